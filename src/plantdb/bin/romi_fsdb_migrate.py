@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Convert the storage of the files metadata of an ``FSDB`` database.
+"""
+import argparse
+
+from plantdb.fsdb import FSDB
+from plantdb.fsdb import migrate_metadata
+
+
+def parsing():
+    parser = argparse.ArgumentParser(
+        description='Save the metadata of all the files of each fileset in a single JSON file, '
+                    'rather than one JSON file per file')
+    parser.add_argument('db_location', metavar='db_location', type=str,
+                        help='Location of the database')
+    parser.add_argument('--per-file', action='store_true',
+                        help='Convert back to one JSON file per file')
+    return parser
+
+
+def run():
+    parser = parsing()
+    args = parser.parse_args()
+    db = FSDB(args.db_location)
+    db.connect()
+    try:
+        count = migrate_metadata(db, consolidated=not args.per_file)
+    finally:
+        db.disconnect()
+    print("Converted %d filesets" % count)
+
+
+if __name__ == '__main__':
+    run()
@@ -47,10 +47,12 @@ def run():
 
     fileset = scan.create_fileset(fileset_id)
     try:
-        for f in os.listdir(folder_path):
-            if os.path.isfile(os.path.join(folder_path, f)):
-                fi = fileset.create_file(os.path.splitext(f)[0])
-                fi.import_file(os.path.join(folder_path, f))
+        # Write the scan's `files.json` once all the files are imported:
+        with scan.batch():
+            for f in os.listdir(folder_path):
+                if os.path.isfile(os.path.join(folder_path, f)):
+                    fi = fileset.create_file(os.path.splitext(f)[0])
+                    fi.import_file(os.path.join(folder_path, f))
     except:
         scan.delete_fileset(fileset_id)
 
@@ -27,6 +27,8 @@ def parsing():
                         help='Local database to serve.')
     parser.add_argument('-prefix', '--db_prefix', type=str, default="",
                         help='Prefix to use with the database.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Reload the scans modified on disk by other processes.')
     return parser
 
 
@@ -240,8 +242,7 @@ class File(Resource):
 class Refresh(Resource):
     def get(self):
         global db
-        db.disconnect()
-        db.connect()
+        db.reload()
         return 200
 
 
@@ -341,6 +342,8 @@ def run():
     global db
     db = DB(db_location)
     db.connect()
+    if args.watch:
+        db.watch()
 
     print("n scans = %i" % len(db.get_scans()))
 
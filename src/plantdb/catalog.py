@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# plantdb - Data handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of plantdb.
+#
+# plantdb is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# plantdb is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with plantdb.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+plantdb.catalog
+===============
+
+Persistent index of the content of an ``FSDB`` database.
+
+The catalog is a SQLite file, stored at the root of the database, referencing every scan, fileset and file ids with
+the file names, sizes & modification times and the metadata attached to each of them.
+Loading a scan from the catalog replaces the parsing of its ``files.json`` and of all its metadata JSON files.
+
+Each scan entry is associated to a *fingerprint* of its ``files.json``, ``metadata.json`` & ``measures.json`` files and
+of the content of its ``metadata`` directory.
+It is used to detect the scans modified on disk without the ``FSDB`` API, these have to be loaded from the JSON files.
+Note that the file metadata JSON files are only checked through their directory: the changes made to one of them
+without the ``FSDB`` API are detected if it is replaced, not if it is written in place.
+
+Examples
+--------
+>>> from plantdb.fsdb import dummy_db
+>>> db = dummy_db(with_file=True)
+>>> db.connect(catalog=True)  # create the catalog file on first connection
+>>> db.disconnect()
+>>> db.connect()  # the scans are now loaded from the catalog
+>>> db.catalog.list_scans()
+['myscan_001']
+>>> db.disconnect()
+
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    measures TEXT
+);
+CREATE TABLE IF NOT EXISTS filesets (
+    scan_id TEXT,
+    id TEXT,
+    position INTEGER
+);
+CREATE INDEX IF NOT EXISTS filesets_scan ON filesets (scan_id);
+CREATE TABLE IF NOT EXISTS files (
+    scan_id TEXT,
+    fileset_id TEXT,
+    id TEXT,
+    filename TEXT,
+    size INTEGER,
+    mtime REAL,
+    position INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_scan ON files (scan_id);
+CREATE TABLE IF NOT EXISTS metadata (
+    scan_id TEXT,
+    fileset_id TEXT,
+    file_id TEXT,
+    data TEXT,
+    PRIMARY KEY (scan_id, fileset_id, file_id)
+);
+"""
+
+
+class Catalog(object):
+    """SQLite index of the scans, filesets & files of a database.
+
+    Attributes
+    ----------
+    path : str
+        Path to the SQLite file.
+
+    Notes
+    -----
+    Scan metadata are stored with empty fileset & file ids, fileset metadata with an empty file id.
+    A single connection is shared by the threads and protected by a lock.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            Path to the SQLite file, created if missing.
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        """Close the connection to the SQLite file."""
+        with self._lock:
+            self._conn.close()
+
+    def list_scans(self):
+        """Get the list of scan ids referenced in the catalog."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM scans ORDER BY rowid").fetchall()
+        return [r[0] for r in rows]
+
+    def get_fingerprint(self, scan_id):
+        """Get the fingerprint of a scan, as set by the last write, ``None`` if unknown.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+
+        Returns
+        -------
+        list or None
+            The fingerprint of the scan.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM scans WHERE id = ?", (scan_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def get_scan(self, scan_id):
+        """Get the structure and metadata of a scan.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+
+        Returns
+        -------
+        dict
+            A dictionary with the "metadata", "measures" & "filesets" of the scan.
+            Filesets are dictionaries with their "id", "metadata" & "files".
+            Files are dictionaries with their "id", "file" (the file name), "size", "mtime" & "metadata".
+        """
+        with self._lock:
+            measures = self._conn.execute("SELECT measures FROM scans WHERE id = ?", (scan_id,)).fetchone()
+            fs_rows = self._conn.execute(
+                "SELECT id FROM filesets WHERE scan_id = ? ORDER BY position", (scan_id,)).fetchall()
+            f_rows = self._conn.execute(
+                "SELECT fileset_id, id, filename, size, mtime FROM files WHERE scan_id = ? ORDER BY position",
+                (scan_id,)).fetchall()
+            md_rows = self._conn.execute(
+                "SELECT fileset_id, file_id, data FROM metadata WHERE scan_id = ?", (scan_id,)).fetchall()
+        metadata = {(fs_id, f_id): json.loads(data) for fs_id, f_id, data in md_rows}
+        filesets = {}
+        for fs_id, in fs_rows:
+            filesets[fs_id] = {"id": fs_id, "metadata": metadata.get((fs_id, ""), {}), "files": []}
+        for fs_id, f_id, filename, size, mtime in f_rows:
+            filesets[fs_id]["files"].append({"id": f_id, "file": filename, "size": size, "mtime": mtime,
+                                             "metadata": metadata.get((fs_id, f_id), {})})
+        return {
+            "metadata": metadata.get(("", ""), {}),
+            "measures": json.loads(measures[0]) if measures is not None and measures[0] is not None else {},
+            "filesets": list(filesets.values())
+        }
+
+    def store_scan(self, scan_id, fingerprint, filesets, metadata, measures):
+        """Replace all the entries of a scan.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+        fingerprint : list
+            The fingerprint of the scan files.
+        filesets : list of dict
+            Filesets as dictionaries with their "id", "metadata" & "files".
+            Files are dictionaries with their "id", "file" (the file name), "path" & "metadata".
+        metadata : dict
+            The scan metadata.
+        measures : dict
+            The scan measures.
+        """
+        with self._lock, self._conn:
+            self._delete_scan(scan_id)
+            self._conn.execute("INSERT INTO scans (id, fingerprint, measures) VALUES (?, ?, ?)",
+                               (scan_id, json.dumps(fingerprint), json.dumps(measures)))
+            self._store_structure(scan_id, filesets, {})
+            md_rows = [(scan_id, "", "", json.dumps(metadata))]
+            for fs in filesets:
+                md_rows.append((scan_id, fs["id"], "", json.dumps(fs["metadata"])))
+                md_rows.extend((scan_id, fs["id"], f["id"], json.dumps(f["metadata"])) for f in fs["files"])
+            self._conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", md_rows)
+
+    def store_structure(self, scan_id, fingerprint, filesets):
+        """Update the filesets and files of a scan, as saved in its ``files.json``.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+        fingerprint : list
+            The fingerprint of the scan files.
+        filesets : list of dict
+            Filesets as dictionaries with their "id" & "files".
+            Files are dictionaries with their "id", "file" (the file name) & "path".
+
+        Notes
+        -----
+        Only the files that are new, or with a new file name, are accessed to get their size & modification time.
+        The files rewritten under the same name must be updated with ``update_file``.
+        The metadata of the filesets and files that are not listed anymore are removed.
+        """
+        with self._lock, self._conn:
+            known = {}
+            rows = self._conn.execute(
+                "SELECT fileset_id, id, filename, size, mtime FROM files WHERE scan_id = ?", (scan_id,))
+            for fs_id, f_id, filename, size, mtime in rows:
+                known[(fs_id, f_id, filename)] = (size, mtime)
+            self._conn.execute("DELETE FROM filesets WHERE scan_id = ?", (scan_id,))
+            self._conn.execute("DELETE FROM files WHERE scan_id = ?", (scan_id,))
+            self._ensure_scan(scan_id)
+            self._conn.execute("UPDATE scans SET fingerprint = ? WHERE id = ?", (json.dumps(fingerprint), scan_id))
+            self._store_structure(scan_id, filesets, known)
+            # Remove the metadata of deleted filesets & files:
+            self._conn.execute(
+                "DELETE FROM metadata WHERE scan_id = ? AND fileset_id != '' AND file_id = '' AND fileset_id NOT IN "
+                "(SELECT id FROM filesets WHERE scan_id = ?)", (scan_id, scan_id))
+            self._conn.execute(
+                "DELETE FROM metadata WHERE scan_id = ? AND file_id != '' AND NOT EXISTS "
+                "(SELECT 1 FROM files WHERE files.scan_id = metadata.scan_id "
+                "AND files.fileset_id = metadata.fileset_id AND files.id = metadata.file_id)", (scan_id,))
+
+    def store_metadata(self, scan_id, fileset_id, file_id, metadata, fingerprint=None):
+        """Update the metadata of a scan, fileset or file.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+        fileset_id : str
+            Id of the fileset, empty for the scan metadata.
+        file_id : str
+            Id of the file, empty for the scan or fileset metadata.
+        metadata : dict
+            The metadata to save.
+        fingerprint : list, optional
+            If set, update the fingerprint of the scan.
+        """
+        with self._lock, self._conn:
+            self._ensure_scan(scan_id)
+            self._conn.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+                               (scan_id, fileset_id, file_id, json.dumps(metadata)))
+            if fingerprint is not None:
+                self._conn.execute("UPDATE scans SET fingerprint = ? WHERE id = ?",
+                                   (json.dumps(fingerprint), scan_id))
+
+    def update_file(self, scan_id, fileset_id, file_id, filename, path):
+        """Update the size & modification time of a file rewritten under the same file name, if referenced.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+        fileset_id : str
+            Id of the fileset.
+        file_id : str
+            Id of the file.
+        filename : str
+            Name of the file, a file referenced under another name is left as is.
+        path : str
+            Path to the file.
+        """
+        size, mtime = _stat(path)
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE files SET size = ?, mtime = ? WHERE scan_id = ? AND fileset_id = ? AND id = ? "
+                               "AND filename = ?", (size, mtime, scan_id, fileset_id, file_id, filename))
+
+    def set_fingerprint(self, scan_id, fingerprint):
+        """Update the fingerprint of a scan, if referenced in the catalog.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+        fingerprint : list
+            The fingerprint of the scan files.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE scans SET fingerprint = ? WHERE id = ?", (json.dumps(fingerprint), scan_id))
+
+    def delete_scan(self, scan_id):
+        """Remove all the entries of a scan.
+
+        Parameters
+        ----------
+        scan_id : str
+            Id of the scan.
+        """
+        with self._lock, self._conn:
+            self._delete_scan(scan_id)
+
+    def prune(self, scan_ids):
+        """Remove the entries of the scans that are not in the given list.
+
+        Parameters
+        ----------
+        scan_ids : list of str
+            Ids of the scans to keep.
+        """
+        scan_ids = set(scan_ids)
+        for scan_id in self.list_scans():
+            if scan_id not in scan_ids:
+                self.delete_scan(scan_id)
+
+    def _ensure_scan(self, scan_id):
+        self._conn.execute("INSERT OR IGNORE INTO scans (id) VALUES (?)", (scan_id,))
+
+    def _delete_scan(self, scan_id):
+        for table in ("filesets", "files", "metadata"):
+            self._conn.execute("DELETE FROM %s WHERE scan_id = ?" % table, (scan_id,))
+        self._conn.execute("DELETE FROM scans WHERE id = ?", (scan_id,))
+
+    def _store_structure(self, scan_id, filesets, known):
+        fs_rows, f_rows = [], []
+        for fs in filesets:
+            fs_rows.append((scan_id, fs["id"], len(fs_rows)))
+            for f in fs["files"]:
+                size, mtime = known.get((fs["id"], f["id"], f["file"])) or _stat(f["path"])
+                f_rows.append((scan_id, fs["id"], f["id"], f["file"], size, mtime, len(f_rows)))
+        self._conn.executemany("INSERT INTO filesets VALUES (?, ?, ?)", fs_rows)
+        self._conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", f_rows)
+
+
+def _stat(path):
+    """Returns the size & modification time of a file, ``None`` if missing."""
+    if path is None:
+        return None, None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime
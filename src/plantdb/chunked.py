@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# plantdb - Data handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of plantdb.
+#
+# plantdb is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# plantdb is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with plantdb.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+plantdb.chunked
+===============
+
+N-D arrays stored by chunks in a fileset, to read and update large volumes piecewise.
+
+The fileset holds a ``header.json`` file, describing the array, and one compressed file per chunk, named after its
+position in the grid of chunks, *e.g.* ``chunk_0_2_1.zlib``.
+The chunks that were never written are not stored and read as the `fill_value` of the array.
+
+A region is read or written with the chunks it overlaps only, and the chunks are compressed and decompressed on a
+thread pool: the ``zlib`` & ``lzma`` compressors release the GIL.
+With a ``plantdb.fsdb.FSDB``, the scan's ``files.json`` is saved once per write, see ``plantdb.fsdb.Scan.batch``.
+
+Examples
+--------
+>>> import numpy as np
+>>> from plantdb.chunked import ChunkedArray
+>>> from plantdb.fsdb import dummy_db
+>>> db = dummy_db()
+>>> db.connect()
+>>> scan = db.create_scan("myscan_001")
+>>> vol = np.arange(64 * 64 * 64, dtype=np.float32).reshape(64, 64, 64)
+>>> arr = ChunkedArray.from_array(scan.create_fileset("volume"), vol, chunks=(32, 32, 32))
+>>> arr.shape, arr.dtype, len(scan.get_fileset("volume").get_files())
+((64, 64, 64), dtype('float32'), 9)
+>>> arr = ChunkedArray(scan.get_fileset("volume"))  # reads 1 chunk out of 8:
+>>> arr.read_region((slice(10, 12), 5, slice(0, 3)))
+array([[41280., 41281., 41282.],
+       [45376., 45377., 45378.]], dtype=float32)
+>>> arr[0, 0, :2] = -1  # updates 1 chunk
+>>> arr[0, 0, :3]
+array([-1., -1.,  2.], dtype=float32)
+>>> db.disconnect()
+
+"""
+
+import itertools
+import lzma
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+from plantdb import io
+
+#: Version of the ``header.json`` format
+FORMAT_VERSION = 1
+#: Id of the file holding the JSON header in the fileset
+HEADER_ID = "header"
+
+#: The chunk compressors, name -> (compress(bytes, level), decompress(bytes))
+_COMPRESSORS = {
+    "none": (lambda data, level: data, bytes),
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+class ChunkedArray(object):
+    """N-D array stored by chunks in a fileset.
+
+    Attributes
+    ----------
+    fileset : plantdb.db.Fileset
+        The fileset holding the header & chunks.
+    shape : tuple of int
+        The shape of the array.
+    dtype : numpy.dtype
+        The data type of the array.
+    chunks : tuple of int
+        The shape of the chunks, the chunks at the end of each dimension may be smaller.
+    compression : str
+        Name of the chunk compressor, one of "zlib" (default), "lzma" or "none".
+    level : int
+        Compression level.
+    fill_value : int or float
+        Value of the elements of the chunks not stored.
+    workers : int or None
+        Maximum number of threads used to (de)compress the chunks, ``None`` to use the ``ThreadPoolExecutor``
+        default.
+    """
+
+    def __init__(self, fileset, workers=None):
+        """
+        Parameters
+        ----------
+        fileset : plantdb.db.Fileset
+            The fileset holding the array, created with ``ChunkedArray.create``.
+        workers : int, optional
+            Maximum number of threads used to (de)compress the chunks.
+
+        Raises
+        ------
+        IOError
+            If the fileset does not hold a chunked array.
+        """
+        header_file = fileset.get_file(HEADER_ID)
+        if header_file is None:
+            raise IOError("The fileset '%s' does not hold a chunked array" % fileset.id)
+        header = io.read_json(header_file)
+        if header.get("format") != FORMAT_VERSION:
+            raise IOError("Unsupported chunked array format '%s' in fileset '%s'" % (header.get("format"), fileset.id))
+        self.fileset = fileset
+        self.shape = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.chunks = tuple(header["chunks"])
+        self.compression = header["compression"]
+        self.level = header["level"]
+        self.fill_value = header["fill_value"]
+        self.workers = workers
+
+    @classmethod
+    def create(cls, fileset, shape, dtype, chunks, compression="zlib", level=1, fill_value=0, workers=None):
+        """Create an empty chunked array in a fileset.
+
+        The chunks of an array previously created in the fileset are deleted.
+
+        Parameters
+        ----------
+        fileset : plantdb.db.Fileset
+            The fileset to hold the array, it should not contain other files.
+        shape : tuple of int
+            The shape of the array.
+        dtype : numpy.dtype or str
+            The data type of the array.
+        chunks : tuple of int
+            The shape of the chunks.
+        compression : {"zlib", "lzma", "none"}, optional
+            Name of the chunk compressor, defaults to "zlib".
+        level : int, optional
+            Compression level, defaults to 1, the fastest.
+        fill_value : int or float, optional
+            Value of the elements never written, defaults to 0.
+        workers : int, optional
+            Maximum number of threads used to (de)compress the chunks.
+
+        Returns
+        -------
+        plantdb.chunked.ChunkedArray
+            The new array.
+
+        Raises
+        ------
+        ValueError
+            If the chunks do not match the shape, or the compressor is unknown.
+        """
+        shape, chunks = tuple(int(n) for n in shape), tuple(int(n) for n in chunks)
+        if len(chunks) != len(shape) or any(n < 1 for n in chunks):
+            raise ValueError("Chunks %s do not match shape %s" % (chunks, shape))
+        if compression not in _COMPRESSORS:
+            raise ValueError("Unknown compression '%s', use one of %s" % (compression, ", ".join(_COMPRESSORS)))
+        dtype = np.dtype(dtype)
+        if dtype.hasobject:
+            raise ValueError("Object arrays cannot be stored by chunks")
+        header = {"format": FORMAT_VERSION, "shape": list(shape), "dtype": dtype.str, "chunks": list(chunks),
+                  "compression": compression, "level": level, "fill_value": dtype.type(fill_value).item()}
+        batch = getattr(fileset.scan, "batch", None)
+        with batch() if batch is not None else nullcontext():
+            for f in list(fileset.get_files()):
+                if f.id.startswith("chunk_"):
+                    fileset.delete_file(f.id)
+            io.write_json(fileset.get_file(HEADER_ID, create=True), header)
+        return cls(fileset, workers=workers)
+
+    @classmethod
+    def from_array(cls, fileset, data, chunks, **kwargs):
+        """Create a chunked array in a fileset from an array.
+
+        Parameters
+        ----------
+        fileset : plantdb.db.Fileset
+            The fileset to hold the array, it should not contain other files.
+        data : array like
+            The array to save.
+        chunks : tuple of int
+            The shape of the chunks.
+        kwargs
+            The other parameters of ``ChunkedArray.create``.
+
+        Returns
+        -------
+        plantdb.chunked.ChunkedArray
+            The new array.
+        """
+        data = np.asanyarray(data)
+        array = cls.create(fileset, data.shape, data.dtype, chunks, **kwargs)
+        array.write_region((), data)
+        return array
+
+    @property
+    def ndim(self):
+        """Number of dimensions of the array."""
+        return len(self.shape)
+
+    def read(self):
+        """Read the whole array.
+
+        Returns
+        -------
+        numpy.ndarray
+            The array.
+        """
+        return self.read_region(())
+
+    def read_region(self, slices):
+        """Read a region of the array, from the chunks it overlaps only.
+
+        Parameters
+        ----------
+        slices : tuple of slice or int
+            The region to read, per dimension, as for numpy basic indexing.
+            The missing trailing dimensions are read in full, the slice steps should be positive.
+
+        Returns
+        -------
+        numpy.ndarray
+            The region of the array.
+
+        Raises
+        ------
+        IndexError
+            If the region is not valid.
+        """
+        bounds, steps, squeezed = self._region(slices)
+        out = np.full(tuple(stop - start for start, stop in bounds), self.fill_value, dtype=self.dtype)
+        chunk_ids = list(self._overlapping_chunks(bounds))
+        for idx, data in zip(chunk_ids, self._map(self._read_chunk, chunk_ids)):
+            if data is not None:
+                chunk_part, out_part = self._intersection(idx, bounds)
+                out[out_part] = data[chunk_part]
+        out = out[tuple(slice(None, None, step) for step in steps)]
+        return out.reshape([n for i, n in enumerate(out.shape) if i not in squeezed])
+
+    def write_region(self, slices, data):
+        """Write a region of the array, only the chunks it overlaps are read and written.
+
+        Parameters
+        ----------
+        slices : tuple of slice or int
+            The region to write, per dimension, as for numpy basic indexing.
+            The missing trailing dimensions are written in full, the slice steps should be 1.
+        data : array like
+            The values to write, broadcast to the shape of the region.
+
+        Raises
+        ------
+        IndexError
+            If the region is not valid.
+        ValueError
+            If `data` cannot be broadcast to the region.
+        """
+        bounds, steps, squeezed = self._region(slices)
+        if any(step != 1 for step in steps):
+            raise IndexError("Only contiguous regions can be written")
+        region_shape = [stop - start for start, stop in bounds]
+        data = np.broadcast_to(np.asarray(data, dtype=self.dtype),
+                               [n for i, n in enumerate(region_shape) if i not in squeezed])
+        data = data.reshape(region_shape)
+
+        def encode(idx):
+            chunk_part, data_part = self._intersection(idx, bounds)
+            chunk_shape = self._chunk_shape(idx)
+            if all(s.stop - s.start == n for s, n in zip(chunk_part, chunk_shape)):
+                chunk = data[data_part]
+            else:  # partial update
+                chunk = self._read_chunk(idx)
+                chunk = np.full(chunk_shape, self.fill_value, self.dtype) if chunk is None else chunk.copy()
+                chunk[chunk_part] = data[data_part]
+            return _COMPRESSORS[self.compression][0](np.ascontiguousarray(chunk).tobytes(), self.level)
+
+        chunk_ids = list(self._overlapping_chunks(bounds))
+        batch = getattr(self.fileset.scan, "batch", None)
+        with batch() if batch is not None else nullcontext():
+            for idx, buffer in zip(chunk_ids, self._map(encode, chunk_ids)):
+                self.fileset.get_file(_chunk_id(idx), create=True).write_raw(buffer, self._chunk_ext())
+
+    def __getitem__(self, slices):
+        return self.read_region(slices)
+
+    def __setitem__(self, slices, data):
+        self.write_region(slices, data)
+
+    def __array__(self, dtype=None):
+        array = self.read()
+        return array if dtype is None else array.astype(dtype)
+
+    def _chunk_ext(self):
+        return "raw" if self.compression == "none" else self.compression
+
+    def _chunk_shape(self, idx):
+        """Returns the shape of a chunk, smaller than `chunks` at the end of the dimensions."""
+        return tuple(min(c, n - i * c) for i, c, n in zip(idx, self.chunks, self.shape))
+
+    def _read_chunk(self, idx):
+        """Returns a chunk as a read-only array, ``None`` if it is not stored."""
+        f = self.fileset.get_file(_chunk_id(idx))
+        if f is None or f.filename is None:
+            return None
+        buffer = _COMPRESSORS[self.compression][1](f.read_raw())
+        return np.frombuffer(buffer, dtype=self.dtype).reshape(self._chunk_shape(idx))
+
+    def _region(self, slices):
+        """Normalize the region to read or write.
+
+        Returns
+        -------
+        list of (int, int)
+            The start & stop of the bounding box of the region, per dimension.
+        list of int
+            The steps of the region, per dimension.
+        set of int
+            The dimensions indexed by an integer, removed from the result.
+        """
+        if not isinstance(slices, tuple):
+            slices = (slices,)
+        if len(slices) > self.ndim:
+            raise IndexError("Too many indices for an array of dimension %d" % self.ndim)
+        slices = slices + (slice(None),) * (self.ndim - len(slices))
+        bounds, steps, squeezed = [], [], set()
+        for dim, (s, n) in enumerate(zip(slices, self.shape)):
+            if isinstance(s, slice):
+                start, stop, step = s.indices(n)
+                if step < 1:
+                    raise IndexError("The slice steps should be positive")
+                stop = max(start, stop)
+                # Bounding box of the selected elements:
+                stop = start + ((stop - start - 1) // step) * step + 1 if stop > start else start
+                bounds.append((start, stop))
+                steps.append(step)
+            else:
+                i = int(s)
+                if not -n <= i < n:
+                    raise IndexError("Index %d is out of bounds for dimension %d with size %d" % (i, dim, n))
+                i = i % n
+                bounds.append((i, i + 1))
+                steps.append(1)
+                squeezed.add(dim)
+        return bounds, steps, squeezed
+
+    def _overlapping_chunks(self, bounds):
+        """Iterate over the indices of the chunks overlapping the bounding box."""
+        if any(start == stop for start, stop in bounds):
+            return iter(())
+        ranges = [range(start // c, (stop - 1) // c + 1) for (start, stop), c in zip(bounds, self.chunks)]
+        return itertools.product(*ranges)
+
+    def _intersection(self, idx, bounds):
+        """Returns the slices of the intersection of a chunk with the bounding box, in the chunk & in the box."""
+        chunk_part, box_part = [], []
+        for i, c, (start, stop) in zip(idx, self.chunks, bounds):
+            origin = i * c
+            lo, hi = max(start, origin), min(stop, origin + c)
+            chunk_part.append(slice(lo - origin, hi - origin))
+            box_part.append(slice(lo - start, hi - start))
+        return tuple(chunk_part), tuple(box_part)
+
+    def _map(self, func, chunk_ids):
+        """Call `func` on each chunk, on a thread pool if there are several chunks."""
+        if len(chunk_ids) < 2 or self.workers == 1:
+            return [func(idx) for idx in chunk_ids]
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(func, chunk_ids))
+
+
+def _chunk_id(idx):
+    """Returns the id of the file of a chunk, from its position in the grid of chunks."""
+    return "chunk_" + "_".join(str(i) for i in idx)
@@ -35,6 +35,8 @@ A ``File`` can be an image, text of bytes.
 
 """
 
+from contextlib import contextmanager
+
 
 class DB(object):
     """Class defining the database object ``DB``.
@@ -125,6 +127,7 @@ class Scan(object):
     id : int
         Id of the scan in the database ``DB``
     """
+    __slots__ = ("db", "id")
 
     def __init__(self, db, id):
         """
@@ -180,13 +183,15 @@ class Scan(object):
         """
         raise NotImplementedError
 
-    def get_metadata(self, key=None):
+    def get_metadata(self, key=None, copy=False):
         """Get metadata associated to scan.
 
         Parameters
         ----------
         key : str
             Metadata key to retrieve (defaults to ``None``)
+        copy : bool
+            Return a mutable copy of the metadata instead of a read-only view (defaults to ``False``)
 
         Returns
         -------
@@ -249,6 +254,7 @@ class Fileset(object):
     scan : db.Scan
         scan containing the set of files
     """
+    __slots__ = ("db", "scan", "id")
 
     def __init__(self, db, scan, id):
         self.db = db
@@ -307,13 +313,15 @@ class Fileset(object):
         """
         raise NotImplementedError
 
-    def get_metadata(self, key=None):
+    def get_metadata(self, key=None, copy=False):
         """Get metadata associated to scan.
 
         Parameters
         ----------
         key : str
             Metadata key to retrieve (defaults to ``None``)
+        copy : bool
+            Return a mutable copy of the metadata instead of a read-only view (defaults to ``False``)
 
         Returns
         -------
@@ -373,6 +381,7 @@ class File(object):
     filename : str
         file format (default = None, can be deduced when importing file)
     """
+    __slots__ = ("db", "fileset", "id", "filename")
 
     def __init__(self, db, fileset, id):
         self.db = db
@@ -416,13 +425,15 @@ class File(object):
         """
         return self.fileset
 
-    def get_metadata(self, key=None):
+    def get_metadata(self, key=None, copy=False):
         """Get metadata associated to scan.
 
         Parameters
         ----------
         key : str, optional
             Metadata key to retrieve (defaults to ``None``)
+        copy : bool, optional
+            Return a mutable copy of the metadata instead of a read-only view (defaults to ``False``)
 
         Returns
         -------
@@ -467,6 +478,33 @@ class File(object):
         """
         raise NotImplementedError
 
+    @contextmanager
+    def open_write(self, ext="", text=False):
+        """Context manager writing the file as a stream.
+
+        The default implementation buffers the data in memory and saves them with ``write_raw`` or ``write`` when the
+        context exits without error.
+
+        Parameters
+        ----------
+        ext : str, optional
+            File extension to use
+        text : bool, optional
+            If ``True``, write text instead of bytes (defaults to ``False``)
+
+        Yields
+        ------
+        io.IOBase
+            A file object to write to.
+        """
+        import io
+        with (io.StringIO() if text else io.BytesIO()) as f:
+            yield f
+            if text:
+                self.write(f.getvalue(), ext)
+            else:
+                self.write_raw(f.getvalue(), ext)
+
     def read_raw(self):
         """Reads bytes from a file.
 
@@ -477,6 +515,51 @@ class File(object):
         """
         raise NotImplementedError
 
+    def open(self):
+        """Open the file for reading.
+
+        The default implementation reads the whole file with ``read_raw``.
+
+        Returns
+        -------
+        io.BufferedIOBase
+            A binary file object, to be closed by the caller.
+        """
+        import io
+        return io.BytesIO(self.read_raw())
+
+    def iter_chunks(self, size=1024 * 1024):
+        """Iterate over the content of the file.
+
+        Parameters
+        ----------
+        size : int, optional
+            Maximum size of the chunks, in bytes (defaults to 1 MiB)
+
+        Yields
+        ------
+        bytes
+            The successive chunks of the file.
+        """
+        with self.open() as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def mmap(self):
+        """Get a read-only view of the content of the file.
+
+        The default implementation reads the whole file with ``read_raw``.
+
+        Returns
+        -------
+        memoryview
+            The read-only content of the file.
+        """
+        return memoryview(self.read_raw())
+
     def write(self, str, ext=""):
         """Writes text to a file.
 
@@ -48,6 +48,7 @@ Assuming that the ``FSDB`` root database directory is ``dbroot/``, there is a ``
     │   └── (measures.json)            # optional manual measurements file
     ├── myscan_002/                    # scan dataset directory, id=`myscan_002`
     :
+    ├── (CATALOG_FILE_NAME)            # optional catalog indexing the database, see `plantdb.catalog`
     ├── (LOCK_FILE_NAME)               # "lock file", present if DB is connected
     └── MARKER_FILE_NAME               # ROMI DB marker file
 
@@ -94,19 +95,46 @@ The metadata of the scan (``metadata.json``), of the set of 'images' files (``<F
 
 import atexit
 import copy
+import ctypes
+import ctypes.util
 import glob
-import json
 import logging
+import marshal
+import mmap
 import os
-from shutil import copyfile
+import socket
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from contextlib import contextmanager
+from shutil import copyfileobj
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the lock file is then always exclusive
+    fcntl = None
 
 from plantdb import db
+from plantdb import jsonio
+from plantdb.catalog import Catalog
 from plantdb.db import DBBusyError
+from plantdb.query import MetadataIndex
+from plantdb.query import compile_query
+from plantdb.watch import Watcher
 
 #: This file must exist in the root of a folder for it to be considered a valid DB
 MARKER_FILE_NAME = "romidb"
-#: This file prevents opening the DB if it is present in the root folder of a DB
+#: This file, locked by the connected processes, prevents opening the DB for writing while it is in use
 LOCK_FILE_NAME = "lock"
+#: This optional file at the root folder of a DB indexes its content, see `plantdb.catalog`
+CATALOG_FILE_NAME = "catalog.sqlite"
+#: This directory at the root folder of a DB holds the lock files of the scans, see `FSDB.lock_scan`
+LOCKS_DIR_NAME = ".locks"
+#: Values of the `fsync` policy of a DB, see `FSDB.connect`
+FSYNC_POLICIES = ("never", "batch", "always")
 
 
 def dummy_db(with_scan=False, with_fileset=False, with_file=False):
@@ -223,6 +251,56 @@ def dummy_db(with_scan=False, with_fileset=False, with_file=False):
     return db
 
 
+def migrate_metadata(db, consolidated=True):
+    """Convert the storage of the files metadata of all the filesets of a database.
+
+    Parameters
+    ----------
+    db : plantdb.fsdb.FSDB
+        The database to convert, it should be connected.
+        With ``scan_locks``, each scan is locked while its filesets are converted.
+    consolidated : bool, optional
+        If ``True`` (default), save the metadata of all the files of a fileset in a single JSON file.
+        Else, save them back in one JSON file per file.
+
+    Returns
+    -------
+    int
+        The number of converted filesets.
+
+    Examples
+    --------
+    >>> import os
+    >>> from plantdb.fsdb import dummy_db, migrate_metadata
+    >>> db = dummy_db(with_file=True)
+    >>> db.connect()
+    >>> migrate_metadata(db)
+    1
+    >>> sorted(os.listdir(os.path.join(db.basedir, "myscan_001", "metadata")))
+    ['fileset_001.files.json', 'fileset_001.json', 'metadata.json']
+    >>> db.disconnect()
+    >>> db.connect()  # both storages are loaded
+    >>> db.get_scan("myscan_001").get_fileset("fileset_001").get_file("test_image").get_metadata()
+    {'random image': True}
+    >>> db.disconnect()
+
+    """
+    count = 0
+    for scan in db.get_scans():
+        lock = db.scan_locks and scan.id not in db._scan_lock_fds
+        if lock:
+            scan = db.lock_scan(scan.id)
+        try:
+            for fileset in scan.get_filesets():
+                if fileset._consolidated != consolidated:
+                    _migrate_fileset_metadata(fileset, consolidated)
+                    count += 1
+        finally:
+            if lock:
+                db.unlock_scan(scan.id)
+    return count
+
+
 class FSDB(db.DB):
     """Implement a local *File System DataBase* version of abstract class ``db.DB``.
 
@@ -230,6 +308,7 @@ class FSDB(db.DB):
       * directory ``${FSDB.basedir}`` as database root directory;
       * marker file ``MARKER_FILE_NAME`` at database root directory;
       * (OPTIONAL) lock file ``LOCK_FILE_NAME`` at database root directory when connected;
+      * (OPTIONAL) catalog file ``CATALOG_FILE_NAME`` at database root directory;
 
     Attributes
     ----------
@@ -237,10 +316,20 @@ class FSDB(db.DB):
         Path to the base directory containing the database
     lock_path : str
         Absolute path to the lock file.
+    catalog : plantdb.catalog.Catalog or None
+        The catalog indexing the database, if any.
+    workers : int
+        Number of threads used to load the scans and the metadata of their files.
+    index : bool
+        If ``True``, the metadata of the scans, filesets and files are indexed to speed up the queries.
     scans : list
-        List of ``Scan`` objects found in the database.
+        List of ``Scan`` objects found in the database, they are also indexed by id to speed up ``get_scan``.
     is_connected : bool
         ``True`` if the database is connected (locked directory), else ``False``.
+    read_only : bool
+        ``True`` if the database is connected in read-only mode, sharing the lock with other readers.
+    scan_locks : bool
+        ``True`` if the writes are locked per scan, sharing the database lock with other processes.
 
     Notes
     -----
@@ -252,6 +341,7 @@ class FSDB(db.DB):
     plantdb.db.DB
     plantdb.fsdb.MARKER_FILE_NAME
     plantdb.fsdb.LOCK_FILE_NAME
+    plantdb.fsdb.CATALOG_FILE_NAME
 
     Examples
     --------
@@ -297,31 +387,143 @@ class FSDB(db.DB):
         # Defines attributes:
         self.basedir = basedir
         self.lock_path = os.path.abspath(os.path.join(basedir, LOCK_FILE_NAME))
+        self._scans_lock = threading.RLock()  # serializes the changes to the list of scans, see `FSDB.reload`
         self.scans = []
         self.is_connected = False
-
-    def connect(self, login_data=None):
+        self.read_only = False
+        self.scan_locks = False
+        self.catalog = None
+        self.workers = 1
+        self.index = False
+        self.fsync = "never"
+        self.consolidated_metadata = False
+        self.compact_json = False
+        self.files_cache = False
+        self.trust = False
+        self._executor = None  # thread pool used to load the files, see `_map_ordered`
+        self._transaction = None  # stack of the scan batches of the current transaction, if any
+        self._deleted_scans = []  # scans to delete when committing the current transaction
+        self._watcher = None  # the thread reloading the scans modified on disk, see `FSDB.watch`
+        self._lock_fd = None  # file descriptor of the locked `LOCK_FILE_NAME`, see `_acquire_lock`
+        self._scan_lock_fds = {}  # scan id -> file descriptor of its lock file, see `FSDB.lock_scan`
+        self._failed_loads = {}  # scan id -> fingerprint of the scan that could not be reloaded, see `FSDB.reload`
+
+    @property
+    def scans(self):
+        return self._scans
+
+    @scans.setter
+    def scans(self, value):
+        scans_by_id = _index_by_id(value)
+        with self._scans_lock:
+            self._scans, self._scans_by_id, self._metadata_index = value, scans_by_id, None
+
+    def _get_metadata_index(self):
+        """Get the index of the scans metadata, ``None`` if the database is not indexed."""
+        index = self._metadata_index
+        if index is None and self.index:
+            scans = self._scans
+            index = MetadataIndex(scans)
+            with self._scans_lock:
+                if self._scans is scans:  # the scans may have been replaced by `reload` meanwhile
+                    self._metadata_index = index
+        return index
+
+    def connect(self, login_data=None, lazy=False, catalog=None, workers=1, index=False, read_only=False,
+                scan_locks=False, fsync="never", consolidated_metadata=False, compact_json=False,
+                files_cache=False, trust=False, force=False):
         """Connect to the local database.
 
-        Handle DB "locking" system by adding a `LOCK_FILE_NAME` file in the DB.
+        Handle DB "locking" system by locking a `LOCK_FILE_NAME` file in the DB.
+        A writer holds an exclusive lock, while the readers share the lock between them.
 
         Parameters
         ----------
         login_data : bool
             UNUSED
+        lazy : bool, optional
+            If ``True``, the ``Scan`` objects are only created from the listing of the database directory.
+            Their filesets, files, metadata & measures are loaded the first time they are accessed.
+            Default is ``False``, load everything on connection.
+        catalog : bool, optional
+            If ``True``, use the catalog file ``CATALOG_FILE_NAME`` to load the scans, create it if missing.
+            If ``False``, do not use it and remove it as it would not be kept up-to-date.
+            By default, use the catalog if the file exists.
+        workers : int, optional
+            Number of threads used to load the scans, and the metadata of the files inside them, concurrently.
+            The loaded scans, filesets and files are in the same order as with the default sequential loading.
+            Defaults to ``1``.
+        index : bool, optional
+            If ``True``, index the metadata of the scans, filesets and files to speed up the queries.
+            The indexes are built when the scans are loaded and maintained by the ``set_metadata`` methods.
+            With a lazy connection, the index of the scans metadata is built on the first query of the scans: it
+            needs the metadata of all the scans, so this query loads all of them.
+            Defaults to ``False``.
+        read_only : bool, optional
+            If ``True``, connect as a reader: other processes may connect in read-only mode at the same time,
+            and the methods modifying the database raise an ``IOError``.
+            Defaults to ``False``, connect as the single writer.
+        scan_locks : bool, optional
+            If ``True``, connect as one of the writers locking the scans they modify, see ``FSDB.lock_scan``.
+            Other processes may connect in read-only or "scan locks" mode at the same time.
+            Defaults to ``False``, connect as the single writer.
+        fsync : {"never", "batch", "always"}, optional
+            When to flush the JSON files to the disk, they are always written to a temporary file and renamed into
+            place so that a crash never leaves a truncated file.
+            With ``"batch"``, the files written by a ``Scan.batch`` or ``FSDB.transaction`` are flushed at once when
+            it is committed.
+            With ``"always"``, the files written outside of a batch are also flushed one by one.
+            Defaults to ``"never"``, let the operating system flush the files.
+        consolidated_metadata : bool, optional
+            If ``True``, save the metadata of all the files of a fileset in a single JSON file, rather than one JSON
+            file per file, see ``migrate_metadata`` to convert all the filesets at once.
+            The filesets already using a single JSON file keep using it in any case.
+            The whole file is written by each ``File.set_metadata``, use a ``Scan.batch`` to write it only once.
+            Defaults to ``False``.
+        compact_json : bool, optional
+            If ``True``, write the ``files.json`` of the scans, and the single JSON files of the files metadata, without
+            indentation: they are smaller and faster to write & parse, but hard to read.
+            The other metadata JSON files are always indented.
+            Defaults to ``False``.
+        files_cache : bool, optional
+            If ``True``, keep a binary copy of the ``files.json`` of each scan, ``files.bin``, faster to load.
+            The binary copy is read instead of ``files.json`` as long as it is up-to-date, even if this option is not
+            set, and ``files.json`` stays the reference: it is used when modified by other tools.
+            Defaults to ``False``.
+        trust : bool, optional
+            If ``True``, do not check that the fileset directories & files listed in the ``files.json`` of the scans
+            exist, the missing files are only detected when they are read.
+            Else, each directory is listed once and the missing filesets & files are removed, or skipped when the
+            scan cannot be written.
+            The scans loaded from the catalog are never checked.
+            Defaults to ``False``.
+        force : bool, optional
+            If ``True``, take over an empty lock file that no process holds, see the notes.
+            Only use it if no other process is using the database.
+            Defaults to ``False``.
 
         Raises
         ------
         IOError
             If the given `basedir` is not an existing directory.
             If the `MARKER_FILE_NAME` is missing from the `basedir`.
+        ValueError
+            If `fsync` is not one of the `FSYNC_POLICIES`.
         DBBusyError
-            If the `LOCK_FILE_NAME` lock fil is found in the `basedir`.
+            If the database is locked by a writer, or by other processes when connecting as the single writer.
+
+        Notes
+        -----
+        The lock file contains the host name & PID of the writer.
+        It is considered stale, and taken over, if no process holds the lock anymore and this writer is not running.
+        An empty lock file that no process holds is created by the older versions of plantdb, or left by a reader that
+        crashed: the database is considered busy unless `force` is set.
 
         See Also
         --------
         plantdb.fsdb.MARKER_FILE_NAME
         plantdb.fsdb.LOCK_FILE_NAME
+        plantdb.fsdb.CATALOG_FILE_NAME
 
         Examples
         --------
@@ -334,6 +536,21 @@ class FSDB(db.DB):
         >>> print(db.is_connected)
         True
         >>> db.disconnect()
+        >>> # Lazy connection only list the scans, they are loaded on first access:
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect(lazy=True)
+        >>> scan = db.get_scan("myscan_001")
+        >>> scan.list_filesets()  # load the scan's filesets, files, metadata & measures
+        ['fileset_001']
+        >>> db.disconnect()
+        >>> # Read-only connections can be shared:
+        >>> reader = FSDB(db.basedir)
+        >>> reader.connect(read_only=True)
+        >>> db.connect(read_only=True)
+        >>> db.get_scan("myscan_001").create_fileset("fileset_002")
+        OSError: The database '/tmp/romidb_********' is connected in read-only mode
+        >>> db.disconnect()
+        >>> reader.disconnect()
 
         """
         # Check the given path to root directory of the database is a directory:
@@ -344,22 +561,42 @@ class FSDB(db.DB):
             raise IOError(
                 "Not a DB. Check that there is a marker named %s in %s" % (
                     MARKER_FILE_NAME, self.basedir))
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy '%s', use one of %s" % (fsync, ", ".join(FSYNC_POLICIES)))
         if not self.is_connected:
+            if scan_locks and fcntl is None:
+                raise IOError("Scan locks are not supported on this platform")
+            shared = read_only or scan_locks
+            self._lock_fd = _acquire_lock(self.lock_path, shared=shared, force=force)
             try:
-                with open(self.lock_path, "x") as _:
-                    self.scans = _load_scans(self)
-                    self.is_connected = True
-                atexit.register(self.disconnect)
-            except FileExistsError:
-                raise DBBusyError(
-                    "File %s exists in DB root: DB is busy, cannot connect." % LOCK_FILE_NAME)
+                self.read_only = read_only
+                self.scan_locks = scan_locks and not read_only
+                self.catalog = _open_catalog(self, catalog)
+                self.workers = workers
+                self.index = index
+                self.fsync = fsync
+                self.consolidated_metadata = consolidated_metadata
+                self.compact_json = compact_json
+                self.files_cache = files_cache
+                self.trust = trust
+                if workers > 1:
+                    self._executor = ThreadPoolExecutor(workers)
+                self.scans = _load_scans(self, lazy=lazy)
+                if index and not lazy:
+                    self._get_metadata_index()
+                self.is_connected = True
+            except:
+                _release_lock(self._lock_fd, self.lock_path, shared=shared)
+                self._lock_fd = None
+                raise
+            atexit.register(self.disconnect)
         else:
             print(f"Already connected to the database '{self.basedir}'")
 
     def disconnect(self):
         """Disconnect from the local database.
 
-        Handle DB "locking" system by removing the `LOCK_FILE_NAME` file from the DB.
+        Handle DB "locking" system by unlocking the `LOCK_FILE_NAME` file, removed if no other reader holds it.
 
         Raises
         ------
@@ -381,26 +618,191 @@ class FSDB(db.DB):
 
         """
         if self.is_connected:
+            if self._watcher is not None:
+                self._watcher.stop()
+                self._watcher = None
+            for scan_id in list(self._scan_lock_fds):
+                self.unlock_scan(scan_id)
             for s in self.scans:
                 s._erase()
+            if self.catalog is not None:
+                self.catalog.close()
+                self.catalog = None
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
             if _is_safe_to_delete(self.lock_path):
-                os.remove(self.lock_path)
+                _release_lock(self._lock_fd, self.lock_path, shared=self.read_only or self.scan_locks)
+                self._lock_fd = None
                 atexit.unregister(self.disconnect)
             else:
                 raise IOError(
                     "Could not remove lock, maybe you messed with the lock_path attribute?")
             self.scans = []
             self.is_connected = False
+            self.read_only = False
+            self.scan_locks = False
         else:
             print(f"Already disconnected from the database '{self.basedir}'")
 
+    def reload(self, ids=None):
+        """Reload the scans added, modified or removed on disk since they were loaded.
+
+        A scan is considered modified if the modification time or the size of its ``files.json``, ``metadata.json``
+        or ``measures.json`` file, or of an entry of its ``metadata`` directory, changed: only these scans are loaded
+        again.
+        The list of scans is replaced once all the new scans are loaded,
+        so the concurrent readers never see a partially loaded database.
+
+        Parameters
+        ----------
+        ids : list of str, optional
+            If set, only check these scans, else check all the directories of the database.
+
+        Returns
+        -------
+        list of str
+            The sorted ids of the scans that were added, modified or removed.
+
+        Raises
+        ------
+        IOError
+            If the database is not connected or if a transaction is in progress.
+
+        Notes
+        -----
+        Like the catalog, the changes made to a file metadata file without the ``FSDB`` API are only detected if the
+        file is replaced, not if it is written in place.
+        The ``Scan`` instances of the modified scans are replaced: the ones obtained before the reload are stale, they
+        keep their previous content and are no longer part of the database. Get them again with ``get_scan``.
+        The new scans are added at the end of the list of scans.
+        A scan that cannot be loaded, e.g. with an invalid ``files.json``, is logged and left as it was, or out of the
+        database if it is new, while the other scans are reloaded. It is loaded again once its files are modified.
+        The reloads, and the creations or deletions of scans, made from several threads are serialized.
+
+        See Also
+        --------
+        plantdb.fsdb.FSDB.watch
+
+        Examples
+        --------
+        >>> import os
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_fileset=True)
+        >>> db.connect()
+        >>> os.makedirs(os.path.join(db.basedir, "myscan_002"))
+        >>> with open(os.path.join(db.basedir, "myscan_002", "files.json"), "w") as f:
+        ...     _ = f.write('{"filesets": []}')
+        >>> db.reload()
+        ['myscan_002']
+        >>> db.list_scans()
+        ['myscan_001', 'myscan_002']
+        >>> db.disconnect()
+
+        """
+        with self._scans_lock:
+            return self._reload(ids)
+
+    def _reload(self, ids):
+        """Reload the modified scans, see `reload`. Called with the `_scans_lock` held."""
+        if not self.is_connected:
+            raise IOError("Not connected to the database '%s'" % self.basedir)
+        if self._transaction is not None:
+            raise IOError("Cannot reload the database during a transaction")
+        scans_by_id = self._scans_by_id
+        if ids is None:
+            ids = os.listdir(self.basedir)
+            updates = dict.fromkeys(set(scans_by_id) - set(ids))  # removed scans
+        else:
+            updates = {}
+        for id in ids:
+            scan = scans_by_id.get(id)
+            if scan is not None and (not scan._is_loaded or scan._fingerprint == _scan_fingerprint(scan)):
+                continue
+            scan = Scan(self, id)
+            if _is_scan_dir(scan):
+                if id in self._failed_loads and self._failed_loads[id] == _scan_fingerprint(scan):
+                    continue  # still broken, retried once modified again
+                scan._is_loaded = False
+                updates[id] = scan
+            elif id in scans_by_id:
+                updates[id] = None
+        if not updates:
+            return []
+        added = [scan for scan in updates.values() if scan is not None]
+        for scan, loaded in zip(added, _load_scans_content(self, added, load=_try_load_scan)):
+            if loaded:
+                self._failed_loads.pop(scan.id, None)
+            else:
+                # Keep the previous state of the scan, or leave it out if it is new:
+                self._failed_loads[scan.id] = scan._fingerprint
+                del updates[scan.id]
+        added = [scan for scan in added if scan.id in updates]
+        if not updates:
+            return []
+        scans = [updates.get(scan.id, scan) for scan in self.scans]
+        scans = [scan for scan in scans if scan is not None]
+        scans += [scan for scan in added if scan.id not in scans_by_id]
+        if self.catalog is not None and not self.read_only:
+            self.catalog.prune([scan.id for scan in scans])
+        indexed = self._metadata_index is not None
+        self.scans = scans
+        if indexed:  # else built on the next query, a lazy connection keeps its scans unloaded until then
+            self._get_metadata_index()
+        return sorted(updates)
+
+    def watch(self, delay=1.0, polling=None, **kwargs):
+        """Start a thread reloading the scans modified on disk by other processes.
+
+        Parameters
+        ----------
+        delay : float, optional
+            Time to wait without any new change before reloading the modified scans, in seconds.
+        polling : bool, optional
+            If ``True``, check the whole database periodically instead of using *inotify*.
+            By default, *inotify* is used when available.
+
+        Other Parameters
+        ----------------
+        max_delay : float
+            Maximum time to wait before reloading the modified scans, if the changes keep coming, in seconds.
+        interval : float
+            Time between two checks of the whole database when polling, in seconds.
+
+        Returns
+        -------
+        plantdb.watch.Watcher
+            The running watcher, it is stopped on disconnection.
+
+        Raises
+        ------
+        IOError
+            If the database is not connected.
+
+        Notes
+        -----
+        The scans are reloaded in the thread of the watcher, by ``reload``: the ``Scan`` instances obtained before a
+        reload may become stale at any time, get them again with ``get_scan`` when needed.
+
+        See Also
+        --------
+        plantdb.watch
+        plantdb.fsdb.FSDB.reload
+        """
+        if not self.is_connected:
+            raise IOError("Not connected to the database '%s'" % self.basedir)
+        if self._watcher is None:
+            self._watcher = Watcher(self, delay=delay, polling=polling, **kwargs)
+            self._watcher.start()
+        return self._watcher
+
     def get_scans(self, query=None):
         """Get the list of `Scan` instances defined in the local database, possibly filtered using a `query`.
 
         Parameters
         ----------
         query : dict, optional
-            Query to use to get a list of scans.
+            Query to use to get a list of scans, see ``plantdb.query``.
 
         Returns
         -------
@@ -423,7 +825,7 @@ class FSDB(db.DB):
         """
         if query is None:
             return self.scans
-        return _filter_query(self.scans, query)
+        return _filter_query(self.scans, query, self._get_metadata_index())
 
     def get_scan(self, id, create=False):
         """Get or create a `Scan` instance in the local database.
@@ -459,12 +861,10 @@ class FSDB(db.DB):
         >>> db.disconnect()
 
         """
-        ids = [f.id for f in self.scans]
-        if id not in ids:
-            if create:
-                return self.create_scan(id)
-            return None
-        return self.scans[ids.index(id)]
+        scan = self._scans_by_id.get(id)
+        if scan is None and create:
+            return self.create_scan(id)
+        return scan
 
     def create_scan(self, id):
         """Create a new `Scan` instance in the local database.
@@ -501,13 +901,26 @@ class FSDB(db.DB):
         >>> db.disconnect()
 
         """
+        _check_writable(self)
         if not _is_valid_id(id):
             raise IOError("Invalid id")
         if self.get_scan(id) != None:
             raise IOError("Duplicate scan name: %s" % id)
         scan = Scan(self, id)
-        _make_scan(scan)
-        self.scans.append(scan)
+        with _scans_lock(self):
+            if self.scan_locks and os.path.exists(_scan_path(scan)):
+                raise IOError("Duplicate scan name: %s" % id)  # created by another process
+            _make_scan(scan)
+            if self.scan_locks:
+                self._scan_lock_fds[id] = _acquire_lock(_scan_lock_path(self, id))
+        scan._fingerprint = _scan_fingerprint(scan)
+        with self._scans_lock:
+            self.scans.append(scan)
+            self._scans_by_id[id] = scan
+            if self._metadata_index is not None:
+                self._metadata_index.add(scan)
+        if self._transaction is not None:
+            self._transaction.enter_context(scan.batch())
         return scan
 
     def delete_scan(self, id):
@@ -545,11 +958,151 @@ class FSDB(db.DB):
         >>> db.disconnect()
 
         """
+        _check_writable(self)
         scan = self.get_scan(id)
         if scan is None:
             raise IOError("Invalid id")
-        _delete_scan(scan)
-        self.scans.remove(scan)
+        _check_writable(self, scan)
+        if self._transaction is not None:
+            self._deleted_scans.append(scan)
+        else:
+            _delete_scan(scan)
+        with self._scans_lock:
+            _remove_by_id(self.scans, self._scans_by_id, scan)
+            if self._metadata_index is not None:
+                self._metadata_index.remove(scan)
+
+    def lock_scan(self, id):
+        """Lock a scan for writing, required to modify it when connected with ``scan_locks=True``.
+
+        The scan is reloaded if it was modified by another process, the lock is held until ``unlock_scan`` is called
+        or the database is disconnected.
+
+        Parameters
+        ----------
+        id : str
+            The id of the scan to lock.
+
+        Returns
+        -------
+        plantdb.fsdb.Scan
+            The locked scan, up-to-date with its content on disk.
+
+        Raises
+        ------
+        IOError
+            If the scan does not exist.
+        DBBusyError
+            If the scan is locked by another process.
+
+        Notes
+        -----
+        When connected as the single writer, the whole database is already locked and this simply returns the scan.
+        The scans created with ``create_scan`` are locked by their creator.
+        The scan may be replaced by a new instance when it is reloaded: only the returned scan, and its filesets &
+        files, can be modified, the ones obtained before raise an ``IOError``.
+
+        Examples
+        --------
+        >>> from plantdb.fsdb import dummy_db
+        >>> from plantdb.fsdb import FSDB
+        >>> db = dummy_db(with_fileset=True)
+        >>> db.connect(scan_locks=True)
+        >>> other = FSDB(db.basedir)
+        >>> other.connect(scan_locks=True)
+        >>> scan = db.lock_scan("myscan_001")
+        >>> scan.set_metadata("test", 1)
+        >>> other.get_scan("myscan_001").set_metadata("test", 2)
+        OSError: Scan 'myscan_001' is not locked, see `FSDB.lock_scan`
+        >>> other.lock_scan("myscan_001")
+        DBBusyError: File /tmp/romidb_********/.locks/myscan_001.lock is locked by ********:****: DB is busy.
+        >>> db.unlock_scan("myscan_001")
+        >>> other.lock_scan("myscan_001").get_metadata("test")  # reloaded with the changes made by `db`
+        1
+        >>> other.disconnect()
+        >>> db.disconnect()
+
+        """
+        _check_writable(self)
+        if self.scan_locks and id not in self._scan_lock_fds:
+            self._scan_lock_fds[id] = _acquire_lock(_scan_lock_path(self, id))
+            try:
+                self.reload([id])
+            except:
+                self.unlock_scan(id)
+                raise
+        scan = self.get_scan(id)
+        if scan is None:
+            self.unlock_scan(id)
+            raise IOError("Invalid id")
+        return scan
+
+    def unlock_scan(self, id):
+        """Release the lock taken on a scan by ``lock_scan``.
+
+        Parameters
+        ----------
+        id : str
+            The id of the scan to unlock.
+        """
+        fd = self._scan_lock_fds.pop(id, None)
+        if fd is not None:
+            _release_lock(fd, _scan_lock_path(self, id))
+
+    @contextmanager
+    def transaction(self):
+        """Context manager deferring the writes to all the scans of the database until it exits.
+
+        Each scan of the database is put in "batch" mode, see ``Scan.batch``.
+        The deletions of scans are also deferred to the commit.
+        If an exception is raised in the context, the in-memory state of the database is rolled back and the
+        deferred writes are discarded.
+
+        Notes
+        -----
+        The state of each scan is saved before its first modification in the context, to be able to roll it back: the
+        scans left unchanged are not copied.
+
+        See Also
+        --------
+        plantdb.fsdb.Scan.batch
+
+        Examples
+        --------
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect()
+        >>> with db.transaction():
+        ...     scan = db.create_scan("007")
+        ...     fs = scan.create_fileset("fs_007")
+        ...     for i in range(10):
+        ...         fs.create_file(f"file_{i}").write(str(i), "txt")
+        >>> db.list_scans()
+        ['myscan_001', '007']
+        >>> db.disconnect()
+
+        """
+        if self._transaction is not None:
+            # Nested transaction, the outer one is in charge of the commit
+            yield self
+            return
+        scans = list(self.scans)
+        self._transaction = ExitStack()
+        try:
+            # The JSON files of all the scans are replaced, and flushed, together:
+            with _group_writes(), self._transaction:
+                for scan in scans:
+                    self._transaction.enter_context(scan.batch())
+                yield self
+        except BaseException:
+            self.scans = scans
+            raise
+        else:
+            for scan in self._deleted_scans:
+                _commit_delete_scan(scan)
+        finally:
+            self._transaction = None
+            self._deleted_scans = []
 
     def path(self) -> str:
         """Get the path to the local database root directory.
@@ -598,12 +1151,15 @@ class Scan(db.Scan):
     metadata : dict
         Dictionary of metadata attached to the scan.
     filesets : list of plantdb.fsdb.Fileset
-        List of ``Fileset`` objects.
+        List of ``Fileset`` objects, they are also indexed by id to speed up ``get_fileset``.
 
     Notes
     -----
     Optional directory ``metadata`` & JSON file ``metadata.json`` are found when using method ``set_metadata()``.
 
+    When the database is connected with ``lazy=True``, the ``filesets``, ``metadata`` & ``measures`` attributes are
+    loaded from the disk the first time one of them is accessed.
+
     See Also
     --------
     plantdb.db.Scan
@@ -655,6 +1211,8 @@ class Scan(db.Scan):
     None
 
     """
+    __slots__ = ("_metadata", "_measures", "_filesets", "_filesets_by_id", "_metadata_index", "_is_loaded", "_is_loading",
+                 "_load_lock", "_batch", "_fingerprint")
 
     def __init__(self, db, id):
         """Scan dataset constructor.
@@ -668,15 +1226,78 @@ class Scan(db.Scan):
         """
         super().__init__(db, id)
         # Defines attributes:
-        self.metadata = None
-        self.measures = None
+        self._metadata = None
+        self._measures = None
         self.filesets = []
+        self._is_loaded = True  # set to ``False`` by a lazy connection, see `_load_scans`
+        self._is_loading = False
+        self._load_lock = threading.RLock()
+        self._batch = None  # the current batch of deferred writes, see `Scan.batch`
+        self._fingerprint = None  # fingerprint of the scan JSON files when last loaded or written, see `FSDB.reload`
+
+    @property
+    def metadata(self):
+        self._load()
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
+    @property
+    def measures(self):
+        self._load()
+        return self._measures
+
+    @measures.setter
+    def measures(self, value):
+        self._measures = value
+
+    @property
+    def filesets(self):
+        self._load()
+        return self._filesets
+
+    @filesets.setter
+    def filesets(self, value):
+        self._filesets = value
+        self._filesets_by_id = _index_by_id(value)
+        self._metadata_index = None
+
+    def _get_metadata_index(self):
+        """Get the index of the filesets metadata, ``None`` if the database is not indexed."""
+        if self._metadata_index is None and self.db.index:
+            self._metadata_index = MetadataIndex(self.filesets)
+        return self._metadata_index
+
+    def _load(self):
+        """Load the filesets, metadata & measures of the scan if it was not done yet."""
+        if self._is_loaded:
+            return
+        # Other threads wait for the scan to be loaded:
+        with self._load_lock:
+            # Return when re-entering as `_load_scan_filesets` may access the filesets to delete broken ones
+            if self._is_loaded or self._is_loading:
+                return
+            self._is_loading = True
+            try:
+                _load_scan(self)
+            except:
+                # Left unloaded, so the next access raises again instead of seeing (and writing) an empty scan:
+                self._metadata, self._measures, self.filesets = None, None, []
+                raise
+            else:
+                self._is_loaded = True
+            finally:
+                self._is_loading = False
 
     def _erase(self):
-        for f in self.filesets:
-            f._erase()
-        del self.metadata
-        del self.filesets
+        if self._is_loaded:
+            for f in self._filesets:
+                f._erase()
+        self._is_loaded = True  # do not load an erased scan
+        self._metadata = None
+        self.filesets = None
 
     def get_filesets(self, query=None):
         """Get the list of `Fileset` instances defined in the current scan dataset, possibly filtered using a `query`.
@@ -684,7 +1305,7 @@ class Scan(db.Scan):
         Parameters
         ----------
         query : dict, optional
-            Query to use to get a list of filesets.
+            Query to use to get a list of filesets, see ``plantdb.query``.
 
         Returns
         -------
@@ -708,7 +1329,7 @@ class Scan(db.Scan):
         """
         if query is None:
             return self.filesets  # Copy?
-        return _filter_query(self.filesets, query)
+        return _filter_query(self.filesets, query, self._get_metadata_index())
 
     def get_fileset(self, id, create=False):
         """Get or create a `Fileset` instance, of given `id`, in the current scan dataset.
@@ -750,20 +1371,22 @@ class Scan(db.Scan):
         >>> db.disconnect()
 
         """
-        ids = [f.id for f in self.filesets]
-        if id not in ids:
-            if create:
-                return self.create_fileset(id)
-            return None
-        return self.filesets[ids.index(id)]
-
-    def get_metadata(self, key=None):
+        self._load()
+        fileset = self._filesets_by_id.get(id)
+        if fileset is None and create:
+            return self.create_fileset(id)
+        return fileset
+
+    def get_metadata(self, key=None, copy=False):
         """Get the metadata associated to a scan.
 
         Parameters
         ----------
         key : str
             A key that should exist in the scan's metadata.
+        copy : bool, optional
+            If ``True``, returns a mutable deep copy of the metadata.
+            Else, returns read-only views of the dictionaries & lists (default).
 
         Returns
         -------
@@ -772,15 +1395,18 @@ class Scan(db.Scan):
             Else, returns the value attached to this key.
 
         """
-        return _get_metadata(self.metadata, key)
+        return _get_metadata(self.metadata, key, copy)
 
-    def get_measures(self, key=None):
+    def get_measures(self, key=None, copy=False):
         """Get the manual measurements associated to a scan.
 
         Parameters
         ----------
         key : str
             A key that should exist in the scan's manual measurements.
+        copy : bool, optional
+            If ``True``, returns a mutable deep copy of the measures.
+            Else, returns read-only views of the dictionaries & lists (default).
 
         Returns
         -------
@@ -794,7 +1420,7 @@ class Scan(db.Scan):
         It is located at the root folder of the scan dataset.
 
         """
-        return _get_measures(self.measures, key)
+        return _get_measures(self.measures, key, copy)
 
     def set_metadata(self, data, value=None):
         """Add a new metadata to the scan.
@@ -807,9 +1433,10 @@ class Scan(db.Scan):
             Value to attach to this metadata. Should be transformable to JSON.
 
         """
+        _check_writable(self.db, self)
         if self.metadata == None:
             self.metadata = {}
-        _set_metadata(self.metadata, data, value)
+        _set_indexed_metadata(self, self.db._metadata_index, data, value)
         _store_scan_metadata(self)
 
     def create_fileset(self, id):
@@ -852,6 +1479,7 @@ class Scan(db.Scan):
         >>> db.disconnect()
 
         """
+        _check_writable(self.db, self)
         if not _is_valid_id(id):
             raise IOError("Invalid id")
         if self.get_fileset(id) != None:
@@ -859,12 +1487,69 @@ class Scan(db.Scan):
         fileset = Fileset(self.db, self, id)
         _make_fileset(fileset)
         self.filesets.append(fileset)
+        self._filesets_by_id[id] = fileset
+        if self._metadata_index is not None:
+            self._metadata_index.add(fileset)
         self.store()
         return fileset
 
     def store(self):
-        """Save changes to the scan's JSON."""
-        _store_scan(self)
+        """Save changes to the scan's JSON.
+
+        In "batch" mode, the JSON is saved when the batch is committed.
+        """
+        _check_writable(self.db, self)
+        if self._batch is not None:
+            self._batch.store = True
+        else:
+            _store_scan(self)
+
+    @contextmanager
+    def batch(self):
+        """Context manager deferring the writes of the scan's JSON and metadata until it exits.
+
+        Within this context, the scan's ``files.json`` and the metadata JSON files are written once, when the
+        context exits.
+        The deletions of filesets and files are also deferred.
+        If an exception is raised in the context, the in-memory state of the scan is rolled back and the deferred
+        writes are discarded.
+
+        Notes
+        -----
+        The data written by ``File.write``, ``File.write_raw`` or ``File.import_file`` are not deferred.
+        The deferred deletions keep the paths reused by the filesets & files created again in the batch with the same
+        ids.
+        The state of the scan is saved before its first modification in the context, to be able to roll it back.
+
+        Examples
+        --------
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect()
+        >>> scan = db.get_scan("myscan_001")
+        >>> with scan.batch():
+        ...     fs = scan.create_fileset("fs_007")
+        ...     for i in range(100):
+        ...         f = fs.create_file(f"file_{i}")  # `files.json` is not written yet...
+        ...         f.write(str(i), "txt")
+        ...         f.set_metadata("index", i)  # ...nor the metadata
+        >>> len(fs.get_files())
+        100
+        >>> db.disconnect()
+
+        """
+        if self._batch is not None:
+            # Nested batch, the outer one is in charge of the commit
+            yield self
+            return
+        batch = self._batch = _Batch(self)
+        try:
+            yield self
+        except BaseException:
+            self._batch = None
+            batch.rollback()
+            raise
+        batch.commit()
 
     def delete_fileset(self, fileset_id):
         """Delete a given fileset from the scan dataset.
@@ -888,12 +1573,16 @@ class Scan(db.Scan):
         >>> db.disconnect()
 
         """
+        _check_writable(self.db, self)
         fs = self.get_fileset(fileset_id)
         if fs is None:
             logging.warning(f"Could not get the Fileset to delete: '{fileset_id}'!")
             return
-        _delete_fileset(fs)
-        self.filesets.remove(fs)
+        if not _defer(self, _commit_delete_fileset, fs):
+            _delete_fileset(fs)
+        _remove_by_id(self.filesets, self._filesets_by_id, fs)
+        if self._metadata_index is not None:
+            self._metadata_index.remove(fs)
         self.store()
 
     def path(self) -> str:
@@ -948,18 +1637,42 @@ class Fileset(db.Fileset):
     metadata : dict
         Dictionary of metadata attached to the fileset.
     files : list of plantdb.fsdb.File
-        List of `File` objects.
+        List of `File` objects, they are also indexed by id to speed up ``get_file``.
+
+    Notes
+    -----
+    The metadata of the files are either stored in one JSON file per file, in the directory
+    ``${FSDB.basedir}/${FSDB.scan.id}/metadata/${Fileset.id}``, or all together in the JSON file
+    ``${FSDB.basedir}/${FSDB.scan.id}/metadata/${Fileset.id}.files.json``, see ``FSDB.connect``.
 
     See Also
     --------
     plantdb.db.Fileset
 
     """
+    __slots__ = ("metadata", "_files", "_files_by_id", "_metadata_index", "_consolidated")
 
     def __init__(self, db, scan, id):
         super().__init__(db, scan, id)
         self.metadata = None
         self.files = []
+        self._consolidated = False  # the files metadata are saved in a single JSON file
+
+    @property
+    def files(self):
+        return self._files
+
+    @files.setter
+    def files(self, value):
+        self._files = value
+        self._files_by_id = _index_by_id(value)
+        self._metadata_index = None
+
+    def _get_metadata_index(self):
+        """Get the index of the files metadata, ``None`` if the database is not indexed."""
+        if self._metadata_index is None and getattr(self.db, "index", False):
+            self._metadata_index = MetadataIndex(self.files)
+        return self._metadata_index
 
     def _erase(self):
         for f in self.files:
@@ -973,7 +1686,7 @@ class Fileset(db.Fileset):
         Parameters
         ----------
         query : dict, optional
-            Query to use to get a list of files.
+            Query to use to get a list of files, see ``plantdb.query``.
 
         Returns
         -------
@@ -1000,7 +1713,7 @@ class Fileset(db.Fileset):
         """
         if query is None:
             return self.files
-        return _filter_query(self.files, query)
+        return _filter_query(self.files, query, self._get_metadata_index())
 
     def get_file(self, id, create=False):
         """Get or create a `File` instance, of given `id`, in the current fileset.
@@ -1032,20 +1745,21 @@ class Fileset(db.Fileset):
         >>> db.disconnect()
 
         """
-        ids = [f.id for f in self.files]
-        if id not in ids:
-            if create:
-                return self.create_file(id)
-            return None
-        return self.files[ids.index(id)]
-
-    def get_metadata(self, key=None):
+        file = self._files_by_id.get(id)
+        if file is None and create:
+            return self.create_file(id)
+        return file
+
+    def get_metadata(self, key=None, copy=False):
         """Get the metadata associated to a fileset.
 
         Parameters
         ----------
         key : str
             A key that should exist in the fileset's metadata.
+        copy : bool, optional
+            If ``True``, returns a mutable deep copy of the metadata.
+            Else, returns read-only views of the dictionaries & lists (default).
 
         Returns
         -------
@@ -1054,7 +1768,7 @@ class Fileset(db.Fileset):
             Else, returns the value attached to this key.
 
         """
-        return _get_metadata(self.metadata, key)
+        return _get_metadata(self.metadata, key, copy)
 
     def set_metadata(self, data, value=None):
         """Add a new metadata to the fileset.
@@ -1067,9 +1781,10 @@ class Fileset(db.Fileset):
             Value to attach to this metadata. Should be transformable to JSON.
 
         """
+        _check_writable(self.db, self.scan)
         if self.metadata == None:
             self.metadata = {}
-        _set_metadata(self.metadata, data, value)
+        _set_indexed_metadata(self, self.scan._metadata_index, data, value)
         _store_fileset_metadata(self)
 
     def create_file(self, id):
@@ -1108,8 +1823,12 @@ class Fileset(db.Fileset):
         >>> db.disconnect()
 
         """
+        _check_writable(self.db, self.scan)
         file = File(self.db, self, id)
         self.files.append(file)
+        self._files_by_id.setdefault(id, file)
+        if self._metadata_index is not None:
+            self._metadata_index.add(file)
         self.store()
         return file
 
@@ -1140,15 +1859,20 @@ class Fileset(db.Fileset):
         >>> db.disconnect()
 
         """
+        _check_writable(self.db, self.scan)
         x = self.get_file(file_id)
         if x is None:
             raise IOError("Invalid file ID: %s" % file_id)
-        _delete_file(x)
-        self.files.remove(x)
+        if not _defer(self.scan, _commit_delete_file, x):
+            _delete_file(x)
+        _remove_by_id(self.files, self._files_by_id, x)
+        if self._metadata_index is not None:
+            self._metadata_index.remove(x)
         self.store()
 
     def store(self):
         """Save changes to the scan's JSON."""
+        _check_writable(self.db, self.scan)
         self.scan.store()
 
     def path(self) -> str:
@@ -1218,6 +1942,7 @@ class File(db.File):
     Contrary to other classes (``Scan`` & ``Fileset``) the uniqueness is not checked!
 
     """
+    __slots__ = ("metadata",)
     def __init__(self, db, fileset, id):
         super().__init__(db, fileset, id)
         self.metadata = None
@@ -1226,13 +1951,16 @@ class File(db.File):
         self.id = None
         self.metadata = None
 
-    def get_metadata(self, key=None):
+    def get_metadata(self, key=None, copy=False):
         """Get the metadata associated to a file.
 
         Parameters
         ----------
         key : str
             A key that should exist in the file's metadata.
+        copy : bool, optional
+            If ``True``, returns a mutable deep copy of the metadata.
+            Else, returns read-only views of the dictionaries & lists (default).
 
         Returns
         -------
@@ -1241,7 +1969,7 @@ class File(db.File):
             Else, returns the value attached to this key.
 
         """
-        return _get_metadata(self.metadata, key)
+        return _get_metadata(self.metadata, key, copy)
 
     def set_metadata(self, data, value=None):
         """Add a new metadata to the file.
@@ -1254,9 +1982,10 @@ class File(db.File):
             Value to attach to this metadata. Should be transformable to JSON.
 
         """
+        _check_writable(self.db, self.fileset.scan)
         if self.metadata == None:
             self.metadata = {}
-        _set_metadata(self.metadata, data, value)
+        _set_indexed_metadata(self, getattr(self.fileset, "_metadata_index", None), data, value)
         _store_file_metadata(self)
 
     def import_file(self, path):
@@ -1270,13 +1999,12 @@ class File(db.File):
         """
         filename = os.path.basename(path)
         ext = os.path.splitext(filename)[-1][1:]
-        self.filename = '%s.%s' % (self.id, ext)
-        newpath = _file_path(self)
-        copyfile(path, newpath)
-        self.store()
+        with self.open_write(ext) as f, open(path, "rb") as src:
+            copyfileobj(src, f, 1024 * 1024)
 
     def store(self):
         """Save changes to the scan's JSON."""
+        _check_writable(self.db, self.fileset.scan)
         self.fileset.store()
 
     def read_raw(self):
@@ -1311,6 +2039,95 @@ class File(db.File):
         with open(path, "rb") as f:
             return f.read()
 
+    def open(self):
+        """Open the file for reading, without loading its content in memory.
+
+        Returns
+        -------
+        io.BufferedReader
+            The binary file object, to be closed by the caller.
+
+        Examples
+        --------
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect()
+        >>> f = db.get_scan("myscan_001").get_fileset("fileset_001").get_file("test_json")
+        >>> with f.open() as fh:
+        ...     fh.read(1)
+        b'{'
+        >>> db.disconnect()
+
+        """
+        return open(_file_path(self), "rb")
+
+    def iter_chunks(self, size=1024 * 1024):
+        """Iterate over the content of the file, to stream it without loading it in memory.
+
+        Parameters
+        ----------
+        size : int, optional
+            Maximum size of the chunks, in bytes.
+            Defaults to 1 MiB.
+
+        Yields
+        ------
+        bytes
+            The successive chunks of the file.
+
+        Examples
+        --------
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect()
+        >>> f = db.get_scan("myscan_001").get_fileset("fileset_001").get_file("test_json")
+        >>> import os
+        >>> chunks = list(f.iter_chunks(16))
+        >>> len(chunks[0]), sum(len(chunk) for chunk in chunks) == os.path.getsize(f.path())
+        (16, True)
+        >>> db.disconnect()
+
+        """
+        with self.open() as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def mmap(self):
+        """Map the file in memory, read-only.
+
+        The content is paged in by the operating system when accessed and shared with the other processes mapping
+        the file, so large files can be read, or sent, without copying them.
+
+        Returns
+        -------
+        memoryview
+            The read-only content of the file, it stays valid until released and garbage collected.
+
+        Examples
+        --------
+        >>> import numpy as np
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect()
+        >>> f = db.get_scan("myscan_001").get_fileset("fileset_001").get_file("test_json")
+        >>> view = f.mmap()
+        >>> bytes(view[:1])
+        b'{'
+        >>> np.frombuffer(view, dtype=np.uint8).size == len(f.read_raw())
+        True
+        >>> view.release()
+        >>> db.disconnect()
+
+        """
+        with open(_file_path(self), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")  # empty files cannot be mapped
+            # The mapping stays valid once the file is closed:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
     def write_raw(self, data, ext=""):
         """Write a file from raw byte data.
 
@@ -1341,11 +2158,8 @@ class File(db.File):
         >>> db.disconnect()
 
         """
-        self.filename = '%s.%s' % (self.id, ext)
-        path = _file_path(self)
-        with open(path, "wb") as f:
+        with self.open_write(ext) as f:
             f.write(data)
-        self.store()
 
     def read(self):
         """Read the file and return its contents.
@@ -1414,10 +2228,69 @@ class File(db.File):
         >>> db.disconnect()
 
         """
-        self.filename = '%s.%s' % (self.id, ext)
-        path = _file_path(self)
-        with open(path, "w") as f:
+        with self.open_write(ext, text=True) as f:
             f.write(data)
+
+    @contextmanager
+    def open_write(self, ext="", text=False):
+        """Context manager writing the file as a stream.
+
+        The data are written to a temporary file in the fileset directory, renamed into place when the context exits.
+        The scan's JSON is then saved once, or when the batch is committed in "batch" mode.
+        If an exception is raised in the context, the temporary file is removed and the file is left unchanged.
+        The ``name`` of the yielded file object is the path of the temporary file, with the final extension, for the
+        writers that only accept a path.
+
+        Parameters
+        ----------
+        ext : str, optional
+            The extension to use to save the file.
+        text : bool, optional
+            If ``True``, open the file in text mode, else in binary mode (default).
+
+        Yields
+        ------
+        io.BufferedWriter or io.TextIOWrapper
+            The file object to write to.
+
+        Examples
+        --------
+        >>> from plantdb.fsdb import dummy_db
+        >>> db = dummy_db(with_file=True)
+        >>> db.connect()
+        >>> fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        >>> f = fs.create_file("stream")
+        >>> with f.open_write("bin") as fh:
+        ...     for i in range(3):
+        ...         _ = fh.write(bytes([i]) * 1024)
+        >>> f.filename
+        'stream.bin'
+        >>> len(f.read_raw())
+        3072
+        >>> db.disconnect()
+
+        """
+        _check_writable(self.db, self.fileset.scan)
+        filename = '%s.%s' % (self.id, ext)
+        path = os.path.join(_fileset_path(self.fileset), filename)
+        # Keep the extension, some writers use the path to select the format, see `plantdb.io`:
+        tmp_path = _tmp_path(path) + os.path.splitext(filename)[1]
+        f = open(tmp_path, "w" if text else "wb")
+        try:
+            with f:
+                yield f
+                if _fsync_policy(self.fileset.scan) == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.db.catalog is not None:
+            # The catalog only gets the size & modification time of the files with a new name from `self.store`:
+            self.db.catalog.update_file(self.fileset.scan.id, self.fileset.id, self.id, filename, path)
+        self.filename = filename
         self.store()
 
     def path(self) -> str:
@@ -1447,7 +2320,7 @@ class File(db.File):
 
 # load the database
 
-def _load_scans(db):
+def _load_scans(db, lazy=False):
     """Load list of ``Scan`` from given database.
 
     List subdirectories of ``db.basedir``.
@@ -1456,6 +2329,13 @@ def _load_scans(db):
     ----------
     db : plantdb.fsdb.FSDB
         The database object to use to get the list of ``fsdb.Scan``
+    lazy : bool, optional
+        If ``True``, do not load the scans content, this is done on first access.
+        Default is ``False``.
+
+    Notes
+    -----
+    If ``db.workers`` is greater than one, the scans are loaded concurrently by a pool of threads.
 
     Returns
     -------
@@ -1466,8 +2346,7 @@ def _load_scans(db):
     --------
     plantdb.fsdb._scan_path
     plantdb.fsdb._scan_files_json
-    plantdb.fsdb._load_scan_filesets
-    plantdb.fsdb._load_scan_metadata
+    plantdb.fsdb._load_scan
 
     Examples
     --------
@@ -1491,24 +2370,115 @@ def _load_scans(db):
     names = os.listdir(db.basedir)
     for name in names:
         scan = Scan(db, name)
-        if (os.path.isdir(_scan_path(scan))
-                and os.path.isfile(_scan_files_json(scan))):
-            scan.filesets = _load_scan_filesets(scan)
-            scan.metadata = _load_scan_metadata(scan)
-            scan.measures = _load_scan_measures(scan)
+        if _is_scan_dir(scan):
+            scan._is_loaded = False
             scans.append(scan)
             # scan.store()
+    if not lazy:
+        _load_scans_content(db, scans)
+    if db.catalog is not None and not db.read_only:
+        db.catalog.prune([scan.id for scan in scans])
     return scans
 
 
-def _load_scan_filesets(scan):
-    """Load list of ``Fileset`` from given scan.
+def _is_scan_dir(scan):
+    """Test if the directory of a scan exists and has a ``files.json``."""
+    return os.path.isdir(_scan_path(scan)) and os.path.isfile(_scan_files_json(scan))
 
-    Load the list of filesets using "filesets" top-level entry from ``files.json``.
 
-    Parameters
-    ----------
-    scan : plantdb.fsdb.Scan
+def _load_scans_content(db, scans, load=Scan._load):
+    """Load the content of a list of scans, concurrently if ``db.workers`` is greater than one.
+
+    Returns the list of the values returned by `load` for each scan.
+    """
+    if db.workers > 1:
+        # The scans wait for their files to be loaded by `db._executor`, so they need their own pool:
+        with ThreadPoolExecutor(db.workers) as executor:
+            return list(executor.map(load, scans))
+    return [load(scan) for scan in scans]
+
+
+def _try_load_scan(scan):
+    """Load the content of a scan, returns ``False`` and log the error if it fails, see `FSDB.reload`."""
+    try:
+        scan._load()
+    except Exception:
+        logging.exception("Could not load the scan '%s'", scan.id)
+        return False
+    return True
+
+
+def _load_scan(scan):
+    """Load the filesets, metadata & measures of a scan.
+
+    If the database has a catalog with an up-to-date entry for this scan, load it from there.
+    Else, load it from the JSON files and update the catalog.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan to load.
+
+    See Also
+    --------
+    plantdb.fsdb._load_scan_filesets
+    plantdb.fsdb._load_scan_metadata
+    plantdb.fsdb._load_scan_measures
+    plantdb.fsdb._load_scan_from_catalog
+    """
+    catalog = scan.db.catalog
+    # Taken before reading the files, so a change made meanwhile is detected by the next `FSDB.reload`:
+    scan._fingerprint = _scan_fingerprint(scan)
+    if catalog is not None and catalog.get_fingerprint(scan.id) == scan._fingerprint:
+        _load_scan_from_catalog(scan, catalog.get_scan(scan.id))
+    else:
+        scan.filesets = _load_scan_filesets(scan)
+        scan.metadata = _load_scan_metadata(scan)
+        scan.measures = _load_scan_measures(scan)
+        if catalog is not None and not scan.db.read_only:
+            _catalog_store_scan(scan)
+    if scan.db.index:
+        scan._get_metadata_index()
+        for fileset in scan.filesets:
+            fileset._get_metadata_index()
+
+
+def _load_scan_from_catalog(scan, record):
+    """Restore the filesets, files, metadata & measures of a scan from its catalog entry.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan to load.
+    record : dict
+        The scan entry, as returned by ``Catalog.get_scan``.
+    """
+    filesets = []
+    for fs_record in record["filesets"]:
+        fileset = Fileset(scan.db, scan, fs_record["id"])
+        files = []
+        for f_record in fs_record["files"]:
+            file = File(scan.db, fileset, f_record["id"])
+            file.filename = f_record["file"]
+            file.metadata = f_record["metadata"] or None
+            files.append(file)
+        fileset.files = files
+        fileset.metadata = fs_record["metadata"]
+        fileset._consolidated = os.path.isfile(_files_metadata_path(fileset))
+        filesets.append(fileset)
+    scan.filesets = filesets
+    scan.metadata = record["metadata"]
+    scan.measures = record["measures"]
+
+
+def _load_scan_filesets(scan):
+    """Load list of ``Fileset`` from given scan.
+
+    Load the list of filesets using "filesets" top-level entry from ``files.json``.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
         The scan object to use to get the list of ``fsdb.Fileset``
 
     Returns
@@ -1539,9 +2509,14 @@ def _load_scan_filesets(scan):
     """
     filesets = []
     files_json = _scan_files_json(scan)
-    with open(files_json, "r") as f:
-        structure = json.load(f)
-    filesets_info = structure["filesets"]
+    filesets_info = _load_files_cache(scan)
+    if filesets_info is None:
+        with open(files_json, "rb") as f:
+            st = os.fstat(f.fileno())
+            structure = jsonio.loads(f.read())
+        filesets_info = structure["filesets"]
+        if getattr(scan.db, "files_cache", False) and not scan.db.read_only and isinstance(filesets_info, list):
+            _store_files_cache(scan, filesets_info, st)
     if isinstance(filesets_info, list):
         for fileset_info in filesets_info:
             try:
@@ -1549,8 +2524,11 @@ def _load_scan_filesets(scan):
                 filesets.append(fileset)
             except:
                 id = fileset_info.get("id")
-                print("Warning: unable to load fileset %s, deleting..." % id)
-                scan.delete_fileset(id)
+                if scan.db.read_only or scan.db.scan_locks:  # cannot write an unlocked scan
+                    print("Warning: unable to load fileset %s, skipping..." % id)
+                else:
+                    print("Warning: unable to load fileset %s, deleting..." % id)
+                    scan.delete_fileset(id)
     else:
         raise IOError("%s: filesets is not a list" % files_json)
     return filesets
@@ -1589,7 +2567,14 @@ def _load_fileset(scan, fileset_info):
 
     """
     fileset = _parse_fileset(scan.db, scan, fileset_info)
-    fileset.files = _load_fileset_files(fileset, fileset_info)
+    # List the directories once rather than testing the existence of each file:
+    names = None if getattr(scan.db, "trust", False) else _list_files(_fileset_path(fileset), fileset)
+    files_metadata = _load_files_metadata(fileset)
+    fileset._consolidated = files_metadata is not None
+    metadata_names = None
+    if files_metadata is None:
+        metadata_names = _list_files(os.path.join(_scan_path(scan), "metadata", fileset.id))
+    fileset.files = _load_fileset_files(fileset, fileset_info, files_metadata, names, metadata_names)
     fileset.metadata = _load_fileset_metadata(fileset)
     return fileset
 
@@ -1598,74 +2583,605 @@ def _parse_fileset(db, scan, fileset_info):
     id = fileset_info.get("id")
     if id == None:
         raise IOError("Fileset: No ID")
-    fileset = Fileset(db, scan, id)
-    path = _fileset_path(fileset)
-    if not os.path.isdir(path):
-        raise IOError(
-            "Fileset: Fileset directory doesn't exists: %s" % path)
-    return fileset
+    return Fileset(db, scan, id)
+
+
+def _list_files(path, fileset=None):
+    """Returns the names of the files in a directory.
+
+    Parameters
+    ----------
+    path : str
+        Path to the directory.
+    fileset : plantdb.fsdb.Fileset, optional
+        If set, the directory is the one of this fileset and it should exist.
 
+    Returns
+    -------
+    set of str
+        The names of the files, or of the symbolic links to files, in the directory.
+        An empty set if the directory does not exist.
 
-def _load_fileset_files(fileset, fileset_info):
+    Raises
+    ------
+    IOError
+        If the directory of the `fileset` does not exist.
+    """
+    try:
+        with os.scandir(path) as entries:
+            # `is_file` only calls `stat` for the symbolic links:
+            return {entry.name for entry in entries if entry.is_file()}
+    except (FileNotFoundError, NotADirectoryError):
+        if fileset is not None:
+            raise IOError("Fileset: Fileset directory doesn't exists: %s" % path)
+        return set()
+
+
+def _load_fileset_files(fileset, fileset_info, files_metadata=None, names=None, metadata_names=None):
     files = []
     files_info = fileset_info.get("files", [])
     if isinstance(files_info, list):
-        for file_info in files_info:
-            try:
-                file = _load_file(fileset, file_info)
+        loaded = _map_ordered(fileset.db, lambda file_info: _load_file(fileset, file_info, files_metadata, names,
+                                                                      metadata_names), files_info)
+        for file_info, (file, error) in zip(files_info, loaded):
+            if error is None:
                 files.append(file)
-            except:
-                id = file_info.get("id")
-                print("Warning: unable to load file %s, deleting..." % id)
-                fileset.delete_file(id)
+            else:
+                id = file_info[0] if isinstance(file_info, tuple) else file_info.get("id")
+                if fileset.db.read_only or fileset.db.scan_locks:  # cannot write an unlocked scan
+                    print("Warning: unable to load file %s, skipping..." % id)
+                else:
+                    print("Warning: unable to load file %s, deleting..." % id)
+                    fileset.delete_file(id)
     else:
         raise IOError("files.json: expected a list for files")
     return files
 
 
-def _load_file(fileset, file_info):
-    file = _parse_file(fileset, file_info)
-    file.metadata = _load_file_metadata(file)
+def _map_ordered(db, func, items):
+    """Apply a function to a list of items, concurrently if the database has a thread pool.
+
+    Parameters
+    ----------
+    db : plantdb.fsdb.FSDB
+        The database, its ``_executor`` thread pool is used if defined.
+    func : callable
+        The function to apply to each item.
+    items : list
+        The items to process.
+
+    Returns
+    -------
+    list of tuple
+        The ``(result, exception)`` pairs, in the order of the `items`, with ``exception`` set to ``None`` on success.
+    """
+
+    def _call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    executor = getattr(db, "_executor", None)
+    if executor is None or len(items) < 2:
+        return [_call(item) for item in items]
+    # Submit a few chunks per thread rather than one task per item to limit the pool overhead:
+    size = -(-len(items) // (4 * db.workers))
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+    results = []
+    for chunk_results in executor.map(lambda chunk: [_call(item) for item in chunk], chunks):
+        results.extend(chunk_results)
+    return results
+
+
+def _load_file(fileset, file_info, files_metadata=None, names=None, metadata_names=None):
+    """Load a file and its metadata.
+
+    Parameters
+    ----------
+    fileset : plantdb.fsdb.Fileset
+        The fileset of the file.
+    file_info : dict or tuple
+        The file id & name, as a dictionary from "files.json" or a tuple from the `files_cache`.
+    files_metadata : dict, optional
+        The metadata of all the files of the fileset, if saved in a single JSON file.
+    names : set of str, optional
+        The names of the files in the fileset directory, by default the existence of the file is not checked.
+    metadata_names : set of str, optional
+        The names of the metadata JSON files of the fileset, by default the JSON file of the file is read if it exists.
+    """
+    file = _parse_file(fileset, file_info, names)
+    # Files without metadata share ``None`` rather than holding an empty dictionary each:
+    if files_metadata is not None:
+        file.metadata = files_metadata.get(file.id) or None
+    elif metadata_names is None or file.id + ".json" in metadata_names:
+        file.metadata = _load_file_metadata(file) or None
     return file
 
 
-def _parse_file(fileset, file_info):
-    id = file_info.get("id")
+def _parse_file(fileset, file_info, names=None):
+    if isinstance(file_info, tuple):  # loaded from the `files_cache`
+        id, filename = file_info
+    else:
+        id, filename = file_info.get("id"), file_info.get("file")
     if id == None:
         raise IOError("File: No ID")
-    filename = file_info.get("file")
     if filename == None:
         raise IOError("File: No filename")
     file = File(fileset.db, fileset, id)
     file.filename = filename
+    if names is None or filename in names:
+        return file
     path = _file_path(file)
-    if not os.path.isfile(path):
+    # The file names with a path are not in the listing of the fileset directory:
+    if os.path.basename(filename) == filename or not os.path.isfile(path):
         raise IOError("File: File doesn't exists: %s" % path)
     return file
 
 
+# binary copy of "files.json", see `FSDB.connect(files_cache=True)`
+
+#: Header of the `files_cache`: magic, Python version, inode, modification time (ns) & size of the "files.json"
+_FILES_CACHE_HEADER = struct.Struct("<4sHQqQ")
+_FILES_CACHE_MAGIC = b"RDBF"
+#: The `marshal` format may change between Python versions
+_FILES_CACHE_VERSION = sys.version_info[0] * 100 + sys.version_info[1]
+
+
+def _load_files_cache(scan):
+    """Returns the filesets of a scan from the binary copy of its "files.json", ``None`` if missing or outdated.
+
+    Returns
+    -------
+    list of dict or None
+        The filesets, as in "files.json", with their "files" as lists of ``(id, filename)`` tuples.
+    """
+    try:
+        st = os.stat(_scan_files_json(scan))
+        with open(_scan_files_cache(scan), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < _FILES_CACHE_HEADER.size:
+        return None
+    if _FILES_CACHE_HEADER.unpack_from(data) != (_FILES_CACHE_MAGIC, _FILES_CACHE_VERSION, st.st_ino,
+                                                 st.st_mtime_ns, st.st_size):
+        return None
+    try:
+        filesets = marshal.loads(memoryview(data)[_FILES_CACHE_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+        return None
+    return [{"id": id, "files": files} for id, files in filesets]
+
+
+def _store_files_cache(scan, filesets_info, st=None):
+    """Save the binary copy of the "files.json" of a scan.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan.
+    filesets_info : list of dict
+        The filesets, as saved in "files.json".
+    st : os.stat_result, optional
+        The status of the "files.json" the filesets were read from, by default the current one.
+    """
+    try:
+        filesets = [(fs["id"], [(f.get("id"), f.get("file")) for f in fs.get("files", [])]) for fs in filesets_info]
+        data = marshal.dumps(filesets)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return  # let the JSON loader report the errors
+    try:
+        if st is None:
+            st = os.stat(_scan_files_json(scan))
+    except OSError:
+        return
+    header = _FILES_CACHE_HEADER.pack(_FILES_CACHE_MAGIC, _FILES_CACHE_VERSION, st.st_ino, st.st_mtime_ns, st.st_size)
+    path = _scan_files_cache(scan)
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# catalog
+
+def _open_catalog(db, catalog=None):
+    """Open the catalog of a database.
+
+    Parameters
+    ----------
+    db : plantdb.fsdb.FSDB
+        The database to get the catalog from.
+    catalog : bool, optional
+        If ``True``, create the catalog file if missing.
+        If ``False``, remove the catalog file if it exists.
+        By default, open the catalog only if the file exists.
+        A read-only database never creates nor removes the catalog file, nor updates it.
+
+    Returns
+    -------
+    plantdb.catalog.Catalog or None
+        The catalog of the database, if any.
+    """
+    path = os.path.join(db.basedir, CATALOG_FILE_NAME)
+    if catalog is False:
+        if os.path.isfile(path) and not db.read_only:
+            os.remove(path)
+        return None
+    if (catalog is None or db.read_only) and not os.path.isfile(path):
+        return None
+    return Catalog(path)
+
+
+def _scan_fingerprint(scan):
+    """Returns the modification times & sizes of the JSON files describing a scan.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan to get the fingerprint from.
+
+    Returns
+    -------
+    list
+        The modification time (in ns) and size of the scan's "files.json", "metadata.json" & "measures.json" files.
+        Missing files have a ``None`` modification time and size.
+        Followed by the name, modification time and size of the other entries of the "metadata" directory: the
+        fileset metadata files and the directories holding the file metadata files.
+
+    Notes
+    -----
+    The file metadata files are not checked one by one, only their directory: the changes made by replacing,
+    adding or removing one of them are detected, but not the ones made by writing into an existing file.
+    """
+    fingerprint = []
+    for path in (_scan_files_json(scan), _scan_metadata_path(scan), _scan_measures_path(scan)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            fingerprint.extend([None, None])
+        else:
+            fingerprint.extend([st.st_mtime_ns, st.st_size])
+    try:
+        with os.scandir(os.path.dirname(_scan_metadata_path(scan))) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        entries = []
+    for entry in entries:
+        if entry.name == "metadata.json" or entry.name.endswith(".tmp"):  # see `_store_json`
+            continue
+        try:
+            st = entry.stat()
+        except OSError:  # removed meanwhile
+            continue
+        fingerprint.extend([entry.name, st.st_mtime_ns, None if entry.is_dir() else st.st_size])
+    return fingerprint
+
+
+def _catalog_filesets(scan, with_metadata=False):
+    """Returns the filesets of a scan formatted for the catalog."""
+    filesets = []
+    for fileset in scan.get_filesets():
+        files = []
+        for f in fileset.get_files():
+            d = _file_to_dict(f)
+            d["path"] = None if f.filename is None else _file_path(f)
+            if with_metadata:
+                d["metadata"] = f.metadata
+            files.append(d)
+        fs = {"id": fileset.id, "files": files}
+        if with_metadata:
+            fs["metadata"] = fileset.metadata
+        filesets.append(fs)
+    return filesets
+
+
+def _catalog_store_scan(scan):
+    """Replace the catalog entry of a scan by its current state."""
+    scan.db.catalog.store_scan(scan.id, scan._fingerprint, _catalog_filesets(scan, with_metadata=True),
+                               scan.metadata, scan.measures)
+
+
+# batched writes
+
+class _Batch(object):
+    """Writes of a scan deferred until the end of a ``Scan.batch`` context.
+
+    Attributes
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan in "batch" mode.
+    store : bool
+        ``True`` if the scan's JSON has to be saved on commit.
+    calls : dict
+        The deferred calls as ``(function, *args)`` tuples, in order. Using a dictionary avoid writing the same
+        metadata file more than once.
+    committing : bool
+        ``True`` while the deferred calls are made.
+    saved : bool
+        ``True`` once the state of the scan is saved, see `save`.
+    """
+
+    def __init__(self, scan):
+        self.scan = scan
+        self.store = False
+        self.calls = {}
+        self.committing = False
+        self.saved = False
+        self._snapshot = None
+
+    def save(self):
+        """Save the state of the scan to roll it back, before its first modification in the batch."""
+        if not self.saved and not self.committing:
+            self._snapshot = _snapshot_scan(self.scan)
+            self.saved = True
+
+    def commit(self):
+        """Make the deferred calls then save the scan's JSON if required."""
+        self.committing = True
+        with _group_writes():
+            try:
+                for func, *args in self.calls:
+                    func(*args)
+            finally:
+                self.scan._batch = None
+            if self.store:
+                _store_scan(self.scan)
+
+    def rollback(self):
+        """Discard the deferred calls and restore the state of the scan, if it was modified."""
+        self.calls = {}
+        if self.saved:
+            _restore_scan(self.scan, self._snapshot)
+
+
+def _defer(scan, func, *args):
+    """Defer a call to the commit of the batch if the scan is in "batch" mode.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan to check for a batch.
+    func : callable
+        The function to call.
+    args
+        The arguments of the function.
+
+    Returns
+    -------
+    bool
+        ``True`` if the call was deferred, else ``False`` and the caller should make it.
+    """
+    batch = getattr(scan, "_batch", None)
+    if batch is None or batch.committing:
+        return False
+    batch.calls[(func,) + args] = None
+    return True
+
+
+def _snapshot_scan(scan):
+    """Returns the in-memory state of a scan, ``None`` if it is not loaded."""
+    if not scan._is_loaded:
+        return None
+    filesets = []
+    for fs in scan.filesets:
+        files = [(f, f.filename, copy.deepcopy(f.metadata)) for f in fs.files]
+        filesets.append((fs, copy.deepcopy(fs.metadata), files))
+    return copy.deepcopy(scan.metadata), filesets
+
+
+def _restore_scan(scan, snapshot):
+    """Restore the in-memory state of a scan, as returned by ``_snapshot_scan``."""
+    scan.db._metadata_index = None  # the scan metadata may change
+    if snapshot is None:
+        # The scan was not loaded, its content will be loaded again from the disk
+        scan.filesets = []
+        scan.metadata = None
+        scan.measures = None
+        scan._is_loaded = False
+        return
+    scan.metadata, filesets = snapshot
+    scan.filesets = [fs for fs, _, _ in filesets]
+    for fs, metadata, files in filesets:
+        fs.metadata = metadata
+        fs.files = [f for f, _, _ in files]
+        for f, filename, f_metadata in files:
+            f.filename = filename
+            f.metadata = f_metadata
+
+
+# atomic writes
+
+#: The current write group of each thread, see `_group_writes`
+_write_groups = threading.local()
+
+
+class _WriteGroup(object):
+    """JSON files written by a thread and replaced together when the group is committed.
+
+    Attributes
+    ----------
+    pending : dict
+        The paths of the files to replace, mapped to the paths of the temporary files holding their new content.
+    scans : dict
+        The scans with written files, by Python id, their fingerprint is updated on commit.
+    callbacks : dict
+        The functions to call once the files are replaced, by path of the written file, see `_after_writes`.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.scans = {}
+        self.callbacks = {}
+
+    def commit(self):
+        """Flush the temporary files if required by the `fsync` policy, then rename them into place."""
+        if not self.pending:
+            return
+        durable = any(_fsync_policy(scan) != "never" for scan in self.scans.values())
+        if durable:
+            _sync_files(list(self.pending.values()))
+        for path, tmp_path in self.pending.items():
+            try:
+                os.replace(tmp_path, path)
+            except FileNotFoundError:  # the scan was deleted meanwhile
+                pass
+        if durable:
+            _sync_files({os.path.dirname(path) for path in self.pending})
+        self.pending = {}
+        for scan in self.scans.values():
+            # The fingerprints computed before the files were replaced are stale:
+            scan._fingerprint = _scan_fingerprint(scan)
+            if scan.db.catalog is not None:
+                scan.db.catalog.set_fingerprint(scan.id, scan._fingerprint)
+        for callback in self.callbacks.values():
+            callback()
+
+
+@contextmanager
+def _group_writes():
+    """Context manager grouping the JSON files written by the current thread until it exits.
+
+    The files are written to temporary files, then flushed at once if required by the `fsync` policy and renamed
+    into place when the context exits.
+    In a nested context, the outer one is in charge of the commit.
+    """
+    if getattr(_write_groups, "group", None) is not None:
+        yield
+        return
+    group = _write_groups.group = _WriteGroup()
+    try:
+        yield
+    finally:
+        _write_groups.group = None
+        group.commit()
+
+
+def _after_writes(path, callback):
+    """Call a function once the file written at `path` is replaced, at the commit of the current write group if any.
+
+    Only the last function registered for a given path is called.
+    """
+    group = getattr(_write_groups, "group", None)
+    if group is None:
+        callback()
+    else:
+        group.callbacks[path] = callback
+
+
+def _fsync_policy(scan):
+    """Returns the `fsync` policy of the database of a scan."""
+    return getattr(scan.db, "fsync", "never")
+
+
+def _is_compact_json(scan):
+    """Returns ``True`` if the JSON files of a scan that are not meant to be edited are written without indentation."""
+    return getattr(scan.db, "compact_json", False)
+
+
+def _tmp_path(path):
+    """Returns the path of the temporary file written by this thread before replacing the file at `path`."""
+    return "%s.%d-%d.tmp" % (path, os.getpid(), threading.get_ident())
+
+
+def _store_json(scan, path, data, compact=False):
+    """Write a JSON file of a scan to a temporary file and rename it into place.
+
+    Other processes may be reading the file (see `scan_locks`) and a crash should not leave it truncated.
+    In a write group, see `_group_writes`, the file is only replaced when the group is committed.
+
+    Parameters
+    ----------
+    scan : plantdb.fsdb.Scan
+        The scan the file belongs to.
+    path : str
+        Path to the JSON file.
+    data : dict
+        The data to save.
+    compact : bool, optional
+        If ``True``, write the JSON without indentation.
+    """
+    group = getattr(_write_groups, "group", None)
+    sync = group is None and _fsync_policy(scan) == "always"
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(jsonio.dumps(data, indent=not compact))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        if group is not None:
+            group.pending[path] = tmp_path
+            group.scans[id(scan)] = scan
+            return
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if sync:
+        _sync_files([os.path.dirname(path)])
+
+
+def _sync_files(paths):
+    """Flush files or directories to the disk.
+
+    On Linux, the whole file system is flushed with a single ``syncfs`` call, else each file is flushed.
+    """
+    paths = list(paths)
+    if len(paths) > 1 and _syncfs is not None:
+        fd = os.open(paths[0], os.O_RDONLY)
+        try:
+            if _syncfs(fd) == 0:
+                return
+        finally:
+            os.close(fd)
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _load_syncfs():
+    """Returns the ``syncfs`` function of the C library, ``None`` if not available."""
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).syncfs
+    except (AttributeError, OSError):
+        return None
+
+
+_syncfs = _load_syncfs()
+
+
 # load/store metadata from disk
 
 def _load_metadata(path):
-    if os.path.isfile(path):
-        with open(path, "r") as f:
-            r = json.load(f)
-        if not isinstance(r, dict):
-            raise IOError("Not a JSON object: %s" % path)
-        return r
-    else:
-        return {}
+    r = _load_json_object(path)
+    return {} if r is None else r
 
 
 def _load_measures(path):
-    if os.path.isfile(path):
-        with open(path, "r") as f:
-            r = json.load(f)
-        if not isinstance(r, dict):
-            raise IOError("Not a JSON object: %s" % path)
-        return r
-    else:
-        return {}
+    r = _load_json_object(path)
+    return {} if r is None else r
+
+
+def _load_json_object(path):
+    """Returns the JSON object saved in a file, ``None`` if the file does not exist."""
+    try:
+        r = jsonio.load(path)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+    if not isinstance(r, dict):
+        raise IOError("Not a JSON object: %s" % path)
+    return r
 
 
 def _load_scan_metadata(scan):
@@ -1684,56 +3200,240 @@ def _load_file_metadata(file):
     return _load_metadata(_file_metadata_path(file))
 
 
+def _load_files_metadata(fileset):
+    """Returns the metadata of the files of a fileset by file id, ``None`` if they are not in a single JSON file."""
+    return _load_json_object(_files_metadata_path(fileset))
+
+
 def _mkdir_metadata(path):
     dir = os.path.dirname(path)
     if not os.path.isdir(dir):
         os.makedirs(dir)
 
 
-def _store_metadata(path, metadata):
+def _store_metadata(scan, path, metadata, compact=False):
     _mkdir_metadata(path)
-    with open(path, "w") as f:
-        json.dump(metadata, f, sort_keys=True,
-                  indent=4, separators=(',', ': '))
+    _store_json(scan, path, metadata, compact=compact)
+    if getattr(_write_groups, "group", None) is None:  # else updated when the group is committed
+        # The metadata files are part of the fingerprint:
+        scan._fingerprint = _scan_fingerprint(scan)
+        if scan.db.catalog is not None:
+            scan.db.catalog.set_fingerprint(scan.id, scan._fingerprint)
 
 
 def _store_scan_metadata(scan):
-    _store_metadata(_scan_metadata_path(scan),
+    if _defer(scan, _store_scan_metadata, scan):
+        return
+    _store_metadata(scan, _scan_metadata_path(scan),
                     scan.metadata)
+    if scan.db.catalog is not None:
+        scan.db.catalog.store_metadata(scan.id, "", "", scan.metadata,
+                                       fingerprint=scan._fingerprint)
 
 
 def _store_fileset_metadata(fileset):
-    _store_metadata(_fileset_metadata_path(fileset),
+    if _defer(fileset.scan, _store_fileset_metadata, fileset):
+        return
+    _store_metadata(fileset.scan, _fileset_metadata_path(fileset),
                     fileset.metadata)
+    if fileset.db.catalog is not None:
+        fileset.db.catalog.store_metadata(fileset.scan.id, fileset.id, "", fileset.metadata)
 
 
 def _store_file_metadata(file):
-    _store_metadata(_file_metadata_path(file),
-                    file.metadata)
+    fileset = file.fileset
+    if fileset._consolidated or getattr(fileset.db, "consolidated_metadata", False):
+        # Save all the files metadata of the fileset, once per batch:
+        _store_files_metadata(fileset)
+    elif _defer(fileset.scan, _store_file_metadata, file):
+        return
+    else:
+        _store_metadata(fileset.scan, _file_metadata_path(file),
+                        file.metadata)
+    if _defer(fileset.scan, _catalog_store_file_metadata, file):
+        return
+    _catalog_store_file_metadata(file)
+
+
+def _store_files_metadata(fileset):
+    """Save the metadata of all the files of a fileset in its single JSON file."""
+    if _defer(fileset.scan, _store_files_metadata, fileset):
+        return
+    _store_metadata(fileset.scan, _files_metadata_path(fileset),
+                    {f.id: f.metadata for f in fileset.files if f.metadata}, compact=_is_compact_json(fileset.scan))
+    fileset._consolidated = True
+
+
+def _migrate_fileset_metadata(fileset, consolidated):
+    """Save the files metadata of a fileset in a single JSON file, or one JSON file per file, and remove the others."""
+    _check_writable(fileset.db, fileset.scan)
+    if consolidated:
+        _store_files_metadata(fileset)
+        for f in fileset.files:
+            path = _file_metadata_path(f)
+            if os.path.isfile(path):
+                os.remove(path)
+        files_dir = os.path.join(fileset.db.basedir, fileset.scan.id, "metadata", fileset.id)
+        if os.path.isdir(files_dir) and not os.listdir(files_dir):
+            os.rmdir(files_dir)
+    else:
+        for f in fileset.files:
+            if f.metadata:
+                _store_metadata(fileset.scan, _file_metadata_path(f), f.metadata)
+        os.remove(_files_metadata_path(fileset))
+        fileset._consolidated = False
+
+
+def _catalog_store_file_metadata(file):
+    if file.db.catalog is not None:
+        file.db.catalog.store_metadata(file.fileset.scan.id, file.fileset.id, file.id, file.metadata)
 
 
 #
 
-def _get_metadata(metadata, key):
-    # Do a deepcopy of the return value because we don't want to
-    # caller the inadvertedly change the values.
+def _get_metadata(metadata, key, mutable=False):
+    # Return a deepcopy, or a read-only view, because we don't want
+    # the caller to inadvertedly change the values.
     if metadata == None:
-        return {}
-    elif key == None:
-        return copy.deepcopy(metadata)
-    else:
-        return copy.deepcopy(metadata.get(str(key)))
+        return {} if mutable else ReadOnlyDict()
+    elif key != None:
+        metadata = metadata.get(str(key))
+    return copy.deepcopy(metadata) if mutable else _read_only(metadata)
 
 
-def _get_measures(measures, key):
-    # Do a deepcopy of the return value because we don't want to
-    # caller the inadvertedly change the values.
+def _get_measures(measures, key, mutable=False):
+    # Return a deepcopy, or a read-only view, because we don't want
+    # the caller to inadvertedly change the values.
     if measures == None:
-        return {}
-    elif key == None:
-        return copy.deepcopy(measures)
-    else:
-        return copy.deepcopy(measures.get(str(key)))
+        return {} if mutable else ReadOnlyDict()
+    elif key != None:
+        measures = measures.get(str(key))
+    return copy.deepcopy(measures) if mutable else _read_only(measures)
+
+
+def _read_only_error(self, *args, **kwargs):
+    raise TypeError("'%s' object is read-only, use `copy=True` to get a mutable copy" % type(self).__name__)
+
+
+class ReadOnlyDict(dict):
+    """Read-only view of a metadata dictionary, as returned by ``get_metadata``.
+
+    The nested dictionaries & lists are returned as read-only views when accessed.
+    It is still a ``dict`` and can be serialized to JSON without conversion.
+
+    Notes
+    -----
+    The view holds a shallow copy of the dictionary, the nested values are shared with the metadata.
+    Use ``copy`` or ``copy.deepcopy`` to get a mutable deep copy, ``dict(view)`` is only a shallow copy.
+
+    Examples
+    --------
+    >>> from plantdb.fsdb import ReadOnlyDict
+    >>> md = ReadOnlyDict({"object": {"species": "Arabidopsis thaliana"}})
+    >>> md["object"]["species"] = "Solanum lycopersicum"
+    Traceback (most recent call last):
+      ...
+    TypeError: 'ReadOnlyDict' object is read-only, use `copy=True` to get a mutable copy
+    >>> md_copy = md.copy()
+    >>> md_copy["object"]["species"] = "Solanum lycopersicum"
+    >>> md["object"]["species"]
+    'Arabidopsis thaliana'
+
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _read_only_error
+    clear = pop = popitem = setdefault = update = _read_only_error
+
+    def __getitem__(self, key):
+        return _read_only(dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        return _read_only(dict.get(self, key, default))
+
+    def values(self):
+        return [_read_only(value) for value in dict.values(self)]
+
+    def items(self):
+        return [(key, _read_only(value)) for key, value in dict.items(self)]
+
+    def copy(self):
+        """Returns a mutable deep copy of the dictionary."""
+        return copy.deepcopy(dict(self))
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class ReadOnlyList(list):
+    """Read-only view of a metadata list, as returned by ``get_metadata``.
+
+    The nested dictionaries & lists are returned as read-only views when accessed.
+    It is still a ``list`` and can be serialized to JSON without conversion.
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only_error
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only_error
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(list.__getitem__(self, index))
+        return _read_only(list.__getitem__(self, index))
+
+    def __iter__(self):
+        return (_read_only(value) for value in list.__iter__(self))
+
+    def copy(self):
+        """Returns a mutable deep copy of the list."""
+        return copy.deepcopy(list(list.__iter__(self)))
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(list.__iter__(self)), memo)
+
+    def __reduce__(self):
+        return list, (list(list.__iter__(self)),)
+
+
+def _read_only(value):
+    """Returns a read-only view of a metadata value, dictionaries & lists are wrapped without copying their content."""
+    if isinstance(value, dict) and not isinstance(value, ReadOnlyDict):
+        return ReadOnlyDict(value)
+    if isinstance(value, list) and not isinstance(value, ReadOnlyList):
+        return ReadOnlyList(value)
+    return value
+
+
+def _set_indexed_metadata(obj, index, data, value):
+    """Set the metadata of a scan, fileset or file and update the index containing it.
+
+    Parameters
+    ----------
+    obj : plantdb.fsdb.Scan or plantdb.fsdb.Fileset or plantdb.fsdb.File
+        The object to update, its ``metadata`` attribute should be a dictionary.
+    index : plantdb.query.MetadataIndex or None
+        The index containing the object, if any.
+    data : str or dict
+        Name of the metadata or dictionary of metadata.
+    value : any
+        Value to attach to this metadata.
+    """
+    if index is not None:
+        index.remove(obj)
+    try:
+        _set_metadata(obj.metadata, data, value)
+    finally:
+        if index is not None:
+            index.add(obj)
 
 
 def _set_metadata(metadata, data, value):
@@ -1884,6 +3584,13 @@ def _scan_files_json(scan):
                         "files.json")
 
 
+def _scan_files_cache(scan):
+    """Get the path to the binary copy of the scan's "files.json" file, see `FSDB.connect(files_cache=True)`."""
+    return os.path.join(scan.db.basedir,
+                        scan.id,
+                        "files.bin")
+
+
 def _scan_metadata_path(scan):
     """Get the path to scan's "metadata.json" file.
 
@@ -1960,6 +3667,25 @@ def _file_metadata_path(file):
                         file.id + ".json")
 
 
+def _files_metadata_path(fileset):
+    """Get the path to the JSON file holding the metadata of all the files of a fileset.
+
+    Parameters
+    ----------
+    fileset : fsdb.Fileset
+        Fileset to get the JSON file path from.
+
+    Returns
+    -------
+    str
+        Path to the "<Fileset.id>.files.json" file.
+    """
+    return os.path.join(fileset.db.basedir,
+                        fileset.scan.id,
+                        "metadata",
+                        fileset.id + ".files.json")
+
+
 ################################################################################
 # store a scan to disk
 ################################################################################
@@ -2041,16 +3767,229 @@ def _store_scan(scan):
     _scan_files_json
     """
     structure = _scan_to_dict(scan)
-    files_json = _scan_files_json(scan)
-    with open(files_json, "w") as f:
-        json.dump(structure, f, sort_keys=True,
-                  indent=4, separators=(',', ': '))
+    _store_json(scan, _scan_files_json(scan), structure, compact=_is_compact_json(scan))
+    if getattr(scan.db, "files_cache", False):
+        _after_writes(_scan_files_json(scan), lambda: _store_files_cache(scan, structure["filesets"]))
+    scan._fingerprint = _scan_fingerprint(scan)
+    if scan.db.catalog is not None:
+        scan.db.catalog.store_structure(scan.id, scan._fingerprint, _catalog_filesets(scan))
 
 
 def _is_valid_id(id):
     return True  # haha  (FIXME!)
 
 
+def _check_writable(db, scan=None):
+    """Raise an ``IOError`` if the database is connected in read-only mode, or if the modified scan is not locked.
+
+    With ``scan_locks``, the modified scan must also be the one returned by ``FSDB.lock_scan``: a scan obtained before
+    may hold a stale state, that would overwrite the changes made by the other processes.
+    Called before each modification of a scan, it saves the state of a scan in "batch" mode, see ``_Batch.save``.
+    """
+    if getattr(db, "read_only", False):
+        raise IOError("The database '%s' is connected in read-only mode" % db.basedir)
+    if scan is not None and getattr(db, "scan_locks", False):
+        if scan.id not in db._scan_lock_fds:
+            raise IOError("Scan '%s' is not locked, see `FSDB.lock_scan`" % scan.id)
+        if db._scans_by_id.get(scan.id) is not scan:  # obtained before `lock_scan` reloaded it
+            raise IOError("Scan '%s' is outdated, use the one returned by `FSDB.lock_scan`" % scan.id)
+    batch = getattr(scan, "_batch", None)
+    if batch is not None:
+        batch.save()
+
+
+def _scan_lock_path(db, scan_id):
+    """Returns the path to the lock file of a scan."""
+    return _locks_path(db, "%s.lock" % scan_id)
+
+
+def _locks_path(db, name):
+    """Returns the path to a file of the `LOCKS_DIR_NAME` directory, created if missing."""
+    locks_dir = os.path.join(db.basedir, LOCKS_DIR_NAME)
+    os.makedirs(locks_dir, exist_ok=True)
+    return os.path.join(locks_dir, name)
+
+
+@contextmanager
+def _scans_lock(db):
+    """Lock the list of scans while creating or deleting a scan, only needed with ``scan_locks``."""
+    if not db.scan_locks:
+        yield
+        return
+    fd = os.open(_locks_path(db, LOCK_FILE_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+#: Number of attempts to lock a database, to get past the short locks taken by the disconnecting readers
+_LOCK_ATTEMPTS = 5
+#: Time between two attempts to lock a database, in seconds
+_LOCK_RETRY_DELAY = 0.02
+
+
+def _lock_owner():
+    """Returns the identifier of this process written in the lock file: ``"host:pid"``."""
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def _is_stale_owner(owner):
+    """Test if the owner of a lock file, as returned by ``_lock_owner``, is a process of this host that is not running."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False  # unknown format, or another host: assume it is still running
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False  # running as another user
+    return False
+
+
+def _read_lock_owner(path):
+    """Returns the owner written in a lock file, empty if none."""
+    try:
+        with open(path, "r") as f:
+            return f.read(1024).strip()
+    except OSError:
+        return ""
+
+
+def _acquire_lock(path, shared=False, force=False):
+    """Lock a database, with a shared lock for the readers or an exclusive lock for the writer.
+
+    Parameters
+    ----------
+    path : str
+        Path to the lock file, created if missing.
+    shared : bool, optional
+        If ``True``, take a shared lock, else an exclusive one.
+    force : bool, optional
+        If ``True``, take over an existing empty lock file that no process holds.
+
+    Returns
+    -------
+    int
+        The file descriptor of the locked file, to give to ``_release_lock``.
+
+    Raises
+    ------
+    DBBusyError
+        If the lock is held by other processes, or if the lock file names a writer that is still running.
+        If the lock file exists, is empty and no process holds it, unless `force` is set.
+
+    Notes
+    -----
+    The writer writes its host name & PID in the lock file, see ``_lock_owner``.
+    Finding the lock file of a writer after locking it means it was not unlocked properly, or that it was locked
+    with ``open(path, "x")`` by another tool.
+    It is only taken over if the writer is not running anymore.
+    An existing empty lock file that no process holds may have been created by the ``open(path, "x")`` of an older
+    version of plantdb still using the database, it is only taken over with `force`.
+    Without ``fcntl``, the lock file is created with ``O_EXCL`` and is always exclusive.
+    """
+    if fcntl is None:
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            raise DBBusyError(
+                "File %s exists in DB root: DB is busy, cannot connect." % LOCK_FILE_NAME)
+        os.write(fd, _lock_owner().encode())
+        return fd
+    unheld = False
+    for attempt in range(_LOCK_ATTEMPTS):
+        if attempt:
+            time.sleep(_LOCK_RETRY_DELAY)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            created = True
+        except FileExistsError:
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:  # removed meanwhile
+                continue
+            created = False
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        try:
+            replaced = os.fstat(fd).st_ino != os.stat(path).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:  # removed by its previous owner before we locked it
+            os.close(fd)
+            continue
+        owner = os.read(fd, 1024).decode(errors="replace").strip()
+        if owner and not _is_stale_owner(owner):
+            os.close(fd)
+            raise DBBusyError("File %s is locked by %s: DB is busy." % (path, owner))
+        # An existing empty file should be held by other readers, else it may be used by an older plantdb, or a
+        # process that just created it and did not lock it yet:
+        try:
+            unheld = not owner and not created and not force and not _is_held_by_others(fd, shared)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        if unheld:
+            os.close(fd)
+            continue
+        if owner or not shared:
+            os.ftruncate(fd, 0)
+        if not shared:
+            os.pwrite(fd, _lock_owner().encode(), 0)
+        return fd
+    if unheld:
+        raise DBBusyError("File %s exists in DB root but no process locks it: it may be used by an older version of "
+                          "plantdb, or left by a process that crashed. Remove it, or connect with `force=True`, if no "
+                          "other process is using the DB." % path)
+    owner = _read_lock_owner(path)
+    raise DBBusyError("File %s is locked%s: DB is busy." % (path, " by %s" % owner if owner else ""))
+
+
+def _is_held_by_others(fd, shared):
+    """Test if other processes hold the lock of the file, while holding it with `fd`.
+
+    If not, the lock held with `fd` may have been made exclusive: `fd` should be closed.
+    Raises a ``BlockingIOError`` if the shared lock was lost while testing.
+    """
+    if not shared:
+        return False  # we hold the exclusive lock
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # The failed conversion may have released the shared lock, take it again:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return True
+    return False
+
+
+def _release_lock(fd, path, shared=False):
+    """Unlock a database, the lock file is removed if no other process holds it.
+
+    Parameters
+    ----------
+    fd : int
+        The file descriptor returned by ``_acquire_lock``.
+    path : str
+        Path to the lock file.
+    shared : bool, optional
+        ``True`` if this is a shared lock.
+    """
+    try:
+        if shared and fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)  # fails if other readers hold the lock
+        os.remove(path)
+    except BlockingIOError:
+        pass
+    finally:
+        os.close(fd)
+
+
 def _is_db(path):
     """Test if the given path is indeed an FSDB database.
 
@@ -2143,6 +4082,11 @@ def _delete_fileset(fileset):
     """
     for f in fileset.files:
         fileset.delete_file(f.id)
+    _remove_fileset_dir(fileset)
+
+
+def _remove_fileset_dir(fileset):
+    """Remove the directory of a fileset and all its content."""
     fullpath = os.path.join(fileset.scan.db.basedir, fileset.scan.id,
                             fileset.id)
     if not _is_safe_to_delete(fullpath):
@@ -2153,6 +4097,43 @@ def _delete_fileset(fileset):
         os.rmdir(fullpath)
 
 
+def _live_fileset(fileset):
+    """Returns the fileset with the same scan & fileset ids in the current state of the database, if any."""
+    scan = fileset.scan.db.get_scan(fileset.scan.id)
+    return None if scan is None else scan.get_fileset(fileset.id)
+
+
+def _commit_delete_file(file):
+    """Delete a file at the commit of a batch, unless a file created in the batch has reused its path."""
+    live = _live_fileset(file.fileset)
+    if live is not None and file.filename is not None and any(f.filename == file.filename for f in live.files):
+        return
+    _delete_file(file)
+
+
+def _commit_delete_fileset(fileset):
+    """Delete a fileset at the commit of a batch, keeping the files of a fileset created again in the batch."""
+    if _live_fileset(fileset) is None:
+        _delete_fileset(fileset)
+        return
+    for f in fileset.files:
+        _commit_delete_file(f)
+
+
+def _commit_delete_scan(scan):
+    """Delete a scan at the commit of a transaction, keeping the filesets of a scan created again in the transaction."""
+    if scan.db.get_scan(scan.id) is None:
+        _delete_scan(scan)
+        return
+    # Remove the files directly, the deleted `Scan` object should not save its JSON over the new one:
+    for fs in scan.filesets:
+        if _live_fileset(fs) is None:
+            _remove_fileset_dir(fs)
+        else:
+            for f in fs.files:
+                _commit_delete_file(f)
+
+
 def _delete_scan(scan):
     """Delete the given scan, starting by its `Fileset`s.
 
@@ -2176,33 +4157,76 @@ def _delete_scan(scan):
     fullpath = os.path.join(scan.db.basedir, scan.id)
     if not _is_safe_to_delete(fullpath):
         raise IOError("Cannot delete files outside of a DB.")
-    rmtree(fullpath, ignore_errors=True)
-    if os.path.exists(fullpath):
-        os.rmdir(fullpath)
+    with _scans_lock(scan.db):
+        rmtree(fullpath, ignore_errors=True)
+        if os.path.exists(fullpath):
+            os.rmdir(fullpath)
+    if scan.db.catalog is not None:
+        scan.db.catalog.delete_scan(scan.id)
+    if scan.db.scan_locks:
+        scan.db.unlock_scan(scan.id)
 
 
-def _filter_query(l, query):
+def _index_by_id(objects):
+    """Index a list of scans, filesets or files by their id.
+
+    Parameters
+    ----------
+    objects : list or None
+        List of scans, filesets or files.
+
+    Returns
+    -------
+    dict
+        The objects indexed by their id, the first one is kept if an id is not unique.
+    """
+    index = {}
+    for obj in objects or []:
+        index.setdefault(obj.id, obj)
+    return index
+
+
+def _remove_by_id(objects, index, obj):
+    """Remove a scan, fileset or file from a list and its index.
+
+    Parameters
+    ----------
+    objects : list
+        List of scans, filesets or files.
+    index : dict
+        The objects indexed by their id, as returned by ``_index_by_id``.
+    obj : plantdb.fsdb.Scan or plantdb.fsdb.Fileset or plantdb.fsdb.File
+        The object to remove.
+    """
+    objects.remove(obj)
+    if index.get(obj.id) is obj:
+        del index[obj.id]
+        # File ids are not checked for uniqueness, index the next one with the same id, if any
+        for other in objects:
+            if other.id == obj.id:
+                index[obj.id] = other
+                break
+
+
+def _filter_query(l, query, index=None):
     """Filter a list of scans, filesets or files using a `query` on their metadata.
 
     Parameters
     ----------
     l : list
         List of scans, filesets or files to filter.
-    query : dict
-        Filtering query, metadata must have a matching `key` and `value`.
+    query : dict or plantdb.query.Query
+        Filtering query, see ``plantdb.query.compile_query``.
+    index : plantdb.query.MetadataIndex, optional
+        The index of the metadata of the objects in `l`, used to select the candidates if defined.
 
     Returns
     -------
     list
         Filtered list of scans, filesets or files.
+
+    See Also
+    --------
+    plantdb.query
     """
-    query_result = []
-    for f in l:
-        flag_add = True
-        for q in query.keys():
-            if f.get_metadata(q) is not None and f.get_metadata(q) != query[q]:
-                flag_add = False
-                break
-        if flag_add:
-            query_result.append(f)
-    return query_result
+    return compile_query(query).filter(l, index)
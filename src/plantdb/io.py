@@ -56,10 +56,11 @@ File extensions: 'jpg', 'png'
 3D Volumes
 **********
 
-* Volume data (3D numpy arrays) read and written using ``imageio``
+* Volume data (3D numpy arrays) read and written using ``imageio``, compressed in 'npz' files
+* Raw 'npy' volumes, memory-mapped when read
 
-Python objects: np.ndarray
-File extensions: 'tiff'
+Python objects: np.ndarray, np.memmap
+File extensions: 'tiff', 'npz', 'npy'
 
 Point Clouds
 ************
@@ -73,12 +74,48 @@ Triangle  Meshes
 * Python object: open3d.geometry.TriangleMesh
 * File extensions: 'ply'
 
+Codecs
+------
+
+``read`` & ``write`` select the reader and writer, the *codec*, from the extension of the file or from the ``"codec"``
+metadata of the file, set by ``write`` when the codec is not the default one for the extension.
+The heavy libraries are only imported when a file of their format is read or written.
+Other codecs can be added with ``register_codec``, possibly as ``"module:function"`` references imported on first use.
+
+>>> import numpy as np
+>>> from plantdb import io
+>>> from plantdb.fsdb import dummy_db
+>>> db = dummy_db(with_fileset=True)
+>>> db.connect()
+>>> fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+>>> io.write(fs.create_file("params"), {"threshold": 0.5}, "json")
+>>> io.read(fs.get_file("params"))
+{'threshold': 0.5}
+>>> io.write(fs.create_file("vol"), np.zeros((5, 6, 7)), "npz", codec="volume")
+>>> io.read(fs.get_file("vol")).shape
+(5, 6, 7)
+>>> db.disconnect()
+
+Local files
+-----------
+
+The files of a ``plantdb.fsdb.FSDB`` are parsed from their path or an open file object, and written with
+``File.open_write``, without temporary copies.
+The libraries only accepting a path write to the temporary file created by ``File.open_write`` in the fileset
+directory, renamed into place once written.
+For the other ``db.File`` implementations, the content is written to a temporary file when the library requires it.
+
 """
 
 import os
+import struct
 import tempfile
+from collections.abc import Mapping
+from contextlib import contextmanager
+from io import BytesIO
 
 from plantdb import fsdb
+from plantdb import jsonio
 from plantdb.db import DB
 from plantdb.db import File
 from plantdb.db import Fileset
@@ -98,8 +135,7 @@ def read_json(dbfile):
     dict
         The deserialized JSON file.
     """
-    import json
-    return json.loads(dbfile.read())
+    return jsonio.loads(dbfile.read())
 
 
 def write_json(dbfile, data, ext="json"):
@@ -114,8 +150,7 @@ def write_json(dbfile, data, ext="json"):
     ext : str, optional
         File extension, defaults to "json".
     """
-    import json
-    dbfile.write(json.dumps(data, indent=4), ext)
+    dbfile.write(jsonio.dumps(data, sort_keys=False).decode(), ext)
 
 
 def read_toml(dbfile):
@@ -187,7 +222,7 @@ def write_image(dbfile, data, ext="png"):
     dbfile.write_raw(b, ext)
 
 
-def read_volume(dbfile, ext="npz"):
+def read_volume(dbfile, ext="npz", mmap_mode="r"):
     """Reads volume from a DB file.
 
     Parameters
@@ -196,14 +231,26 @@ def read_volume(dbfile, ext="npz"):
         The `File` object used to load the associated file.
     ext : str, optional
         File extension, defaults to "npz".
+        The raw volumes, with a "npy" file extension, are always read as such.
+    mmap_mode : {"r", "c", None}, optional
+        How to memory-map the raw volumes of the local files, see ``numpy.load``.
+        ``"r"`` returns a read-only ``numpy.memmap`` (default), ``"c"`` a copy-on-write one, never saved to the file.
+        If ``None``, the volume is loaded in memory.
 
     Returns
     -------
     numpy.ndarray
         The volume array.
     """
+    if ext == "npy" or os.path.splitext(dbfile.filename or "")[1] == ".npy":
+        import numpy as np
+        path = _local_path(dbfile)
+        if path is None:
+            return np.load(BytesIO(dbfile.read_raw()), allow_pickle=False)
+        return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
     import imageio
-    return imageio.volread(dbfile.read_raw(), format=ext)
+    with _read_path(dbfile, ext) as path:
+        return imageio.volread(path, format=ext)
 
 
 def write_volume(dbfile, data, ext="npz"):
@@ -216,13 +263,14 @@ def write_volume(dbfile, data, ext="npz"):
     data : array like
         The 3D array to save as volume. 
     ext : str, optional
-        File extension, defaults to "npz".
+        File extension, defaults to "npz", a compressed volume.
+        Use "npy" to save a raw volume, memory-mapped by ``read_volume``.
 
     Examples
     --------
     >>> import numpy as np
     >>> from plantdb.fsdb import FSDB
-    >>> from plantdb.io import write_volume
+    >>> from plantdb.io import read_volume, write_volume
     >>> from plantdb.fsdb import Scan, Fileset, File
     >>> from plantdb.fsdb import dummy_db
     >>> db = dummy_db()
@@ -231,14 +279,22 @@ def write_volume(dbfile, data, ext="npz"):
     >>> fs = scan.get_fileset('volume', create=True)
     >>> f = fs.get_file('test_volume', create=True)
     >>> write_volume(f, np.random.rand(50, 10, 10))
+    >>> # Example #2: Save a raw volume, to read only the planes you need:
+    >>> f = fs.get_file('raw_volume', create=True)
+    >>> write_volume(f, np.arange(1000).reshape(10, 10, 10), 'npy')
+    >>> vol = read_volume(f)
+    >>> type(vol).__name__, vol[5, 0, :3]
+    ('memmap', memmap([500, 501, 502]))
 
     """
+    if ext == "npy":
+        import numpy as np
+        with dbfile.open_write(ext) as fh:
+            np.lib.format.write_array(fh, np.asanyarray(data), allow_pickle=False)
+        return
     import imageio
-    import numpy as np
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.npz")
-        imageio.volwrite(fname, data, format=ext)
-        dbfile.import_file(fname)
+    with _write_path(dbfile, ext) as path:
+        imageio.volwrite(path, data, format=ext)
 
 
 def read_npz(dbfile):
@@ -251,34 +307,144 @@ def read_npz(dbfile):
 
     Returns
     -------
-    numpy.ndarray
-        The uncompressed numpy array.
+    plantdb.io.NpzArchive
+        The lazy mapping of the arrays by name, reading each array from the file when accessed.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from plantdb.fsdb import dummy_db
+    >>> from plantdb.io import read_npz, write_npz
+    >>> db = dummy_db(with_fileset=True)
+    >>> db.connect()
+    >>> f = db.get_scan("myscan_001").get_fileset("fileset_001").create_file("arrays")
+    >>> write_npz(f, {"small": np.arange(3), "large": np.zeros((100, 100))}, compressed=False)
+    >>> with read_npz(f) as npz:
+    ...     print(sorted(npz), type(npz["large"]).__name__, npz["small"])
+    ['large', 'small'] memmap [0 1 2]
+    >>> db.disconnect()
+
     """
-    import numpy as np
-    b = dbfile.read_raw()
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.npz")
-        with open(fname, "wb") as fh:
-            fh.write(b)
-        return np.load(fname)
+    path = _local_path(dbfile)
+    if path is None:
+        return NpzArchive(BytesIO(dbfile.read_raw()))
+    return NpzArchive(path)
 
 
-def write_npz(dbfile, data):
+def write_npz(dbfile, data, ext="npz", compressed=True):
     """Writes npz to a DB file.
 
     Parameters
     ----------
     dbfile : db.File
         The `File` object used to write the associated file.
-    data : array like
-        A 3D array to save as volume.
+    data : dict
+        The arrays to save, by name.
+    ext : str, optional
+        File extension, defaults to "npz".
+    compressed : bool, optional
+        If ``False``, store the arrays without compression, they are then memory-mapped by ``read_npz``.
+        Defaults to ``True``.
 
     """
     import numpy as np
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.npz")
-        np.savez_compressed(fname, **data)
-        dbfile.import_file(fname)
+    with dbfile.open_write(ext) as fh:
+        if compressed:
+            np.savez_compressed(fh, **data)
+        else:
+            np.savez(fh, **data)
+
+
+class NpzArchive(Mapping):
+    """Lazy read-only mapping of the arrays of a NPZ archive, by name.
+
+    Only the requested arrays are read from the archive.
+    The arrays stored without compression in a local file are returned as read-only ``numpy.memmap``, only the pages
+    accessed are then read from the disk.
+    Like ``numpy.lib.npyio.NpzFile``, the names may be given with their ``".npy"`` suffix.
+
+    Attributes
+    ----------
+    files : list of str
+        The names of the arrays.
+    zip : zipfile.ZipFile
+        The archive.
+    """
+
+    def __init__(self, file):
+        """
+        Parameters
+        ----------
+        file : str or file-like
+            The path to the archive, or its binary file object.
+        """
+        import zipfile
+        self.path = file if isinstance(file, str) else None
+        self.zip = zipfile.ZipFile(file)
+        self._members = {(n[:-4] if n.endswith(".npy") else n): n for n in self.zip.namelist()}
+        self.files = list(self._members)
+
+    def __getitem__(self, key):
+        import zipfile
+        import numpy as np
+        if key not in self._members and str(key).endswith(".npy"):
+            key = key[:-4]
+        name = self._members[key]
+        if not name.endswith(".npy"):
+            return self.zip.read(name)
+        info = self.zip.getinfo(name)
+        if self.path is not None and info.compress_type == zipfile.ZIP_STORED:
+            array = self._memmap(info)
+            if array is not None:
+                return array
+        with self.zip.open(name) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def __contains__(self, key):
+        return key in self._members or (str(key).endswith(".npy") and key[:-4] in self._members)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the archive, the memory-mapped arrays remain valid."""
+        self.zip.close()
+
+    def _memmap(self, info):
+        """Memory-map a stored member, returns ``None`` if it cannot be mapped."""
+        import numpy as np
+        with open(self.path, "rb") as f:
+            f.seek(info.header_offset)
+            header = f.read(_ZIP_LOCAL_HEADER.size)
+            if len(header) < _ZIP_LOCAL_HEADER.size or header[:4] != b"PK\x03\x04":
+                return None
+            name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(header)[-2:]
+            f.seek(info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                return None
+            offset = f.tell()
+        if dtype.hasobject or 0 in shape:
+            return None
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                         order="F" if fortran_order else "C")
+
+
+#: ZIP local file header, see the ZIP specification
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
 
 
 def read_point_cloud(dbfile, ext="ply"):
@@ -297,12 +463,8 @@ def read_point_cloud(dbfile, ext="ply"):
         The loaded point cloud object. 
     """
     from open3d import io
-    b = dbfile.read_raw()
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        with open(fname, "wb") as fh:
-            fh.write(b)
-        return io.read_point_cloud(fname)
+    with _read_path(dbfile, ext) as path:
+        return io.read_point_cloud(path)
 
 
 def write_point_cloud(dbfile, data, ext="ply"):
@@ -318,10 +480,8 @@ def write_point_cloud(dbfile, data, ext="ply"):
         File extension, defaults to "ply".
     """
     from open3d import io
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        io.write_point_cloud(fname, data)
-        dbfile.import_file(fname)
+    with _write_path(dbfile, ext) as path:
+        io.write_point_cloud(path, data)
 
 
 def read_triangle_mesh(dbfile, ext="ply"):
@@ -340,12 +500,8 @@ def read_triangle_mesh(dbfile, ext="ply"):
         The loaded point cloud object.
     """
     from open3d import io
-    b = dbfile.read_raw()
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        with open(fname, "wb") as fh:
-            fh.write(b)
-        return io.read_triangle_mesh(fname)
+    with _read_path(dbfile, ext) as path:
+        return io.read_triangle_mesh(path)
 
 
 def write_triangle_mesh(dbfile, data, ext="ply"):
@@ -361,10 +517,8 @@ def write_triangle_mesh(dbfile, data, ext="ply"):
         File extension, defaults to "ply".
     """
     from open3d import io
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        io.write_triangle_mesh(fname, data)
-        dbfile.import_file(fname)
+    with _write_path(dbfile, ext) as path:
+        io.write_triangle_mesh(path, data)
 
 
 def read_voxel_grid(dbfile, ext="ply"):
@@ -383,12 +537,8 @@ def read_voxel_grid(dbfile, ext="ply"):
         The loaded point cloud object.
     """
     from open3d import io
-    b = dbfile.read_raw()
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        with open(fname, "wb") as fh:
-            fh.write(b)
-        return io.read_voxel_grid(fname)
+    with _read_path(dbfile, ext) as path:
+        return io.read_voxel_grid(path)
 
 
 def write_voxel_grid(dbfile, data, ext="ply"):
@@ -404,10 +554,8 @@ def write_voxel_grid(dbfile, data, ext="ply"):
         File extension, defaults to "ply".
     """
     from open3d import io
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        io.write_voxel_grid(fname, data)
-        dbfile.import_file(fname)
+    with _write_path(dbfile, ext) as path:
+        io.write_voxel_grid(path, data)
 
 
 def read_graph(dbfile, ext="p"):
@@ -426,12 +574,8 @@ def read_graph(dbfile, ext="p"):
         The loaded tree graph object.
     """
     import networkx as nx
-    b = dbfile.read_raw()
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        with open(fname, "wb") as fh:
-            fh.write(b)
-        return nx.read_gpickle(fname)
+    with dbfile.open() as fh:
+        return nx.read_gpickle(fh)
 
 
 def write_graph(dbfile, data, ext="p"):
@@ -447,10 +591,8 @@ def write_graph(dbfile, data, ext="p"):
         File extension, defaults to "p".
     """
     import networkx as nx
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        nx.write_gpickle(data, fname)
-        dbfile.import_file(fname)
+    with dbfile.open_write(ext) as fh:
+        nx.write_gpickle(data, fh)
 
 
 def read_torch(dbfile, ext="pt"):
@@ -469,12 +611,8 @@ def read_torch(dbfile, ext="pt"):
         The loaded tensor object.
     """
     import torch
-    b = dbfile.read_raw()
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        with open(fname, "wb") as fh:
-            fh.write(b)
-        return torch.load(fname)
+    with dbfile.open() as fh:
+        return torch.load(fh)
 
 
 def write_torch(dbfile, data, ext="pt"):
@@ -490,17 +628,163 @@ def write_torch(dbfile, data, ext="pt"):
         File extension, defaults to "pt".
     """
     import torch
-    with tempfile.TemporaryDirectory() as d:
-        fname = os.path.join(d, "temp.%s" % ext)
-        torch.save(data, fname)
-        dbfile.import_file(fname)
+    with dbfile.open_write(ext) as fh:
+        torch.save(data, fh)
+
+
+#: The registered codecs, name -> [reader, writer, extensions]
+_CODECS = {}
+#: Name of the codec used for each file extension
+_EXTENSIONS = {}
+
+
+def register_codec(name, reader, writer, extensions=()):
+    """Register a codec reading and writing a file format.
+
+    Parameters
+    ----------
+    name : str
+        Name of the codec, used as ``"codec"`` metadata hint.
+    reader : callable or str
+        Function called as ``reader(dbfile, ext)`` returning the object read from the ``db.File``, or its
+        ``"module:function"`` reference, imported on first use.
+    writer : callable or str
+        Function called as ``writer(dbfile, data, ext)`` writing the object to the ``db.File``, or its
+        ``"module:function"`` reference, imported on first use.
+    extensions : list of str, optional
+        The file extensions handled by default by this codec, the first one is the default extension for ``write``.
+        They replace the codecs previously registered for these extensions.
+    """
+    _CODECS[name] = [reader, writer, list(extensions)]
+    for ext in extensions:
+        _EXTENSIONS[ext.lower()] = name
+
+
+def read(dbfile, codec=None):
+    """Reads a DB file with the codec of its format.
+
+    Parameters
+    ----------
+    dbfile : db.File
+        The `File` object used to load the associated file.
+    codec : str, optional
+        Name of the codec to use.
+        By default, the ``"codec"`` metadata of the file, or the codec registered for its extension.
+
+    Returns
+    -------
+    any
+        The object read from the file.
+
+    Raises
+    ------
+    ValueError
+        If no codec is registered for the format of the file.
+    """
+    ext = os.path.splitext(dbfile.filename or "")[1][1:]
+    if codec is None:
+        codec = _codec_hint(dbfile) or _EXTENSIONS.get(ext.lower())
+    return _get_codec_function(codec, 0, dbfile)(dbfile, ext)
+
+
+def write(dbfile, data, ext=None, codec=None):
+    """Writes an object to a DB file with the codec of its format.
+
+    Parameters
+    ----------
+    dbfile : db.File
+        The `File` object used to write the associated file.
+    data : any
+        The object to write.
+    ext : str, optional
+        File extension, defaults to the first extension of `codec`.
+    codec : str, optional
+        Name of the codec to use, defaults to the one registered for `ext`.
+        If it is not the default codec for `ext`, it is saved as ``"codec"`` metadata of the file for ``read``.
+
+    Raises
+    ------
+    ValueError
+        If no codec is registered for `ext`, or neither `ext` nor `codec` are given.
+    """
+    if codec is None:
+        codec = _EXTENSIONS.get((ext or "").lower())
+    writer = _get_codec_function(codec, 1, dbfile)
+    if ext is None:
+        ext = _CODECS[codec][2][0] if _CODECS[codec][2] else ""
+    writer(dbfile, data, ext)
+    if codec != _EXTENSIONS.get(ext.lower()) or _codec_hint(dbfile) not in (None, codec):
+        dbfile.set_metadata("codec", codec)
+
+
+def _codec_hint(dbfile):
+    """Returns the ``"codec"`` metadata of the file, ``None`` if not defined."""
+    return (dbfile.get_metadata() or {}).get("codec")
+
+
+def _get_codec_function(codec, i, dbfile):
+    """Returns the reader (`i` = 0) or writer (`i` = 1) of a codec, imported and cached if given as a reference."""
+    if codec not in _CODECS:
+        raise ValueError("No codec for the file '%s', use one of %s" % (dbfile.id, ", ".join(sorted(_CODECS))))
+    func = _CODECS[codec][i]
+    if isinstance(func, str):
+        import importlib
+        module, name = func.split(":")
+        func = _CODECS[codec][i] = getattr(importlib.import_module(module), name)
+    return func
+
+
+register_codec("json", lambda dbfile, ext: read_json(dbfile), write_json, ["json"])
+register_codec("toml", lambda dbfile, ext: read_toml(dbfile), write_toml, ["toml"])
+register_codec("image", lambda dbfile, ext: read_image(dbfile), write_image, ["png", "jpg", "jpeg"])
+register_codec("volume", read_volume, write_volume, ["tiff", "tif", "npy"])
+register_codec("npz", lambda dbfile, ext: read_npz(dbfile), write_npz, ["npz"])
+register_codec("triangle_mesh", read_triangle_mesh, write_triangle_mesh, ["obj", "stl", "off"])
+register_codec("voxel_grid", read_voxel_grid, write_voxel_grid)
+register_codec("point_cloud", read_point_cloud, write_point_cloud, ["ply", "pcd", "xyz"])
+register_codec("graph", read_graph, write_graph, ["p"])
+register_codec("torch", read_torch, write_torch, ["pt"])
 
 
 def to_file(dbfile: File, path: str):
     """Helper to write a `dbfile` to a file in the filesystem. """
-    b = dbfile.read_raw()
     with open(path, "wb") as fh:
-        fh.write(b)
+        for chunk in dbfile.iter_chunks():
+            fh.write(chunk)
+
+
+def _local_path(dbfile):
+    """Returns the path of the file if it is stored on the local filesystem, else ``None``."""
+    if isinstance(dbfile, fsdb.File) and dbfile.filename is not None:
+        return dbfile.path()
+    return None
+
+
+@contextmanager
+def _read_path(dbfile, ext):
+    """Yields a local path to the content of `dbfile`, copied to a temporary file if it is not stored locally."""
+    path = _local_path(dbfile)
+    if path is not None:
+        yield path
+        return
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, "temp.%s" % ext)
+        to_file(dbfile, fname)
+        yield fname
+
+
+@contextmanager
+def _write_path(dbfile, ext):
+    """Yields a local path to write, saved to `dbfile` with extension `ext` when the context exits without error."""
+    if isinstance(dbfile, fsdb.File):
+        # The writer replaces the content of the temporary file, renamed into place by `open_write`:
+        with dbfile.open_write(ext) as fh:
+            yield fh.name
+        return
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, "temp.%s" % ext)
+        yield fname
+        dbfile.import_file(fname)
 
 
 def dbfile_from_local_file(path: str):
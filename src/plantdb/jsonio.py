@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# plantdb - Data handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of plantdb.
+#
+# plantdb is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# plantdb is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with plantdb.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+plantdb.jsonio
+==============
+
+JSON serialization of the database files: ``files.json``, metadata & measures JSON files.
+
+The serialization is made by a *backend*, the fastest one installed is used by default:
+
+* ``"orjson"``: the `orjson <https://github.com/ijl/orjson>`_ library, for the compact documents;
+* ``"json"``: the standard library ``json`` module.
+
+Other backends can be added with ``register_backend`` and selected with ``set_backend``.
+The values not supported by a backend, like non-string keys or integers larger than 64 bits for ``"orjson"``, are
+serialized by the ``"json"`` module, as are the documents it fails to parse, like the ``NaN`` values written by the
+``"json"`` module.
+Whatever the backend, the indented documents use 4 spaces and the ``NaN`` & infinite values round-trip: the
+``"orjson"`` backend leaves the documents that are indented or hold such values, that it would write as ``null``, to
+the ``"json"`` module.
+
+Examples
+--------
+>>> from plantdb import jsonio
+>>> jsonio.dumps({"b": 1, "a": [1, 2]}, indent=False)
+b'{"a":[1,2],"b":1}'
+>>> jsonio.loads(b'{"a": NaN}')
+{'a': nan}
+>>> jsonio.set_backend("json")
+>>> jsonio.dumps({"b": 1, "a": [1, 2]}, indent=False)
+b'{"a":[1,2],"b":1}'
+>>> jsonio.set_backend()  # back to the fastest backend
+
+"""
+
+import json
+import math
+
+#: The registered backends, name -> (dumps, loads)
+_BACKENDS = {}
+#: Name of the backend in use, see `set_backend`
+_backend = None
+
+
+def register_backend(name, dumps, loads):
+    """Register a JSON serialization backend.
+
+    Parameters
+    ----------
+    name : str
+        Name of the backend.
+    dumps : callable
+        Function serializing an object to UTF-8 encoded JSON ``bytes``, with the ``indent`` & ``sort_keys``
+        boolean keyword arguments.
+        It should raise a ``TypeError`` or ``ValueError`` for the values it does not support.
+    loads : callable
+        Function parsing a JSON document given as ``bytes`` or ``str``.
+        It should raise a ``ValueError`` if the document is invalid.
+    """
+    _BACKENDS[name] = (dumps, loads)
+
+
+def set_backend(name=None):
+    """Select the JSON serialization backend.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of a registered backend.
+        By default, use the fastest installed backend.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not registered.
+    """
+    global _backend
+    if name is None:
+        name = "orjson" if "orjson" in _BACKENDS else "json"
+    if name not in _BACKENDS:
+        raise ValueError("Unknown JSON backend '%s', use one of %s" % (name, ", ".join(_BACKENDS)))
+    _backend = name
+
+
+def get_backend():
+    """Returns the name of the JSON serialization backend in use."""
+    return _backend
+
+
+def dumps(data, indent=True, sort_keys=True):
+    """Serialize an object to JSON.
+
+    Parameters
+    ----------
+    data : any
+        The object to serialize.
+    indent : bool, optional
+        If ``False``, write a compact document, without spaces nor new lines.
+        Defaults to ``True``.
+    sort_keys : bool, optional
+        If ``False``, keep the order of the dictionary keys.
+        Defaults to ``True``.
+
+    Returns
+    -------
+    bytes
+        The UTF-8 encoded JSON document.
+    """
+    try:
+        return _BACKENDS[_backend][0](data, indent=indent, sort_keys=sort_keys)
+    except (TypeError, ValueError):
+        if _backend == "json":
+            raise
+        return _json_dumps(data, indent=indent, sort_keys=sort_keys)
+
+
+def loads(data):
+    """Parse a JSON document.
+
+    Parameters
+    ----------
+    data : bytes or str
+        The JSON document.
+
+    Returns
+    -------
+    any
+        The parsed object.
+
+    Raises
+    ------
+    json.JSONDecodeError
+        If the document is invalid.
+    """
+    try:
+        return _BACKENDS[_backend][1](data)
+    except ValueError:
+        if _backend == "json":
+            raise
+        return json.loads(data)
+
+
+def load(path):
+    """Parse a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the JSON file.
+
+    Returns
+    -------
+    any
+        The parsed object.
+    """
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def _json_dumps(data, indent=True, sort_keys=True):
+    if indent:
+        return json.dumps(data, sort_keys=sort_keys, indent=4, separators=(',', ': ')).encode()
+    return json.dumps(data, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+
+def _is_finite(data):
+    """Returns ``False`` if `data` holds a ``NaN`` or infinite float."""
+    if isinstance(data, float):
+        return math.isfinite(data)
+    if isinstance(data, dict):
+        data = data.values()
+    elif not isinstance(data, (list, tuple)):
+        return True
+    return all(_is_finite(value) for value in data)
+
+
+register_backend("json", _json_dumps, json.loads)
+
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    def _orjson_dumps(data, indent=True, sort_keys=True):
+        # orjson only indents with 2 spaces and writes the non-finite floats as null:
+        if indent or not _is_finite(data):
+            return _json_dumps(data, indent=indent, sort_keys=sort_keys)
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+
+    register_backend("orjson", _orjson_dumps, orjson.loads)
+
+set_backend()
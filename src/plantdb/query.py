@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# plantdb - Data handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of plantdb.
+#
+# plantdb is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# plantdb is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with plantdb.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+plantdb.query
+=============
+
+Metadata queries on lists of scans, filesets or files.
+
+A query is a dictionary of metadata keys and conditions, an object matches the query if it meets all the conditions.
+Keys may be dotted paths to nested metadata, *e.g.* ``"object.species"``.
+A metadata key containing dots is matched literally first, *e.g.* ``"a.b"`` is the value of ``{"a.b": 1}`` before the
+one of ``{"a": {"b": 1}}``.
+
+A condition is either:
+
+* a value: the metadata value should be equal to it **or not be defined**;
+* a dictionary of operators, all of them should be verified:
+
+  * ``{"$eq": value}``: the metadata value is equal to `value`;
+  * ``{"$ne": value}``: the metadata value is not equal to `value` or not defined;
+  * ``{"$gt": value}``, ``{"$gte": value}``, ``{"$lt": value}``, ``{"$lte": value}``: comparisons to `value`;
+  * ``{"$in": [values]}``: the metadata value is one of `values`;
+  * ``{"$nin": [values]}``: the metadata value is not one of `values` or not defined;
+  * ``{"$exists": bool}``: the metadata value is defined, or not;
+  * ``{"$regex": pattern}``: the metadata value is a string matching the regular expression `pattern`.
+
+Metadata set to ``None`` are considered as not defined.
+Queries are compiled once by ``compile_query`` and the equality, membership & existence conditions are served by
+the ``MetadataIndex`` when the database is indexed.
+
+Examples
+--------
+>>> from plantdb.fsdb import dummy_db
+>>> db = dummy_db(with_file=True)
+>>> db.connect(index=True)  # index the metadata to speed up the queries
+>>> fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+>>> fs.get_file("test_json").set_metadata("random image", False)
+>>> [f.id for f in fs.get_files({"random image": True})]  # 'dummy_image' does not define "random image"
+['dummy_image', 'test_image']
+>>> [f.id for f in fs.get_files({"random image": {"$eq": True}})]
+['test_image']
+>>> fs.get_file("test_image").set_metadata("camera", {"model": "RX0", "exposure": 10})
+>>> [f.id for f in fs.get_files({"camera.exposure": {"$gt": 5}})]
+['test_image']
+>>> db.disconnect()
+
+"""
+
+import json
+import re
+
+
+class MetadataIndex(object):
+    """Inverted index of the metadata of a list of scans, filesets or files.
+
+    Maps the metadata key/value pairs to the objects defining them.
+
+    Notes
+    -----
+    Metadata values set to ``None`` are considered undefined and are not indexed.
+    Unhashable values, like dictionaries or lists, are indexed using their JSON representation.
+    """
+
+    def __init__(self, objects=None):
+        """
+        Parameters
+        ----------
+        objects : list, optional
+            The scans, filesets or files to index.
+        """
+        self._values = {}  # key -> {value -> set of objects}
+        self._keys = {}  # key -> set of objects
+        for obj in objects or []:
+            self.add(obj)
+
+    def add(self, obj):
+        """Index the metadata of a scan, fileset or file.
+
+        Parameters
+        ----------
+        obj : plantdb.fsdb.Scan or plantdb.fsdb.Fileset or plantdb.fsdb.File
+            The object to index.
+        """
+        for key, value in _indexed_items(obj):
+            self._keys.setdefault(key, set()).add(obj)
+            self._values.setdefault(key, {}).setdefault(value, set()).add(obj)
+
+    def remove(self, obj):
+        """Remove a scan, fileset or file from the index.
+
+        Parameters
+        ----------
+        obj : plantdb.fsdb.Scan or plantdb.fsdb.Fileset or plantdb.fsdb.File
+            The object to remove, its metadata should not have changed since it was added.
+        """
+        for key, value in _indexed_items(obj):
+            self._keys.get(key, set()).discard(obj)
+            self._values.get(key, {}).get(value, set()).discard(obj)
+
+    def having(self, key):
+        """Get the objects defining a metadata key.
+
+        Parameters
+        ----------
+        key : str
+            The metadata key.
+
+        Returns
+        -------
+        set
+            The objects defining this key.
+        """
+        return self._keys.get(key, set())
+
+    def lookup(self, key, value):
+        """Get the objects with the given metadata value.
+
+        Parameters
+        ----------
+        key : str
+            The metadata key.
+        value : any
+            The metadata value.
+
+        Returns
+        -------
+        set
+            The objects with this metadata value.
+        """
+        return self._values.get(key, {}).get(_hashable(value), set())
+
+    def filter(self, objects, query):
+        """Filter a list of scans, filesets or files using a `query` on their metadata.
+
+        Parameters
+        ----------
+        objects : list
+            The scans, filesets or files to filter, they should all be indexed.
+        query : dict or plantdb.query.Query
+            Filtering query, see ``compile_query``.
+
+        Returns
+        -------
+        list
+            Filtered list of scans, filesets or files, in the same order as `objects`.
+        """
+        return compile_query(query).filter(objects, self)
+
+
+class Query(object):
+    """A compiled metadata query.
+
+    Attributes
+    ----------
+    conditions : list of tuple
+        The ``(key, operator, operand)`` conditions, with `key` the literal or dotted key of the metadata value.
+    """
+
+    def __init__(self, query):
+        """
+        Parameters
+        ----------
+        query : dict
+            The query to compile.
+
+        Raises
+        ------
+        ValueError
+            If an operator is unknown or mixed with metadata keys.
+        """
+        self.conditions = []
+        for key, condition in query.items():
+            key = str(key)
+            if isinstance(condition, dict) and any(str(k).startswith("$") for k in condition):
+                for op, operand in condition.items():
+                    if op not in _OPERATORS:
+                        raise ValueError("Unknown query operator '%s' for key '%s'" % (op, key))
+                    if op == "$regex":
+                        operand = re.compile(operand)
+                    elif op in ("$in", "$nin"):
+                        operand = list(operand)
+                    self.conditions.append((key, op, operand))
+            else:
+                self.conditions.append((key, None, condition))
+
+    def match(self, obj):
+        """Test if a scan, fileset or file matches the query.
+
+        Parameters
+        ----------
+        obj : plantdb.fsdb.Scan or plantdb.fsdb.Fileset or plantdb.fsdb.File
+            The object to test.
+
+        Returns
+        -------
+        bool
+            ``True`` if the object metadata meet all the conditions.
+        """
+        metadata = obj.metadata or {}
+        for key, op, operand in self.conditions:
+            if not _OPERATORS[op](_resolve(metadata, key), operand):
+                return False
+        return True
+
+    def filter(self, objects, index=None):
+        """Filter a list of scans, filesets or files.
+
+        Parameters
+        ----------
+        objects : list
+            The scans, filesets or files to filter.
+        index : plantdb.query.MetadataIndex, optional
+            The index of the metadata of `objects`, used to select the candidates if defined.
+
+        Returns
+        -------
+        list
+            Filtered list of scans, filesets or files, in the same order as `objects`.
+        """
+        if index is None:
+            return [obj for obj in objects if self.match(obj)]
+        candidates, excluded, remaining = None, set(), []
+        for condition in self.conditions:
+            key, op, operand = condition
+            if op is None:
+                excluded |= index.having(key) - index.lookup(key, operand)
+            elif op == "$eq":
+                candidates = _intersect(candidates, index.lookup(key, operand))
+            elif op == "$in":
+                candidates = _intersect(candidates, set().union(*[index.lookup(key, v) for v in operand]))
+            elif op == "$exists" and operand:
+                candidates = _intersect(candidates, index.having(key))
+            elif op == "$exists":
+                excluded |= index.having(key)
+            else:
+                remaining.append(condition)
+        result = []
+        for obj in objects:
+            if obj in excluded or (candidates is not None and obj not in candidates):
+                continue
+            metadata = obj.metadata or {}
+            if all(_OPERATORS[op](_resolve(metadata, key), operand) for key, op, operand in remaining):
+                result.append(obj)
+        return result
+
+
+def compile_query(query):
+    """Compile a metadata query.
+
+    Parameters
+    ----------
+    query : dict or plantdb.query.Query
+        The query to compile, returned as is if already compiled.
+
+    Returns
+    -------
+    plantdb.query.Query
+        The compiled query.
+
+    Examples
+    --------
+    >>> from plantdb.query import compile_query
+    >>> query = compile_query({"object.species": {"$in": ["Arabidopsis thaliana", "Solanum lycopersicum"]}})
+    >>> query.conditions
+    [('object.species', '$in', ['Arabidopsis thaliana', 'Solanum lycopersicum'])]
+
+    """
+    if isinstance(query, Query):
+        return query
+    return Query(query)
+
+
+#: Value of undefined metadata
+_MISSING = object()
+#: Tag of the JSON representations of the unhashable values in the index, see `_hashable`
+_JSON_TAG = object()
+
+
+def _resolve(metadata, key):
+    """Returns the metadata value of a key, ``_MISSING`` if not defined.
+
+    The literal key is tried first, then the dotted paths to nested metadata, splitting on the first dots first.
+    """
+    if not isinstance(metadata, dict):
+        return _MISSING
+    value = metadata.get(key)
+    if value is not None:
+        return value
+    i = key.find(".")
+    while i != -1:
+        value = _resolve(metadata.get(key[:i]), key[i + 1:])
+        if value is not _MISSING:
+            return value
+        i = key.find(".", i + 1)
+    return _MISSING
+
+
+def _compare(func):
+    """Returns a comparison operator that is ``False`` for undefined or incomparable values."""
+
+    def _op(value, operand):
+        if value is _MISSING:
+            return False
+        try:
+            return func(value, operand)
+        except TypeError:
+            return False
+
+    return _op
+
+
+_OPERATORS = {
+    None: lambda value, operand: value is _MISSING or value == operand,
+    "$eq": lambda value, operand: value is not _MISSING and value == operand,
+    "$ne": lambda value, operand: value is _MISSING or value != operand,
+    "$gt": _compare(lambda value, operand: value > operand),
+    "$gte": _compare(lambda value, operand: value >= operand),
+    "$lt": _compare(lambda value, operand: value < operand),
+    "$lte": _compare(lambda value, operand: value <= operand),
+    "$in": lambda value, operand: value is not _MISSING and value in operand,
+    "$nin": lambda value, operand: value is _MISSING or value not in operand,
+    "$exists": lambda value, operand: (value is not _MISSING) == bool(operand),
+    "$regex": lambda value, operand: isinstance(value, str) and operand.search(value) is not None,
+}
+
+
+def _intersect(candidates, objects):
+    """Returns the intersection of the candidates with the objects, the objects if there is no candidates yet."""
+    return set(objects) if candidates is None else candidates & objects
+
+
+def _indexed_items(obj):
+    """Returns the indexed metadata key/value pairs of a scan, fileset or file.
+
+    Nested dictionaries are also indexed using dotted keys.
+    The value of each key is the one matched by the queries, see ``_resolve``.
+    """
+    metadata = obj.metadata or {}
+    keys = []
+    _flatten(metadata, "", keys)
+    items = []
+    for key in dict.fromkeys(keys):
+        value = _resolve(metadata, key)
+        if value is not _MISSING:
+            items.append((key, _hashable(value)))
+    return items
+
+
+def _flatten(metadata, prefix, keys):
+    """Append the keys of the metadata to `keys`, recursively with dotted keys for nested dictionaries."""
+    for key, value in metadata.items():
+        key = prefix + str(key)
+        keys.append(key)
+        if isinstance(value, dict):
+            _flatten(value, key + ".", keys)
+
+
+def _hashable(value):
+    """Returns the value, or its tagged JSON representation if it is not hashable.
+
+    The tag keeps the representation of a list or dictionary from matching a string with the same content.
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return _JSON_TAG, json.dumps(value, sort_keys=True, default=str)
+    return value
@@ -96,7 +96,7 @@ class SSHFSDB(fsdb.FSDB):
         super().__init__(basedir)
         self.remotedir = remotedir
 
-    def connect(self, login_data=None):
+    def connect(self, login_data=None, **kwargs):
         """Connect to the remote database.
 
         Handle DB "locking" system by adding a ``LOCK_FILE_NAME`` file in the DB.
@@ -106,6 +106,11 @@ class SSHFSDB(fsdb.FSDB):
         login_data : bool
             UNUSED
 
+        Other Parameters
+        ----------------
+        kwargs
+            Keyword arguments passed to ``FSDB.connect``, *e.g.* ``lazy``.
+
         Examples
         --------
         >>> from plantdb import SSHFSDB
@@ -125,7 +130,7 @@ class SSHFSDB(fsdb.FSDB):
             print(cmd)
             p = subprocess.run(cmd)
             print("The exit code was: %d" % p.returncode)
-        super().connect()
+        super().connect(login_data, **kwargs)
 
     def disconnect(self):
         """Disconnect from the database.
@@ -26,9 +26,12 @@
 import os
 import subprocess
 
+from plantdb.db import DBBusyError
 from plantdb.fsdb import LOCK_FILE_NAME
 from plantdb.fsdb import MARKER_FILE_NAME
+from plantdb.fsdb import _acquire_lock
 from plantdb.fsdb import _is_db
+from plantdb.fsdb import _release_lock
 
 
 class FSDBSync():
@@ -135,13 +138,11 @@ def _fmt_path(path):
 
 
 def _lock_local(d):
-    path = d["path"]
     lock_path = d["lock_path"]
     try:
-        with open(lock_path, "x") as _:
-            pass
-    except FileExistsError:
-        raise IOError("Could not secure lock, %s is present in DB path." % LOCK_FILE_NAME)
+        d["lock_fd"] = _acquire_lock(lock_path)
+    except DBBusyError:
+        raise IOError("Could not secure lock, %s is locked in DB path." % LOCK_FILE_NAME)
 
 
 def _lock_remote(d):
@@ -163,7 +164,7 @@ def _lock_remote(d):
 
 def _unlock_local(d):
     lock_path = d["lock_path"]
-    os.remove(lock_path)
+    _release_lock(d.pop("lock_fd"), lock_path)
 
 
 def _unlock_remote(d):
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# plantdb - Data handling tools for the ROMI project
+#
+# Copyright (C) 2018-2019 Sony Computer Science Laboratories
+# Authors: D. Colliaux, T. Wintz, P. Hanappe
+#
+# This file is part of plantdb.
+#
+# plantdb is free software: you can redistribute it
+# and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# plantdb is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with plantdb.  If not, see
+# <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+"""
+plantdb.watch
+=============
+
+Keep a connected ``FSDB`` in sync with the changes made on disk by other processes.
+
+A ``Watcher`` thread monitors the database directory, the scan directories with their ``files.json`` &
+``measures.json`` files, and the whole ``metadata`` directory of each scan: the files checked by ``FSDB.reload``.
+The modified scans are collected until no event is received for `delay` seconds, then reloaded at once with
+``FSDB.reload``, so a burst of writes to a scan results in a single reload.
+
+On Linux, the events are received from *inotify*, else the whole database is checked every `interval` seconds.
+
+Examples
+--------
+>>> import os
+>>> import time
+>>> from plantdb.fsdb import dummy_db
+>>> db = dummy_db(with_fileset=True)
+>>> db.connect()
+>>> watcher = db.watch(delay=0.1)
+>>> os.makedirs(os.path.join(db.basedir, "myscan_002"))
+>>> with open(os.path.join(db.basedir, "myscan_002", "files.json"), "w") as f:
+...     _ = f.write('{"filesets": []}')
+>>> time.sleep(0.5)
+>>> db.list_scans()
+['myscan_001', 'myscan_002']
+>>> db.disconnect()  # also stops the watcher
+
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from plantdb.log import logger
+
+# inotify flags, see `man inotify`:
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+_DIR_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_ONLYDIR
+_EVENT = struct.Struct("iIII")
+
+#: Names of the files, in a scan directory, describing the scan. All the files of the "metadata" directory do.
+_SCAN_FILES = ("files.json", "measures.json", "metadata")
+
+
+class Watcher(object):
+    """Thread reloading the scans of a database when they are modified on disk.
+
+    Attributes
+    ----------
+    db : plantdb.fsdb.FSDB
+        The watched database.
+    delay : float
+        Time to wait without any new event before reloading the modified scans, in seconds.
+    max_delay : float
+        Maximum time to wait before reloading the modified scans, if the events keep coming, in seconds.
+    interval : float
+        Time between two checks of the whole database when *inotify* is not available, in seconds.
+    polling : bool
+        ``True`` if *inotify* is not used.
+    """
+
+    def __init__(self, db, delay=1.0, max_delay=10.0, interval=5.0, polling=None):
+        """
+        Parameters
+        ----------
+        db : plantdb.fsdb.FSDB
+            The database to watch, should be connected.
+        delay : float, optional
+            Time to wait without any new event before reloading the modified scans, in seconds.
+        max_delay : float, optional
+            Maximum time to wait before reloading the modified scans, if the events keep coming, in seconds.
+        interval : float, optional
+            Time between two checks of the whole database when *inotify* is not available, in seconds.
+        polling : bool, optional
+            If ``True``, do not use *inotify*.
+            By default, *inotify* is used when available.
+        """
+        self.db = db
+        self.delay = delay
+        self.max_delay = max_delay
+        self.interval = interval
+        self._stop = threading.Event()
+        self._inotify = None
+        if not polling:
+            try:
+                self._inotify = _Inotify()
+            except OSError as e:
+                if polling is not None:
+                    raise
+                logger.info("inotify not available (%s), polling the database every %s s" % (e, interval))
+        self.polling = self._inotify is None
+        self._thread = threading.Thread(target=self._run, name="plantdb-watcher", daemon=True)
+
+    def start(self):
+        """Start watching the database."""
+        if self._inotify is not None:
+            self._inotify.watch_db(self.db.basedir, self.db.list_scans())
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching the database and wait for the pending reload, if any."""
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _run(self):
+        if self._inotify is None:
+            while not self._stop.wait(self.interval):
+                self._reload()
+            return
+        pending, first, last = set(), None, None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if pending and (now - last >= self.delay or now - first >= self.max_delay):
+                if self._reload(pending):
+                    pending, first, last = set(), None, None
+                else:  # try again later
+                    first = last = now
+                continue
+            timeout = 0.5 if not pending else min(0.5, last + self.delay - now, first + self.max_delay - now)
+            scans = self._inotify.read(max(timeout, 0))
+            if scans:
+                last = time.monotonic()
+                first = first or last
+                pending |= scans
+
+    def _reload(self, scans=None):
+        """Reload the modified scans, all of them if `scans` contains ``None``, returns ``False`` on failure."""
+        ids = None if scans is None or None in scans else list(scans)
+        try:
+            changed = self.db.reload(ids)
+        except Exception as e:
+            logger.error("Could not reload the database '%s': %s" % (self.db.basedir, e))
+            return False
+        if changed:
+            logger.info("Reloaded the scans: %s" % ", ".join(changed))
+        return True
+
+
+class _Inotify(object):
+    """Minimal *inotify* wrapper, watching the database and scan directories."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError("inotify is not supported on this platform")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = init(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.basedir = None
+        # watch descriptor -> (scan id, depth in the scan directory: 0, 1 for "metadata" & 2 for its subdirectories,
+        # path of the directory), scan id is None for basedir:
+        self._watches = {}
+
+    def close(self):
+        os.close(self.fd)
+
+    def watch_db(self, basedir, scan_ids):
+        """Watch the database directory and the given scans."""
+        self.basedir = basedir
+        self._add(basedir, None, False)
+        for scan_id in scan_ids:
+            self._watch_scan(scan_id)
+
+    def read(self, timeout):
+        """Wait for events at most `timeout` seconds.
+
+        Returns
+        -------
+        set
+            The ids of the modified scans, ``None`` if the events were lost and all the scans should be checked.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        scans, offset = set(), 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0").decode(errors="replace")
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                scans.add(None)
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches:
+                continue
+            scan_id, depth, path = self._watches[wd]
+            if scan_id is None:
+                # Event in `basedir`: a scan directory was created, moved or deleted
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        self._watch_scan(name)
+                    scans.add(name)
+            elif mask & _IN_DELETE_SELF:
+                scans.add(scan_id)
+            elif depth > 0 or name in _SCAN_FILES:
+                if name.endswith(".tmp"):
+                    continue  # temporary file renamed into place, see `plantdb.fsdb._store_json`
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO) and depth < 2:
+                    self._watch_metadata(os.path.join(path, name), scan_id, depth + 1)
+                scans.add(scan_id)
+        return scans
+
+    def _watch_scan(self, scan_id):
+        path = os.path.join(self.basedir, scan_id)
+        self._add(path, scan_id, 0)
+        if os.path.isdir(os.path.join(path, "metadata")):
+            self._watch_metadata(os.path.join(path, "metadata"), scan_id, 1)
+
+    def _watch_metadata(self, path, scan_id, depth):
+        """Watch the "metadata" directory of a scan, or one of its subdirectories, and their subdirectories."""
+        self._add(path, scan_id, depth)
+        if depth < 2:
+            try:
+                with os.scandir(path) as it:
+                    subdirs = [entry.path for entry in it if entry.is_dir()]
+            except OSError:  # removed meanwhile
+                return
+            for subdir in subdirs:
+                self._watch_metadata(subdir, scan_id, depth + 1)
+
+    def _add(self, path, scan_id, depth):
+        wd = self._add_watch(self.fd, os.fsencode(path), _DIR_MASK)
+        if wd >= 0:
+            self._watches[wd] = (scan_id, depth, path)
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+from plantdb.chunked import ChunkedArray
+from plantdb.testing import DBTestCase
+
+
+class TestChunkedArray(DBTestCase):
+
+    def get_test_array(self, **kwargs):
+        scan = self.get_test_scan()
+        vol = np.random.rand(20, 17, 9).astype(np.float32)
+        return ChunkedArray.from_array(scan.create_fileset("volume"), vol, chunks=(8, 8, 8), **kwargs), vol
+
+    def test_read_region(self):
+        for compression in ("zlib", "lzma", "none"):
+            with self.subTest(compression=compression):
+                _, vol = self.get_test_array(compression=compression)
+                # Reload the array from the database:
+                self.db.reload()
+                arr = ChunkedArray(self.get_test_scan().get_fileset("volume"))
+                self.assertEqual((arr.shape, arr.dtype, arr.chunks), (vol.shape, vol.dtype, (8, 8, 8)))
+                np.testing.assert_array_equal(arr.read(), vol)
+                for region in [(slice(3, 12), slice(0, 17), slice(7, 9)), (5,), (slice(None), -1, 2),
+                               (slice(1, 19, 3), slice(None, None, 5)), (slice(4, 4),)]:
+                    np.testing.assert_array_equal(arr.read_region(region), vol[region])
+                self.get_test_scan().delete_fileset("volume")
+
+    def test_write_region(self):
+        arr, vol = self.get_test_array(workers=2)
+        arr[2:10, 5, :] = 7
+        vol[2:10, 5, :] = 7
+        arr.write_region((slice(15, 20),), np.ones((5, 17, 9)))
+        vol[15:20] = 1
+        np.testing.assert_array_equal(ChunkedArray(arr.fileset).read(), vol)
+        with self.assertRaises(IndexError):
+            arr[::2] = 0
+        with self.assertRaises(ValueError):
+            arr[0] = np.zeros(3)
+
+    def test_fill_value(self):
+        fs = self.get_test_scan().create_fileset("sparse")
+        arr = ChunkedArray.create(fs, (30, 30), "uint8", (10, 10), fill_value=255)
+        arr[12:14, 12:14] = 1
+        self.assertEqual(sorted(f.id for f in fs.get_files()), ["chunk_1_1", "header"])
+        expected = np.full((30, 30), 255, dtype=np.uint8)
+        expected[12:14, 12:14] = 1
+        np.testing.assert_array_equal(arr.read(), expected)
+        with self.assertRaises(ValueError):
+            ChunkedArray.create(fs, (30, 30), "uint8", (10,))
+
+    def test_create_over_array(self):
+        fs = self.get_test_scan().create_fileset("recreated")
+        arr = ChunkedArray.create(fs, (20, 20), "float32", (8, 8))
+        arr[:] = 5
+        arr = ChunkedArray.create(fs, (20, 20), "float32", (8, 8))
+        self.assertEqual(arr.read().max(), 0)
+        self.assertEqual(fs.list_files(), ["header"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,20 @@
+import glob
+import json
+import math
 import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
 import unittest
 
+from plantdb import fsdb
 from plantdb import io
+from plantdb import jsonio
+from plantdb.db import DBBusyError
+from plantdb.fsdb import CATALOG_FILE_NAME
+from plantdb.fsdb import FSDB
 from plantdb.fsdb import File
 from plantdb.fsdb import Scan
 from plantdb.fsdb import Fileset
@@ -13,6 +26,162 @@ class TestFSDB(DBTestCase):
     def test_connect(self):
         db = self.get_test_db()
 
+    def test_connect_lazy(self):
+        self.db.connect(lazy=True)
+        scan = self.db.get_scan("myscan_001")
+        self.assertFalse(scan._is_loaded)
+        self.assertEqual(scan.list_filesets(), ["fileset_001"])
+        self.assertTrue(scan._is_loaded)
+        self.assertEqual(scan.get_metadata("test"), 1)
+        fs = scan.get_fileset("fileset_001")
+        self.assertEqual(fs.get_file("test_image").get_metadata("random image"), True)
+
+    def test_connect_lazy_broken(self):
+        files_json = os.path.join(self.db.basedir, "myscan_001", "files.json")
+        with open(files_json) as f:
+            content = f.read()
+        with open(files_json, "w") as f:
+            f.write(content[:10])
+        self.db.connect(lazy=True)
+        scan = self.db.get_scan("myscan_001")
+        self.assertRaises(ValueError, scan.list_filesets)
+        # Still broken, not seen as an empty scan that could be written over the files:
+        self.assertRaises(ValueError, scan.create_fileset, "fileset_002")
+        self.assertFalse(scan._is_loaded)
+        with open(files_json) as f:
+            self.assertEqual(f.read(), content[:10])
+        with open(files_json, "w") as f:
+            f.write(content)
+        self.assertEqual(scan.list_filesets(), ["fileset_001"])
+
+    def test_connect_catalog(self):
+        db = self.db
+        db.connect(catalog=True)
+        self.assertTrue(os.path.isfile(os.path.join(db.basedir, CATALOG_FILE_NAME)))
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        f = fs.create_file("test_text")
+        f.write("hello", "txt")
+        f.set_metadata("text", True)
+        fs.delete_file("dummy_image")
+        db.disconnect()
+
+        db.connect()
+        self.assertIsNotNone(db.catalog)
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        self.assertEqual(fs.list_files(), ["test_image", "test_json", "test_text"])
+        self.assertEqual(fs.get_file("test_text").get_metadata("text"), True)
+        self.assertEqual(fs.get_file("test_text").filename, "test_text.txt")
+        # A file rewritten under the same name is stat again:
+        fs.get_file("test_text").write("hello world", "txt")
+        with db.get_scan("myscan_001").batch():
+            fs.get_file("test_json").write("{}", "json")
+        files = {f["id"]: f for f in db.catalog.get_scan("myscan_001")["filesets"][0]["files"]}
+        self.assertEqual((files["test_text"]["size"], files["test_json"]["size"]), (11, 2))
+        self.assertEqual(files["test_text"]["mtime"], os.stat(fs.get_file("test_text").path()).st_mtime)
+        db.disconnect()
+
+        # The metadata files edited without the API invalidate the catalog:
+        metadata_dir = os.path.join(db.basedir, "myscan_001", "metadata")
+        with open(os.path.join(metadata_dir, "fileset_001.json"), "w") as f:
+            json.dump({"edited": True}, f)
+        with open(os.path.join(metadata_dir, "fileset_001", "test_json.json.new"), "w") as f:
+            json.dump({"edited": True}, f)
+        os.replace(os.path.join(metadata_dir, "fileset_001", "test_json.json.new"),
+                   os.path.join(metadata_dir, "fileset_001", "test_json.json"))
+        db.connect()
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        self.assertEqual(fs.get_metadata(), {"edited": True})
+        self.assertEqual(fs.get_file("test_json").get_metadata(), {"edited": True})
+        # The fingerprint follows the writes made with the API, the scan is not reloaded:
+        fingerprint = db.catalog.get_fingerprint("myscan_001")
+        fs.set_metadata("edited", False)
+        fs.get_file("test_json").set_metadata("edited", False)
+        self.assertNotEqual(db.catalog.get_fingerprint("myscan_001"), fingerprint)
+        self.assertEqual(db.reload(), [])
+        db.disconnect()
+
+        db.connect(catalog=False)
+        self.assertIsNone(db.catalog)
+        self.assertFalse(os.path.isfile(os.path.join(db.basedir, CATALOG_FILE_NAME)))
+
+    def test_connect_read_only(self):
+        lock_path = self.db.lock_path
+        reader = FSDB(self.db.basedir)
+        reader.connect(read_only=True)
+        self.db.connect(read_only=True)
+        self.assertRaises(IOError, self.db.get_scan("myscan_001").create_fileset, "fileset_002")
+        self.assertRaises(IOError, self.db.get_scan("myscan_001").set_metadata, "test", 2)
+        self.db.disconnect()
+        self.assertTrue(os.path.exists(lock_path))
+        self.assertRaises(DBBusyError, self.db.connect)
+        reader.disconnect()
+        self.assertFalse(os.path.exists(lock_path))
+        self.db.connect()
+        self.assertRaises(DBBusyError, reader.connect, read_only=True)
+        self.db.disconnect()
+
+    def test_connect_scan_locks(self):
+        self.db.connect(scan_locks=True)
+        other = FSDB(self.db.basedir)
+        other.connect(scan_locks=True)
+        self.assertRaises(DBBusyError, FSDB(self.db.basedir).connect)
+        scan = self.db.lock_scan("myscan_001")
+        scan.set_metadata("test", 2)
+        self.assertRaises(IOError, other.get_scan("myscan_001").set_metadata, "test", 3)
+        self.assertRaises(DBBusyError, other.lock_scan, "myscan_001")
+        other.create_scan("myscan_002").create_fileset("fileset_001")
+        self.assertRaises(IOError, self.db.create_scan, "myscan_002")
+        self.db.unlock_scan("myscan_001")
+        stale = other.get_scan("myscan_001")
+        self.assertEqual(other.lock_scan("myscan_001").get_metadata("test"), 2)
+        # The scan obtained before it was reloaded cannot overwrite the changes:
+        self.assertRaises(IOError, stale.set_metadata, "test", 3)
+        self.assertRaises(IOError, stale.get_fileset("fileset_001").set_metadata, "test", 3)
+        other.disconnect()
+        self.assertEqual(self.db.lock_scan("myscan_002").list_filesets(), ["fileset_001"])
+        self.db.disconnect()
+
+    def test_connect_stale_lock(self):
+        with open(self.db.lock_path, "w") as f:
+            f.write("%s:%d" % (socket.gethostname(), os.getpid()))
+        self.assertRaises(DBBusyError, self.db.connect)
+        process = subprocess.Popen(["true"])
+        process.wait()
+        with open(self.db.lock_path, "w") as f:
+            f.write("%s:%d" % (socket.gethostname(), process.pid))
+        self.db.connect()
+        self.db.disconnect()
+        self.assertFalse(os.path.exists(self.db.lock_path))
+
+    def test_connect_legacy_lock(self):
+        # Empty lock file, as created by the older versions of plantdb:
+        open(self.db.lock_path, "x").close()
+        self.assertRaises(DBBusyError, self.db.connect)
+        self.assertRaises(DBBusyError, self.db.connect, read_only=True)
+        self.assertTrue(os.path.exists(self.db.lock_path))
+        self.db.connect(force=True)
+        self.db.disconnect()
+        self.assertFalse(os.path.exists(self.db.lock_path))
+
+    def test_connect_workers(self):
+        db = self.db
+        db.connect()
+        scan = db.get_scan("myscan_001")
+        for i in range(3):
+            fs = scan.create_fileset(f"fileset_{i + 2:03d}")
+            for j in range(20):
+                f = fs.create_file(f"file_{j:03d}")
+                f.write(str(j), "txt")
+                f.set_metadata("index", j)
+        expected = {fs.id: [(f.id, f.get_metadata("index")) for f in fs.get_files()] for fs in scan.get_filesets()}
+        db.disconnect()
+
+        db.connect(workers=4)
+        scan = db.get_scan("myscan_001")
+        self.assertEqual(list(expected), scan.list_filesets())
+        for fs in scan.get_filesets():
+            self.assertEqual(expected[fs.id], [(f.id, f.get_metadata("index")) for f in fs.get_files()])
+
     def test_get_test_scan(self):
         db = self.get_test_db()
         scan = db.get_scan("myscan_001")  # exists
@@ -42,12 +211,476 @@ class TestFSDB(DBTestCase):
         fs = scan.create_fileset("testfileset_2")
         self.assertTrue(os.path.isdir(os.path.join(scan.db.basedir, scan.id, "testfileset_2")))
 
+    def test_get_file_after_create_and_delete(self):
+        fs = self.get_test_fileset()
+        f = fs.create_file("test_text")
+        self.assertIs(fs.get_file("test_text"), f)
+        fs.delete_file("test_text")
+        self.assertIsNone(fs.get_file("test_text"))
+        self.assertEqual(fs.list_files(), ["dummy_image", "test_image", "test_json"])
+
+    def test_scan_batch(self):
+        scan = self.get_test_scan()
+        files_json = os.path.join(scan.path(), "files.json")
+        with open(files_json) as f:
+            before = f.read()
+        with scan.batch():
+            fs = scan.create_fileset("testfileset_2")
+            for i in range(5):
+                f = fs.create_file(f"file_{i}")
+                f.write(str(i), "txt")
+                f.set_metadata("index", i)
+            with open(files_json) as f:
+                self.assertEqual(f.read(), before)
+        self.assertEqual(len(fs.get_files()), 5)
+        self.db.disconnect()
+        self.db.connect()
+        fs = self.db.get_scan("myscan_001").get_fileset("testfileset_2")
+        self.assertEqual(fs.list_files(), [f"file_{i}" for i in range(5)])
+        self.assertEqual(fs.get_file("file_4").get_metadata("index"), 4)
+
+    def test_scan_batch_rollback(self):
+        scan = self.get_test_scan()
+        fs = scan.get_fileset("fileset_001")
+        with self.assertRaises(ValueError):
+            with scan.batch():
+                scan.create_fileset("testfileset_2")
+                fs.delete_file("test_image")
+                fs.get_file("test_json").set_metadata("random json", False)
+                raise ValueError("rollback")
+        self.assertEqual(scan.list_filesets(), ["fileset_001"])
+        self.assertEqual(fs.list_files(), ["dummy_image", "test_image", "test_json"])
+        self.assertTrue(os.path.exists(fs.get_file("test_image").path()))
+        self.assertEqual(fs.get_file("test_json").get_metadata("random json"), True)
+
+    def test_scan_batch_recreate(self):
+        db = self.get_test_db()
+        scan = db.get_scan("myscan_001")
+        with scan.batch():
+            fs = scan.get_fileset("fileset_001")
+            fs.delete_file("test_json")
+            fs.create_file("test_json").write('{"new": true}', "json")
+            fs.delete_file("test_image")
+            fs.create_file("test_image").write("not an image", "txt")
+            scan.delete_fileset("fileset_001")
+            scan.create_fileset("fileset_001").create_file("test_text").write("hello", "txt")
+        with db.transaction():
+            db.delete_scan("myscan_001")
+            db.create_scan("myscan_001").create_fileset("fileset_002").create_file("test_text").write("world", "txt")
+        db.disconnect()
+        db.connect()
+        scan = db.get_scan("myscan_001")
+        self.assertEqual(scan.list_filesets(), ["fileset_002"])
+        self.assertEqual(scan.get_fileset("fileset_002").get_file("test_text").read(), "world")
+        self.assertFalse(os.path.exists(os.path.join(scan.path(), "fileset_001")))
+        # A file deleted then created again in a batch keeps its new content:
+        with scan.batch():
+            fs = scan.get_fileset("fileset_002")
+            fs.delete_file("test_text")
+            fs.create_file("test_text").write("again", "txt")
+        self.assertEqual(fs.get_file("test_text").read(), "again")
+
+    def test_atomic_writes(self):
+        db, syncs = self.db, []
+        sync_files = fsdb._sync_files
+        fsdb._sync_files = lambda paths: syncs.append(list(paths)) or sync_files(paths)
+        try:
+            db.connect(fsync="batch", catalog=True)
+            scan = db.get_scan("myscan_001")
+            with scan.batch():
+                fs = scan.create_fileset("testfileset_2")
+                for i in range(5):
+                    fs.create_file(f"file_{i}").set_metadata("index", i)
+                scan.set_metadata("test", 2)
+            self.assertEqual(len(syncs), 2)  # the temporary files, then their directories
+            self.assertEqual(len(syncs[0]), 7)  # "files.json" and the metadata files
+            fs.get_file("file_0").set_metadata("index", 10)  # not flushed outside a batch
+            self.assertEqual(len(syncs), 2)
+            self.assertEqual(glob.glob(os.path.join(scan.path(), "**", "*.tmp"), recursive=True), [])
+            self.assertEqual(db.catalog.get_fingerprint(scan.id), fsdb._scan_fingerprint(scan))
+            db.disconnect()
+        finally:
+            fsdb._sync_files = sync_files
+        db.connect()
+        fs = db.get_scan("myscan_001").get_fileset("testfileset_2")
+        self.assertEqual([f.get_metadata("index") for f in fs.get_files()], [10, 1, 2, 3, 4])
+        self.assertEqual(db.get_scan("myscan_001").get_metadata("test"), 2)
+        self.assertRaises(ValueError, FSDB(db.basedir).connect, fsync="sometimes")
+
+    def test_consolidated_metadata(self):
+        db = self.db
+        db.connect(consolidated_metadata=True)
+        scan = db.get_scan("myscan_001")
+        with scan.batch():
+            fs = scan.create_fileset("testfileset_2")
+            for i in range(5):
+                f = fs.create_file(f"file_{i}")
+                f.write(str(i), "txt")
+                f.set_metadata("index", i)
+        metadata_dir = os.path.join(scan.path(), "metadata")
+        self.assertFalse(os.path.exists(os.path.join(metadata_dir, "testfileset_2")))
+        self.assertEqual(fsdb.migrate_metadata(db), 1)
+        self.assertEqual(sorted(os.listdir(metadata_dir)),
+                         ["fileset_001.files.json", "fileset_001.json", "metadata.json", "testfileset_2.files.json"])
+        db.disconnect()
+        db.connect()
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        fs.get_file("test_json").set_metadata("random json", False)  # keeps the single JSON file
+        self.assertEqual(db.get_scan("myscan_001").get_fileset("testfileset_2").get_file("file_4").get_metadata(),
+                         {"index": 4})
+        self.assertEqual(fsdb.migrate_metadata(db, consolidated=False), 2)
+        db.disconnect()
+        db.connect()
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        self.assertEqual([f.get_metadata() for f in fs.get_files()],
+                         [{"dummy image": True}, {"random image": True}, {"random json": False}])
+        self.assertFalse(os.path.exists(os.path.join(metadata_dir, "fileset_001.files.json")))
+
+    def test_compact_json(self):
+        db = self.db
+        for backend in jsonio._BACKENDS:
+            jsonio.set_backend(backend)
+            try:
+                db.connect(compact_json=True)
+                scan = db.get_scan("myscan_001")
+                scan.create_fileset(f"fileset_{backend}")
+                scan.set_metadata("backend", backend)
+                with open(os.path.join(scan.path(), "files.json")) as f:
+                    self.assertNotIn("\n", f.read())
+                with open(os.path.join(scan.path(), "metadata", "metadata.json")) as f:
+                    self.assertIn("\n", f.read())
+                db.disconnect()
+                db.connect()
+                self.assertIn(f"fileset_{backend}", db.get_scan("myscan_001").list_filesets())
+                self.assertEqual(db.get_scan("myscan_001").get_metadata("backend"), backend)
+                db.disconnect()
+                # Same indentation & non-finite floats round-trip with all the backends:
+                data = {"a": [1.5, float("nan")], "b": {"c": float("-inf")}}
+                self.assertEqual(jsonio.dumps(data), jsonio._json_dumps(data))
+                for indent in (True, False):
+                    loaded = jsonio.loads(jsonio.dumps(data, indent=indent))
+                    self.assertTrue(math.isnan(loaded["a"][1]))
+                    self.assertEqual(loaded["b"]["c"], float("-inf"))
+            finally:
+                jsonio.set_backend()
+        self.assertEqual(jsonio.loads(jsonio.dumps({1: 2 ** 70})), {"1": 2 ** 70})
+
+    def test_files_cache(self):
+        db = self.db
+        db.connect(files_cache=True)
+        scan = db.get_scan("myscan_001")
+        files_bin = os.path.join(scan.path(), "files.bin")
+        self.assertTrue(os.path.isfile(files_bin))  # created on load
+        self.assertIsNotNone(fsdb._load_files_cache(scan))
+        with scan.batch():
+            f = scan.get_fileset("fileset_001").create_file("test_text")
+            f.write("hello", "txt")
+        self.assertEqual(fsdb._load_files_cache(scan)[0]["files"][-1], ("test_text", "test_text.txt"))
+        db.disconnect()
+        db.connect()
+        self.assertEqual(db.get_scan("myscan_001").get_fileset("fileset_001").list_files(),
+                         ["dummy_image", "test_image", "test_json", "test_text"])
+        db.disconnect()
+        # Modified without the API, "files.json" is used:
+        with open(os.path.join(scan.path(), "files.json"), "w") as f:
+            json.dump({"filesets": [{"id": "fileset_001", "files": [{"id": "test_json", "file": "test_json.json"}]}]}, f)
+        self.assertIsNone(fsdb._load_files_cache(scan))
+        db.connect()
+        self.assertEqual(db.get_scan("myscan_001").get_fileset("fileset_001").list_files(), ["test_json"])
+
+    def test_connect_trust(self):
+        db = self.db
+        fs_path = os.path.join(db.basedir, "myscan_001", "fileset_001")
+        os.remove(os.path.join(fs_path, "test_json.json"))
+        db.connect(read_only=True, trust=True)
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        self.assertEqual(fs.list_files(), ["dummy_image", "test_image", "test_json"])
+        self.assertEqual(fs.get_file("dummy_image").get_metadata(), {"dummy image": True})
+        db.disconnect()
+        db.connect(read_only=True)
+        fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+        self.assertEqual(fs.list_files(), ["dummy_image", "test_image"])
+        self.assertEqual(fs.get_file("test_image").get_metadata(), {"random image": True})
+
+    def test_reload(self):
+        db = self.get_test_db()
+        scan = db.get_scan("myscan_001")
+        db.create_scan("myscan_002").create_fileset("fileset_001")
+        self.assertEqual(db.reload(), [])
+        self.assertIs(db.get_scan("myscan_001"), scan)
+        with open(os.path.join(db.basedir, "myscan_001", "metadata", "metadata.json"), "w") as f:
+            json.dump({"test": 3}, f)
+        shutil.rmtree(os.path.join(db.basedir, "myscan_002"))
+        self.assertEqual(db.reload(), ["myscan_001", "myscan_002"])
+        self.assertIsNot(db.get_scan("myscan_001"), scan)
+        self.assertEqual(db.get_scan("myscan_001").get_metadata("test"), 3)
+        self.assertEqual(db.list_scans(), ["myscan_001"])
+
+    def test_reload_broken(self):
+        db = self.get_test_db()
+        scan = db.get_scan("myscan_001")
+        for scan_id in ("myscan_001", "myscan_002", "myscan_003"):
+            os.makedirs(os.path.join(db.basedir, scan_id), exist_ok=True)
+            with open(os.path.join(db.basedir, scan_id, "files.json"), "w") as f:
+                f.write('{"filesets": [' if scan_id != "myscan_003" else '{"filesets": []}')
+        # The broken scans are left as they were, the other ones are reloaded:
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(db.reload(), ["myscan_003"])
+        self.assertIs(db.get_scan("myscan_001"), scan)
+        self.assertEqual(db.list_scans(), ["myscan_001", "myscan_003"])
+        # Not retried until modified again:
+        self.assertEqual(db.reload(), [])
+        with open(os.path.join(db.basedir, "myscan_002", "files.json"), "w") as f:
+            f.write('{"filesets": []}')
+        self.assertEqual(db.reload(), ["myscan_002"])
+
+    def test_reload_threads(self):
+        db = self.get_test_db()
+        os.makedirs(os.path.join(db.basedir, "myscan_002"))
+        with open(os.path.join(db.basedir, "myscan_002", "files.json"), "w") as f:
+            json.dump({"filesets": []}, f)
+        index_by_id, threads = fsdb._index_by_id, []
+
+        def create_while_reloading(objects):
+            # Another thread creates a scan while `reload` replaces the list of scans:
+            if not threads and objects and isinstance(objects[0], Scan):
+                threads.append(threading.Thread(target=db.create_scan, args=("myscan_003",)))
+                threads[0].start()
+                threads[0].join(0.2)
+            return index_by_id(objects)
+
+        fsdb._index_by_id = create_while_reloading
+        try:
+            self.assertEqual(db.reload(), ["myscan_002"])
+        finally:
+            fsdb._index_by_id = index_by_id
+        threads[0].join()
+        self.assertEqual(db.list_scans(), ["myscan_001", "myscan_002", "myscan_003"])
+        self.assertIsNotNone(db.get_scan("myscan_003"))
+
+    def test_watch(self):
+        db, reloads = self.db, []
+        reload = db.reload
+        db.reload = lambda ids=None: reloads.append(ids) or reload(ids)
+        for polling in (False, True):
+            db.connect()
+            db.watch(delay=0.2, polling=polling, interval=0.2)
+            scan_id = "myscan_%s" % polling
+            os.makedirs(os.path.join(db.basedir, scan_id))
+            for i in range(100):
+                with open(os.path.join(db.basedir, scan_id, "files.json"), "w") as f:
+                    json.dump({"filesets": [], "i": i}, f)
+            for _ in range(50):
+                if scan_id in db.list_scans():
+                    break
+                time.sleep(0.1)
+            self.assertIn(scan_id, db.list_scans())
+            if not polling:
+                self.assertEqual(reloads, [[scan_id]])
+            db.disconnect()
+
+    def test_watch_metadata(self):
+        db = self.get_test_db()
+        db.watch(delay=0.1, polling=False)
+        metadata_dir = os.path.join(db.basedir, "myscan_001", "metadata")
+
+        def reloaded(path, metadata):
+            # Replace a metadata file, then wait for the watcher to reload the scan:
+            with open(path + ".new", "w") as f:
+                json.dump(metadata, f)
+            os.replace(path + ".new", path)
+            for _ in range(50):
+                time.sleep(0.1)
+                fs = db.get_scan("myscan_001").get_fileset("fileset_001")
+                if metadata in (fs.get_metadata(), fs.get_file("test_json").get_metadata()):
+                    return True
+            return False
+
+        with open(os.path.join(metadata_dir, "fileset_001.json"), "w") as f:  # written in place
+            json.dump({"edited": 1}, f)
+        for _ in range(50):
+            time.sleep(0.1)
+            if db.get_scan("myscan_001").get_fileset("fileset_001").get_metadata("edited") == 1:
+                break
+        self.assertEqual(db.get_scan("myscan_001").get_fileset("fileset_001").get_metadata(), {"edited": 1})
+        self.assertTrue(reloaded(os.path.join(metadata_dir, "fileset_001.json"), {"edited": 2}))
+        self.assertTrue(reloaded(os.path.join(metadata_dir, "fileset_001", "test_json.json"), {"edited": 3}))
+        # In a directory created after the watcher started:
+        shutil.rmtree(os.path.join(metadata_dir, "fileset_001"))
+        os.makedirs(os.path.join(metadata_dir, "fileset_001"))
+        time.sleep(0.5)
+        self.assertTrue(reloaded(os.path.join(metadata_dir, "fileset_001", "test_json.json"), {"edited": 4}))
+
+    def test_transaction(self):
+        db = self.get_test_db()
+        with db.transaction():
+            scan = db.create_scan("testscan_2")
+            fs = scan.create_fileset("testfileset_2")
+            fs.create_file("test_text").write("hello", "txt")
+            db.delete_scan("myscan_001")
+            self.assertTrue(os.path.isdir(os.path.join(db.basedir, "myscan_001")))
+        self.assertFalse(os.path.isdir(os.path.join(db.basedir, "myscan_001")))
+        db.disconnect()
+        db.connect()
+        self.assertEqual(db.list_scans(), ["testscan_2"])
+
+    def test_transaction_rollback(self):
+        db = self.get_test_db()
+        other = db.create_scan("myscan_002")
+        other.set_metadata("test", 1)
+        with self.assertRaises(ValueError):
+            with db.transaction():
+                scan = db.get_scan("myscan_001")
+                scan.set_metadata("test", 2)
+                scan.get_fileset("fileset_001").delete_file("test_image")
+                # Only the modified scans are saved to be rolled back:
+                self.assertTrue(scan._batch.saved)
+                self.assertFalse(other._batch.saved)
+                raise ValueError("rollback")
+        scan = db.get_scan("myscan_001")
+        self.assertEqual(scan.get_metadata("test"), 1)
+        self.assertEqual(scan.get_fileset("fileset_001").list_files(), ["dummy_image", "test_image", "test_json"])
+        self.assertEqual(other.get_metadata("test"), 1)
+
+    def test_query_index(self):
+        self.db.connect(index=True)
+        fs = self.db.get_scan("myscan_001").get_fileset("fileset_001")
+        self.assertEqual([f.id for f in fs.get_files({"random image": True})], ["dummy_image", "test_image", "test_json"])
+        fs.get_file("test_json").set_metadata("random image", False)
+        self.assertEqual([f.id for f in fs.get_files({"random image": True})], ["dummy_image", "test_image"])
+        f = fs.create_file("test_text")
+        f.set_metadata("random image", "no")
+        self.assertEqual([f.id for f in fs.get_files({"random image": "no"})], ["dummy_image", "test_text"])
+        self.assertEqual(self.db.list_scans({"test": 2}), [])
+
+    def test_query_index_lazy(self):
+        db = self.db
+        db.connect(lazy=True, index=True)
+        os.makedirs(os.path.join(db.basedir, "myscan_002"))
+        with open(os.path.join(db.basedir, "myscan_002", "files.json"), "w") as f:
+            json.dump({"filesets": []}, f)
+        self.assertEqual(db.reload(), ["myscan_002"])
+        # The index of the scans is not built by `reload`, the scans are left unloaded:
+        self.assertFalse(db.get_scan("myscan_001")._is_loaded)
+        self.assertEqual(db.list_scans(), ["myscan_001", "myscan_002"])
+        self.assertFalse(db.get_scan("myscan_001")._is_loaded)
+        # But by the first query, that needs the metadata of all the scans:
+        self.assertEqual(db.list_scans({"test": {"$eq": 1}}), ["myscan_001"])
+        self.assertTrue(all(scan._is_loaded for scan in db.get_scans()))
+
+    def test_query_operators(self):
+        for index in (False, True):
+            self.db.connect(index=index)
+            fs = self.db.get_scan("myscan_001").get_fileset("fileset_001")
+            fs.get_file("test_image").set_metadata("camera", {"model": "RX0", "exposure": 10})
+            fs.get_file("test_json").set_metadata("camera", {"model": "RX100", "exposure": 2})
+            queries = [
+                ({"random image": {"$eq": True}}, ["test_image"]),
+                ({"camera.model": "RX0"}, ["dummy_image", "test_image"]),
+                ({"camera.exposure": {"$gt": 5}}, ["test_image"]),
+                ({"camera.model": {"$in": ["RX100", "D850"]}}, ["test_json"]),
+                ({"camera": {"$exists": False}}, ["dummy_image"]),
+                ({"camera.model": {"$regex": "^RX1"}}, ["test_json"]),
+                ({"camera.exposure": {"$gte": 2, "$lt": 10}}, ["test_json"]),
+            ]
+            for query, ids in queries:
+                self.assertEqual([f.id for f in fs.get_files(query)], ids)
+            self.assertRaises(ValueError, fs.get_files, {"camera": {"$unknown": 1}})
+            self.db.disconnect()
+
+    def test_query_dotted_keys(self):
+        results = []
+        for index in (False, True):
+            self.db.connect(index=index)
+            fs = self.db.get_scan("myscan_001").get_fileset("fileset_001")
+            fs.get_file("dummy_image").set_metadata("a.b", 1)
+            fs.get_file("test_image").set_metadata("a", {"b": 2})
+            fs.get_file("test_json").set_metadata({"a.b": 1, "a": {"b": 2}})  # the literal key is matched first
+            queries = [{"a.b": 1}, {"a.b": 2}, {"a.b": {"$eq": 2}}, {"a.b": {"$in": [1]}}, {"a.b": {"$exists": True}},
+                       {"a.b": {"$ne": 1}}]
+            results.append([[f.id for f in fs.get_files(query)] for query in queries])
+            self.db.disconnect()
+        self.assertEqual(results[0], [["dummy_image", "test_json"], ["test_image"], ["test_image"],
+                                      ["dummy_image", "test_json"], ["dummy_image", "test_image", "test_json"],
+                                      ["test_image"]])
+        self.assertEqual(results[1], results[0])
+
+    def test_query_unhashable_values(self):
+        results = []
+        for index in (False, True):
+            self.db.connect(index=index)
+            fs = self.db.get_scan("myscan_001").get_fileset("fileset_001")
+            fs.get_file("test_image").set_metadata("v", [1, 2])
+            fs.get_file("test_json").set_metadata("v", "[1, 2]")
+            queries = [{"v": [1, 2]}, {"v": "[1, 2]"}, {"v": {"$eq": [1, 2]}}, {"v": {"$in": ["[1, 2]"]}}]
+            results.append([[f.id for f in fs.get_files(query)] for query in queries])
+            self.db.disconnect()
+        # The plain values also match the files without the key, like "dummy_image":
+        self.assertEqual(results[0], [["dummy_image", "test_image"], ["dummy_image", "test_json"], ["test_image"],
+                                      ["test_json"]])
+        self.assertEqual(results[1], results[0])
+
+    def test_compact_objects(self):
+        fs = self.get_test_fileset()
+        for obj in (fs.scan, fs, fs.get_file("test_image")):
+            self.assertFalse(hasattr(obj, "__dict__"))
+        self.assertIsNone(fs.create_file("test_text").metadata)
+
+    def test_get_metadata_read_only(self):
+        scan = self.get_test_scan()
+        scan.set_metadata("object", {"species": "Arabidopsis thaliana", "ids": [1, 2]})
+        md = scan.get_metadata()
+        self.assertEqual(json.loads(json.dumps(md))["object"]["ids"], [1, 2])
+        self.assertRaises(TypeError, md.__setitem__, "test", 2)
+        self.assertRaises(TypeError, md["object"]["ids"].append, 3)
+        md = scan.get_metadata("object", copy=True)
+        md["ids"].append(3)
+        self.assertEqual(scan.get_metadata("object")["ids"], [1, 2])
+
     def test_read_text(self):
         fileset = self.get_test_fileset()
         file = fileset.get_file("test_json")
         txt = io.read_json(file)
         self.assertTrue(txt['Who you gonna call?'] == "Ghostbuster")
 
+    def test_read_streams(self):
+        fs = self.get_test_fileset()
+        f = fs.get_file("test_image")
+        data = f.read_raw()
+        with f.open() as fh:
+            self.assertEqual(fh.read(), data)
+        chunks = list(f.iter_chunks(100))
+        self.assertEqual(b"".join(chunks), data)
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        view = f.mmap()
+        self.assertEqual(bytes(view), data)
+        self.assertTrue(view.readonly)
+        view.release()
+        empty = fs.create_file("test_empty")
+        empty.write_raw(b"", "bin")
+        self.assertEqual(bytes(empty.mmap()), b"")
+
+    def test_open_write(self):
+        fs = self.get_test_fileset()
+        files_json = os.path.join(fs.scan.path(), "files.json")
+        f = fs.create_file("test_stream")
+        with f.open_write("bin") as fh:
+            for i in range(4):
+                fh.write(bytes([i]) * 1000)
+            with open(files_json) as js:
+                self.assertNotIn("test_stream.bin", js.read())
+        self.assertEqual(f.read_raw(), b"".join(bytes([i]) * 1000 for i in range(4)))
+        with open(files_json) as js:
+            self.assertIn("test_stream.bin", js.read())
+        # An error leaves the file unchanged, without temporary file:
+        with self.assertRaises(RuntimeError):
+            with f.open_write("bin") as fh:
+                fh.write(b"partial")
+                raise RuntimeError("interrupted")
+        self.assertEqual(len(f.read_raw()), 4000)
+        self.assertEqual(sorted(os.listdir(fs.path())),
+                         ['dummy_image.png', 'test_image.png', 'test_json.json', 'test_stream.bin'])
+
     def test_write_text(self):
         fs = self.get_test_fileset()
         text = "hello"
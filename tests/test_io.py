@@ -10,40 +10,18 @@ class TestIO(DBTestCase):
     """TODO : tests for all other IO...
     """
 
-    def _test_write_file(self, obj, ext):
+    def _test_write_file(self, obj, ext, codec=None):
         fs = self.get_test_fileset()
-        fname = f"test_{ext}"
+        fname = f"test_{codec or ext}"
         f = fs.create_file(fname)
-        if ext == "json":
-            io.write_json(f, obj, ext)
-        elif ext == "toml":
-            io.write_toml(f, obj, ext)
-        elif ext in ("jpg", "png"):
-            io.write_image(f, obj, ext)
-        elif ext == "npz":
-            io.write_npz(f, obj)
-        elif ext == "volume":
-            io.write_volume(f, obj)
-            ext = "npz"
-        else:
-            raise ValueError(f"Unknown extension {ext}!")
+        io.write(f, obj, ext, codec=codec)
         fpath = os.path.join(fs.scan.db.basedir, fs.scan.id, fs.id, fname + f".{ext}")
         self.assertTrue(os.path.exists(fpath), msg=f"Could not find: '{fpath}'!")
         return fpath, obj, ext
 
     def _test_read_file(self, fpath, obj, ext):
-        if ext == "json":
-            io_obj = io.read_json(fpath)
-        elif ext == "toml":
-            io_obj = io.read_toml(fpath)
-        elif ext in ("jpg", "png"):
-            io_obj = io.read_image(fpath)
-        elif ext == "volume":
-            io_obj = io.read_volume(fpath)
-        elif ext == "npz":
-            io_obj = io.read_npz(fpath)
-        else:
-            raise ValueError(f"Unknown extension {ext}!")
+        fs = self.get_test_fileset()
+        io_obj = io.read(fs.get_file(os.path.splitext(os.path.basename(fpath))[0]))
         self.assertEqual(io_obj, obj)
 
     def _test_io_file(self, obj, ext):
@@ -70,7 +48,7 @@ class TestIO(DBTestCase):
 
     def test_write_vol(self):
         vol = np.random.rand(50, 50, 200)
-        self._test_write_file(vol, 'volume')
+        self._test_write_file(vol, 'npz', codec='volume')
 
     def test_write_npz(self):
         vol = np.random.rand(50, 50, 200)
@@ -89,6 +67,75 @@ class TestIO(DBTestCase):
         self.assertEqual(img[1, 0], 0)
         self.assertEqual(img[1, 1], 255)
 
+    def test_read_volume_npz(self):
+        vol = np.random.rand(5, 6, 7)
+        self._test_write_file(vol, 'npz', codec='volume')
+        fs = self.get_test_fileset()
+        np.testing.assert_array_equal(io.read_volume(fs.get_file("test_volume")), vol)
+        self._test_write_file({'arr': vol}, 'npz')
+        np.testing.assert_array_equal(io.read_npz(fs.get_file("test_npz"))['arr'], vol)
+        # The files are written in place, without temporary files left in the fileset:
+        self.assertEqual(sorted(f for f in os.listdir(fs.path()) if f.startswith("test_")),
+                         ['test_image.png', 'test_json.json', 'test_npz.npz', 'test_volume.npz'])
+
+    def test_read_npz_lazy(self):
+        fs = self.get_test_fileset()
+        arrays = {"a": np.random.rand(4, 5), "b": np.asfortranarray(np.random.rand(3, 2)), "c": np.arange(3)}
+        for compressed in (True, False):
+            f = fs.create_file(f"test_npz_{compressed}")
+            io.write_npz(f, arrays, compressed=compressed)
+            with io.read_npz(f) as npz:
+                self.assertEqual(sorted(npz), ["a", "b", "c"])
+                for name, array in arrays.items():
+                    self.assertEqual(isinstance(npz[name], np.memmap), not compressed)
+                    np.testing.assert_array_equal(npz[name], array)
+                np.testing.assert_array_equal(npz["c.npy"], arrays["c"])
+                self.assertTrue("a" in npz and "a.npy" in npz and "d" not in npz)
+                with self.assertRaises(KeyError):
+                    npz["d"]
+
+    def test_raw_volume(self):
+        vol = np.random.rand(6, 7, 8).astype(np.float32)
+        fpath, _, _ = self._test_write_file(vol, 'npy')
+        fs = self.get_test_fileset()
+        f = fs.get_file("test_npy")
+        raw = io.read_volume(f)
+        self.assertIsInstance(raw, np.memmap)
+        self.assertFalse(raw.flags.writeable)
+        np.testing.assert_array_equal(raw[2:4], vol[2:4])
+        self.assertIsInstance(io.read(f), np.memmap)
+        loaded = io.read_volume(f, mmap_mode=None)
+        self.assertNotIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, vol)
+        # A volume rewritten in place does not change the arrays already mapped:
+        io.write_volume(f, vol + 1, "npy")
+        np.testing.assert_array_equal(raw, vol)
+        np.testing.assert_array_equal(io.read_volume(f), vol + 1)
+
+    def test_read_write_dispatch(self):
+        self._test_io_file({"test": {"json": 1}}, "json")
+        self._test_io_file({"test": {"toml": 1}}, "toml")
+        fs = self.get_test_fileset()
+        # The codec is chosen from the extension, or from the metadata hint when it is not the default one:
+        vol = np.random.rand(5, 6, 7)
+        io.write(fs.create_file("vol"), vol, "npz", codec="volume")
+        self.assertEqual(fs.get_file("vol").get_metadata("codec"), "volume")
+        np.testing.assert_array_equal(io.read(fs.get_file("vol")), vol)
+        io.write(fs.create_file("arrays"), {"a": vol}, "npz")
+        self.assertNotIn("codec", fs.get_file("arrays").get_metadata())
+        np.testing.assert_array_equal(io.read(fs.get_file("arrays"))["a"], vol)
+        with self.assertRaises(ValueError):
+            io.write(fs.create_file("unknown"), b"", "xyz123")
+        # Third-party codecs, possibly imported on first use:
+        io.register_codec("text", "plantdb.io:_read_text", lambda f, data, ext: f.write(data, ext), ["txt"])
+        try:
+            io._read_text = lambda f, ext: f.read()
+            io.write(fs.create_file("notes"), "hello", "txt")
+            self.assertEqual(io.read(fs.get_file("notes")), "hello")
+            self.assertFalse(isinstance(io._CODECS["text"][0], str))
+        finally:
+            del io._CODECS["text"], io._EXTENSIONS["txt"], io._read_text
+
 
 if __name__ == "__main__":
     unittest.main()